@@ -35,3 +35,7 @@ FEATURE_CATEGORIES = ['roisize',
 
 ZSLICE_PROJECTION_METHODS = ['maximum', 'average']
 COMPRESSION_FORMATS = ['raw', 'bz2', 'gz']
+
+# chunk layouts and compression filters of the hdf5 image datasets
+CH5_CHUNK_LAYOUTS = ['legacy', 'frame', 'tiled']
+CH5_IMAGE_COMPRESSIONS = ['default', 'gzip', 'lzf', 'none']
@@ -12,14 +12,19 @@ __copyright__ = ('The CellCognition Project'
 __licence__ = 'LGPL'
 __url__ = 'www.cellcognition.org'
 
+import multiprocessing
 from os.path import join
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 from cecog import ccore
 from cecog.analyzer.channel import PrimaryChannel
 from cecog.analyzer.channel import SecondaryChannel
 from cecog.analyzer.channel import TertiaryChannel
 from cecog.analyzer.channel import MergedChannel
+from cecog.analyzer.channel import compute_features, extract_features
 from cecog.analyzer.object import ObjectHolder
 
 from cecog.util.logger import LoggerObject
@@ -27,10 +32,68 @@ from cecog.util.util import makedirs
 from cecog.colors import hex2rgb
 
 
+class RegionFeaturePool(LoggerObject):
+    """Feature extraction of the regions (object containers) of all
+    channels of a frame in parallel.
+
+    Threads are used if ccore releases the GIL during the feature
+    calculation. Otherwise the containers are rebuilt from image and label
+    image in worker processes, unless the pool runs in a daemonic process
+    (i.e. a worker of MultiAnalyzerThread), which can't have children. In
+    that case features are computed sequentially.
+    """
+
+    def __init__(self, nworkers):
+        super(RegionFeaturePool, self).__init__()
+        self.processes = not getattr(ccore, 'FEATURES_RELEASE_GIL', False)
+
+        if not self.processes:
+            self._pool = ThreadPool(nworkers)
+        elif not multiprocessing.current_process().daemon:
+            self._pool = multiprocessing.Pool(nworkers)
+        else:
+            self.logger.warning(("ccore does not release the GIL and worker "
+                                 "processes are not possible, features are "
+                                 "computed sequentially"))
+            self._pool = None
+
+    def extract(self, channels):
+        """Compute the features of all regions of the channels. Returns
+        a dict channel name -> region name -> result of compute_features.
+        """
+        extracted = dict()
+        if self._pool is None:
+            return extracted
+
+        tasks = list()
+        for channel in channels:
+            for region_name, container in channel.containers.iteritems():
+                if container is None:
+                    continue
+                if self.processes:
+                    result = self._pool.apply_async(
+                        extract_features,
+                        channel.feature_process_args(region_name))
+                else:
+                    result = self._pool.apply_async(
+                        compute_features, channel.feature_args(region_name))
+                tasks.append((channel.NAME, region_name, result))
+
+        for name, region_name, result in tasks:
+            extracted.setdefault(name, dict())[region_name] = result.get()
+        return extracted
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
 class CellAnalyzer(LoggerObject):
 
     def __init__(self, timeholder, position, create_images, binning_factor,
-                 detect_objects):
+                 detect_objects, feature_pool=None):
         super(CellAnalyzer, self).__init__()
 
         self.timeholder = timeholder
@@ -38,9 +101,19 @@ class CellAnalyzer(LoggerObject):
         self.bCreateImages = create_images
         self.iBinningFactor = binning_factor
         self.detect_objects = detect_objects
+        # RegionFeaturePool or None
+        self.feature_pool = feature_pool
 
         self._iT = None
         self._channel_registry = OrderedDict()
+        self._computed = []
+
+    def copy(self):
+        """Return a new instance with the same parameters and an empty
+        channel registry."""
+        return type(self)(self.timeholder, self.P, self.bCreateImages,
+                          self.iBinningFactor, self.detect_objects,
+                          self.feature_pool)
 
     def initTimepoint(self, iT):
         self._channel_registry.clear()
@@ -79,33 +152,81 @@ class CellAnalyzer(LoggerObject):
 
     def process(self, apply=True, extract_features=True):
         """Perform the segmentation and feature extraction."""
+        self.compute(extract_features)
+        self.commit(apply, extract_features)
+
+    def compute(self, extract_features=True):
+        """Image processing, segmentation and feature extraction of the
+        current frame. Nothing is written to the hdf5 file, call commit()
+        afterwards. CellAnalyzer instances of different frames can run
+        compute() concurrently.
+        """
+        self._computed = []
+        timeholder = self.timeholder
         channels = sorted(self._channel_registry.values())
         primary_channel = None
+        secondary_channel = None
 
         for channel in channels:
-            self.timeholder.prepare_raw_image(channel)
+            # no raw image in a merged channel
+            raw_loaded = channel.is_virtual() or \
+                timeholder.load_raw_image(channel, self._iT)
+            if not raw_loaded:
+                timeholder.compute_raw_image(channel, self._iT)
+
+            labels_loaded = False
             if self.detect_objects:
                 if channel.NAME == PrimaryChannel.NAME:
-                    self.timeholder.apply_segmentation(channel)
+                    args = ()
                     primary_channel = channel
                 elif channel.NAME == SecondaryChannel.NAME:
-                    self.timeholder.apply_segmentation(channel, primary_channel)
+                    args = (primary_channel, )
                     secondary_channel = channel
                 elif channel.NAME == TertiaryChannel.NAME:
-                    self.timeholder.apply_segmentation(channel, primary_channel, secondary_channel)
+                    args = (primary_channel, secondary_channel)
                 elif channel.NAME == MergedChannel.NAME:
                     channel.meta_image = primary_channel.meta_image
-                    self.timeholder.apply_segmentation(channel, self._channel_registry)
+                    args = (self._channel_registry, )
                 else:
                     raise ValueError("Channel with name '%s' not supported." % channel.NAME)
 
+                labels_loaded = timeholder.load_label_images(channel, self._iT)
+                if not labels_loaded:
+                    timeholder.compute_label_images(channel, self._iT, *args)
+
+            self._computed.append((channel, raw_loaded, labels_loaded))
+
+        # regions of all channels are independent once segmented,
+        # the merged channel concatenates the features of the others
+        if self.detect_objects and extract_features:
+            extracted = dict()
+            if self.feature_pool is not None:
+                extracted = self.feature_pool.extract(
+                    [c for c in channels if not c.is_virtual()])
+            for channel in channels:
+                channel.apply_features(extracted.get(channel.NAME))
+
+    def commit(self, apply=True, extract_features=True):
+        """Write the results of compute() to the hdf5 file and add the
+        channels to the timeholder. Frames must be commited in order.
+        """
+        timeholder = self.timeholder
+        timeholder.initTimePoint(self._iT)
+
+        for channel, raw_loaded, labels_loaded in self._computed:
+            if not raw_loaded:
+                timeholder.write_raw_image(channel, self._iT)
+            if self.detect_objects:
+                if not labels_loaded:
+                    timeholder.write_label_images(channel, self._iT)
                 if extract_features:
-                    self.timeholder.apply_features(channel)
+                    timeholder.write_features(channel, self._iT)
+        self._computed = []
 
         if apply:
             # want apply also the pseudo channels
             for channel in sorted(self._channel_registry.values()):
-                self.timeholder.apply_channel(channel)
+                timeholder.apply_channel(channel)
 
     def purge(self, features=None):
         for channel in self._channel_registry.values():
@@ -375,26 +496,39 @@ class CellAnalyzer(LoggerObject):
     def classify_objects(self, predictor):
         channel = self._channel_registry[predictor.name]
         holder = channel.get_region(predictor.regions)
-        
+        nfeatures = len(holder.feature_names)
+
         try:
             signal_idx = holder.feature_names.index('n2_avg')
             roisize_idx = holder.feature_names.index('roisize')
             has_basic_features = True
         except ValueError:
             has_basic_features = False
-            
+
+        objects = []
         for label, obj in holder.iteritems():
-            if obj.aFeatures.size != len(holder.feature_names):
+            if obj.aFeatures.size != nfeatures:
                 msg = ('Incomplete feature set found (%d/%d): skipping sample '
                        'object label %s'
-                       %(obj.aFeatures.size, len(holder.feature_names), label))
+                       %(obj.aFeatures.size, nfeatures, label))
                 self.logger.warning(msg)
             else:
-                label, probs = predictor.predict(obj.aFeatures, holder.feature_names)
-                obj.iLabel = label
-                obj.dctProb = probs
-                obj.strClassName = predictor.class_names[label]
-                obj.strHexColor = predictor.hexcolors[obj.strClassName]
-                if has_basic_features:
-                    obj.roisize = obj.aFeatures[roisize_idx]
-                    obj.signal = obj.aFeatures[signal_idx]
+                objects.append(obj)
+
+        if not objects:
+            return
+
+        # all objects of the frame are classified in one go
+        if len(objects) == len(holder):
+            features = holder.feature_matrix()
+        else:
+            features = np.vstack([obj.aFeatures for obj in objects])
+        labels, probs = predictor.predict_batch(features, holder.feature_names)
+        for i, obj in enumerate(objects):
+            obj.iLabel = labels[i]
+            obj.dctProb = probs[i]
+            obj.strClassName = predictor.class_names[labels[i]]
+            obj.strHexColor = predictor.hexcolors[obj.strClassName]
+            if has_basic_features:
+                obj.roisize = features[i, roisize_idx]
+                obj.signal = features[i, signal_idx]
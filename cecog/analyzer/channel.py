@@ -17,10 +17,12 @@ __source__ = '$URL$'
 __all__ = ["PrimaryChannel", "SecondaryChannel", "TertiaryChannel"
            "MergedChannel"]
 
+import os
 from os.path import join, isdir
 import glob
 import copy
 import types
+import threading
 import numpy
 
 
@@ -30,10 +32,105 @@ from cecog.io.imagecontainer import MetaImage
 from cecog.analyzer.object import ImageObject, ObjectHolder, Orientation
 
 from cecog.util.logger import LoggerObject
+from cecog.util.stopwatch import StopWatch
 from cecog.plugin.metamanager import MetaPluginManager
 from cecog.util.ctuple import COrderedDict
 
 
+class _FlatfieldCache(object):
+    """Gain images of the flat field correction, one per background image,
+    crop and normalization range, kept for the life of the process.
+
+    Flat field correction and the linear transform to 8 bit collapse into
+    one gain image and an offset:
+
+        out = ratio*(img/bg*mean(bg) - nmin) = img*gain + offset
+    """
+
+    MAX_ENTRIES = 16
+
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def __call__(self, key, load):
+        with self._lock:
+            try:
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        # load outside the lock, concurrent loads of a key are harmless
+        entry = load()
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def gain(background, norm_min, norm_max):
+        bg = background.toArray(copy=True)
+        ratio = 255.0/(norm_max - norm_min)
+        # zero background pixels saturate as in ccore.flatfieldCorrection
+        with numpy.errstate(divide='ignore'):
+            gain = (ratio*float(bg.mean())/bg).astype(numpy.float32)
+        return gain, numpy.float32(-ratio*norm_min)
+
+    @staticmethod
+    def apply(array, gain, offset):
+        """Return the corrected 8 bit image, rounding and clipping as in
+        ccore.linearTransform2."""
+        if array.shape != gain.shape:
+            raise ValueError(("Size of the flat field correction image %s "
+                              "does not match the image size %s")
+                             %(gain.shape[::-1], array.shape[::-1]))
+        out = numpy.multiply(array, gain, dtype=numpy.float32)
+        out += offset
+        numpy.clip(out, 0, 255, out=out)
+        out += 0.5
+        return out.astype(numpy.uint8)
+
+_flatfield_cache = _FlatfieldCache()
+
+
+def compute_features(container, categories, parameters):
+    """Apply the feature categories (and haralick distances) to an object
+    container. Return the features and the orientation per object id and
+    the extraction time per feature category.
+
+    Categories of one container share the object features, but containers
+    of different regions are independent and can be processed concurrently.
+    """
+    timing = dict()
+
+    def apply(category):
+        stopwatch = StopWatch(start=True)
+        container.applyFeature(category)
+        timing[category] = timing.get(category, 0.0) + stopwatch.stop()
+
+    for category in categories:
+        apply(category)
+
+    # calculate set of haralick features (with differnt distances)
+    for category in parameters.get('haralick_categories', ()):
+        for distance in parameters['haralick_distances']:
+            container.haralick_distance = distance
+            apply(category)
+
+    features = dict((obj_id, (c_obj.getFeatures(), c_obj.orientation))
+                    for obj_id, c_obj in container.getObjects().iteritems())
+    return features, timing
+
+def extract_features(image, labels, categories, parameters):
+    """compute_features for worker processes, object containers can't be
+    pickled and are rebuilt from the image and the label image."""
+    container = ccore.ImageMaskContainer(
+        ccore.numpy_to_image(image, copy=True),
+        ccore.numpy_to_image(labels, copy=True), False, True, True)
+    return compute_features(container, categories, parameters)
+
+
 class ChannelCore(LoggerObject):
 
     NAME = None
@@ -58,7 +155,8 @@ class ChannelCore(LoggerObject):
                  fNormalizeMin="",
                  fNormalizeMax="",
                  fNormalizeRatio="",
-                 fNormalizeOffset=""):
+                 fNormalizeOffset="",
+                 preprocessed=False):
         super(ChannelCore, self).__init__()
 
         # remove all the hungarian bullshit as soon as possible!
@@ -73,6 +171,8 @@ class ChannelCore(LoggerObject):
         self.lstFeatureCategories = lstFeatureCategories
         self.dctFeatureParameters = dctFeatureParameters
         self.lstFeatureNames = lstFeatureNames
+        # extraction time per feature category (seconds)
+        self.feature_timing = dict()
         self.bFlatfieldCorrection = bFlatfieldCorrection
         self.strBackgroundImagePath = strBackgroundImagePath
         self.fBackgroundCorrection = fBackgroundCorrection
@@ -80,6 +180,8 @@ class ChannelCore(LoggerObject):
         self.fNormalizeMax = fNormalizeMax
         self.fNormalizeRatio = fNormalizeRatio
         self.fNormalizeOffset = fNormalizeOffset
+        # images are already normalized and registered (cellh5 import)
+        self.preprocessed = preprocessed
 
         self._zslices = []
         self.containers = {}
@@ -114,6 +216,17 @@ class ChannelCore(LoggerObject):
     def get_container(self, name):
         return self.containers[name]
 
+    @staticmethod
+    def zslice_selection(zslices, oZSliceOrProjection):
+        """Return the subset of zslices (all z-slices of the stack in
+        order) used by the z-slice selection or projection."""
+        zslices = list(zslices)
+        if type(oZSliceOrProjection) == types.TupleType:
+            _, zbegin, zend, zstep = oZSliceOrProjection
+            return zslices[(zbegin-1):zend:zstep]
+        else:
+            return [zslices[int(oZSliceOrProjection)-1]]
+
     def append_zslice(self, meta_image):
         self._zslices.append(meta_image)
 
@@ -153,45 +266,59 @@ class Channel(ChannelCore):
             for regionName in self.region_names():
                 region = self.get_region(regionName)
                 channelFeatures2 = [x for x in channelFeatures
-                                    if region.hasFeatureName(x)]
-                for objId in region:
-                    try:
-                        region[objId].aFeatures = region.features_by_name(
-                            objId, channelFeatures2)
-                    except KeyError:
-                        pass
-                region.feature_names = channelFeatures2
+                                    if region.has_feature(x)]
+                region.select_features(channelFeatures2)
 
     def apply_zselection(self):
+        """Select the z-slice or project the z-stack. The channel holds only
+        the z-slices used (see zslice_selection)."""
         if type(self.oZSliceOrProjection) == types.TupleType:
-            method, zbegin, zend, zstep = self.oZSliceOrProjection
-            images = [img.image for img in self._zslices][(zbegin-1):zend:zstep]
-            # single images don't carry the dtype
-            dtype = img.format
-
-            if method == "maximum":
-                method_const = ccore.ProjectionType.MaxProjection
-            elif method == "minimum":
-                method_const = ccore.ProjectionType.MinProjection
-            elif method == "average":
-                method_const = ccore.ProjectionType.MeanProjection
-
+            method = self.oZSliceOrProjection[0]
             self.logger.debug("* applying %s Z-Projection to stack of %d images..."
-                              %(method, len(images)))
-            imgprj = numpy.zeros((images[0].height, images[0].width), dtype=dtype)
-            imgprj = ccore.numpy_to_image(numpy.zeros((images[0].height, images[0].width), dtype=dtype), copy=True)
-            ccore.zproject(imgprj, images, method_const)
+                              %(method, len(self._zslices)))
+            imgprj = self._zproject(method)
 
             # overwrite the first MetaImage found with the projected image data
             meta_image = self._zslices[0]
             meta_image.set_image(imgprj)
         else:
-            self.oZSliceOrProjection = int(self.oZSliceOrProjection)
-            self.logger.debug("* selecting z-slice %d..." % self.oZSliceOrProjection)
-            meta_image = self._zslices[self.oZSliceOrProjection-1]
+            self.logger.debug("* selecting z-slice %d..."
+                              %int(self.oZSliceOrProjection))
+            meta_image = self._zslices[0]
 
         self.meta_image = copy.copy(meta_image)
 
+    def _zproject(self, method):
+        """Accumulate the projection plane by plane. Planes are released
+        after use and read again if needed."""
+        first = self._zslices[0]
+        # single images don't carry the dtype
+        dtype = first.format
+        shape = (first.image.height, first.image.width)
+
+        if method == "average":
+            # vigra.FindAverage rounds to the pixel type
+            imgsum = numpy.zeros(shape, dtype=numpy.float64)
+            for meta_image in self._zslices:
+                imgsum += meta_image.image.toArray()
+                if meta_image is not first:
+                    meta_image.clear()
+            imgsum = numpy.floor(imgsum/len(self._zslices) + 0.5)
+            return ccore.numpy_to_image(imgsum.astype(dtype), copy=True)
+
+        if method == "maximum":
+            method_const = ccore.ProjectionType.MaxProjection
+        elif method == "minimum":
+            method_const = ccore.ProjectionType.MinProjection
+
+        # zproject copies the input images, imgprj can be input and output
+        imgprj = ccore.numpy_to_image(numpy.zeros(shape, dtype=dtype), copy=True)
+        ccore.zproject(imgprj, [first.image], method_const)
+        for meta_image in self._zslices[1:]:
+            ccore.zproject(imgprj, [imgprj, meta_image.image], method_const)
+            meta_image.clear()
+        return imgprj
+
     def apply_binning(self, iFactor):
         self.meta_image.binning(iFactor)
 
@@ -205,34 +332,55 @@ class Channel(ChannelCore):
                                ccore.Diff2D(*self.new_image_size))
         self.meta_image.set_image(image)
 
-    def apply_features(self):
+    def feature_args(self, region_name):
+        """Arguments of compute_features for a region."""
+        return (self.containers[region_name], self.lstFeatureCategories,
+                self.dctFeatureParameters)
+
+    def feature_process_args(self, region_name):
+        """Arguments of extract_features (worker processes) for a region."""
+        container = self.containers[region_name]
+        return (container.img.toArray(copy=True),
+                numpy.asarray(container.img_labels.toArray(copy=True),
+                              dtype=numpy.int16),
+                self.lstFeatureCategories, self.dctFeatureParameters)
+
+    def apply_features(self, extracted=None):
+        """Build the object holders of all regions. extracted maps region
+        names to results of compute_features, e.g. computed concurrently,
+        features of the other regions are computed here."""
+        if extracted is None:
+            extracted = dict()
+
         self._features_calculated = True
         for region_name, container in self.containers.iteritems():
             object_holder = ObjectHolder(region_name)
             if not container is None:
-                for strFeatureCategory in self.lstFeatureCategories:
-                    container.applyFeature(strFeatureCategory)
+                if region_name in extracted:
+                    obj_features, timing = extracted[region_name]
+                else:
+                    obj_features, timing = compute_features(
+                        *self.feature_args(region_name))
 
-                # calculate set of haralick features
-                # (with differnt distances)
-                if 'haralick_categories' in self.dctFeatureParameters:
-                    for strHaralickCategory in self.dctFeatureParameters['haralick_categories']:
-                        for iHaralickDistance in self.dctFeatureParameters['haralick_distances']:
-                            container.haralick_distance = iHaralickDistance
-                            container.applyFeature(strHaralickCategory)
+                for category, seconds in timing.iteritems():
+                    self.feature_timing[category] = \
+                        self.feature_timing.get(category, 0.0) + seconds
 
+                features = []
                 for obj_id, c_obj in container.getObjects().iteritems():
 
+                    # incl. features computed during the segmentation,
+                    # missing in containers rebuilt by worker processes
                     dctFeatures = c_obj.getFeatures()
+                    dctFeatures.update(obj_features[obj_id][0])
+                    angle = obj_features[obj_id][1]
                     # build a new ImageObject
                     obj = ImageObject(c_obj)
                     obj.iId = obj_id
 
-                    ul = obj.oRoi.upperLeft
-                    crack = [(pos[0] + ul[0], pos[1] + ul[1])
-                             for pos in
-                             container.getCrackCoordinates(obj_id)]
-                    obj.crack_contour = crack
+                    crack = numpy.array(container.getCrackCoordinates(obj_id),
+                                        dtype=numpy.int32).reshape((-1, 2))
+                    obj.crack_contour = crack + obj.oRoi.upperLeft
 
 
                     # ORIENTATION TEST: orientation of objects (for tracking) #
@@ -240,7 +388,7 @@ class Channel(ChannelCore):
                     # The problem is that orientation cannot be a feature #
                     # but moments need to be chosen to calculate the orientation. #
                     if 'moments' in self.lstFeatureCategories:
-                        obj.orientation = Orientation(angle = c_obj.orientation,
+                        obj.orientation = Orientation(angle = angle,
                                                       eccentricity = dctFeatures['eccentricity'])
 
                     # why do wo sort the features according to their names??
@@ -248,17 +396,49 @@ class Channel(ChannelCore):
                     if self.lstFeatureNames is None:
                         self.lstFeatureNames = sorted(dctFeatures.keys())
 
-                    # assign feature values in sorted order as NumPy array
-                    features = (dctFeatures[f] for f in self.lstFeatureNames)
-                    obj.aFeatures = numpy.fromiter(features, dtype=float)
+                    # feature values in sorted order, one row per object
+                    features.append([dctFeatures[f]
+                                     for f in self.lstFeatureNames])
                     object_holder[obj_id] = obj
 
+                # aFeatures become row views of one matrix per region
+                nfeatures = len(self.lstFeatureNames or ())
+                object_holder.set_feature_matrix(numpy.array(
+                        features, dtype=float).reshape((len(features),
+                                                        nfeatures)))
+
             if self.lstFeatureNames is not None:
                 object_holder.feature_names = self.lstFeatureNames
             self._regions[region_name] = object_holder
 
 
-    def _load_flatfield_correction_image(self, plate):
+    def preprocessing_key(self, plate_id=None):
+        """Return a tuple of everything the preprocessed image (z-slice
+        selection, normalization and registration) depends on: source files
+        incl. modification times and the processing parameters. Returns None
+        if the source files are unknown.
+        """
+        sources = []
+        for meta_image in self._zslices:
+            if meta_image.image_container is None:
+                return None
+            filename, index = meta_image.image_container.get_image_source(
+                meta_image.coordinate)
+            stat = os.stat(filename)
+            sources.append((filename, index, stat.st_mtime, stat.st_size))
+
+        flatfield = None
+        if self.bFlatfieldCorrection:
+            filename = self._flatfield_correction_image_path(plate_id)
+            stat = os.stat(filename)
+            flatfield = (filename, stat.st_mtime, stat.st_size)
+
+        return (self.NAME, tuple(sources), self.oZSliceOrProjection,
+                self.fNormalizeMin, self.fNormalizeMax, flatfield,
+                MetaImage.get_crop_coordinates(), self.channelRegistration,
+                self.registration_start, self.new_image_size)
+
+    def _flatfield_correction_image_path(self, plate):
         if not isdir(str(self.strBackgroundImagePath)):
             raise IOError("No z-slice correction image directory set")
 
@@ -273,9 +453,13 @@ class Channel(ChannelCore):
         elif len(path) == 0:
             raise IOError("No z-slice flat field corr. images found. in %s\n"
                           "Directory must contain only one file per plate\n" % self.strBackgroundImagePath)
+        return path[0]
+
+    def _load_flatfield_correction_image(self, plate):
+        path = self._flatfield_correction_image_path(plate)
         try:
             # ccore need str not unicode
-            bg_image = ccore.readImageFloat(str(path[0]))
+            bg_image = ccore.readImageFloat(str(path))
         except Exception, e:
             # catching all errors, even files that are no images
             raise IOError(("Z-slice flat field correction image could not be "
@@ -284,6 +468,27 @@ class Channel(ChannelCore):
 
         return bg_image
 
+    def _flatfield_gain(self, plate_id):
+        """Return gain image and offset of the (cropped) background image
+        of the plate (see _FlatfieldCache)."""
+        crop_coordinated = MetaImage.get_crop_coordinates()
+
+        def load():
+            imgBackground = self._load_flatfield_correction_image(plate_id)
+            if crop_coordinated is not None:
+                self.logger.debug("* applying cropping to background image")
+                imgBackground = ccore.subImage(imgBackground,
+                                               ccore.Diff2D(crop_coordinated[0],
+                                                            crop_coordinated[1]),
+                                               ccore.Diff2D(crop_coordinated[2],
+                                                            crop_coordinated[3]))
+            return _flatfield_cache.gain(imgBackground, self.fNormalizeMin,
+                                         self.fNormalizeMax)
+
+        key = (plate_id, str(self.strBackgroundImagePath), crop_coordinated,
+               self.fNormalizeMin, self.fNormalizeMax)
+        return _flatfield_cache(key, load)
+
     def normalize_image(self, plate_id=None):
         try:
             import pydevd
@@ -296,20 +501,10 @@ class Channel(ChannelCore):
         if self.bFlatfieldCorrection:
             self.logger.debug("* using flat field correction with image from %s"
                               % self.strBackgroundImagePath)
-            imgBackground = self._load_flatfield_correction_image(plate_id)
-
-            crop_coordinated = MetaImage.get_crop_coordinates()
-            if crop_coordinated is not None:
-                self.logger.debug("* applying cropping to background image")
-                imgBackground = ccore.subImage(imgBackground,
-                                               ccore.Diff2D(crop_coordinated[0],
-                                                            crop_coordinated[1]),
-                                               ccore.Diff2D(crop_coordinated[2],
-                                                            crop_coordinated[3]))
-
-            img_in = ccore.flatfieldCorrection(img_in, imgBackground, 0.0, True)
-            img_out = ccore.linearTransform2(img_in, self.fNormalizeMin,
-                                             self.fNormalizeMax, 0, 255, 0, 255)
+            gain, offset = self._flatfield_gain(plate_id)
+            img_out = ccore.numpy_to_image(
+                _flatfield_cache.apply(img_in.toArray(copy=False),
+                                       gain, offset), copy=True)
         else:
             self.logger.debug("* not using flat field correction")
             if type(img_in) == ccore.UInt16Image:
@@ -414,6 +609,7 @@ class MergedChannel(ChannelCore):
         if len(removed) > 0:
             self.logger.info("Found incomplete samples in merged channel")
             self.logger.info("removed samples: %s" %",".join([str(r) for r in removed]))
+        holder.set_feature_matrix(holder.feature_matrix())
         self._regions[self.regkey] = holder
         self.lstFeatureNames = holder.feature_names
 
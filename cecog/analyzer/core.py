@@ -169,7 +169,10 @@ class AnalyzerCore(AnalyzerBase):
         y0 = self.settings.get('General', 'crop_image_y0')
         x1 = self.settings.get('General', 'crop_image_x1')
         y1 = self.settings.get('General', 'crop_image_y1')
-        if crop:
+        if crop and self._imagecontainer.preprocessed:
+            MetaImage.disable_cropping()
+            self.logger.warning("images are preprocessed, cropping disabled")
+        elif crop:
             MetaImage.enable_cropping(x0, y0, x1-x0, y1-y0)
             self.logger.info("cropping enabled with %d %d %d %d"
                              % (x0, y0, x1-x0, y1-y0))
@@ -208,7 +211,8 @@ class AnalyzerCore(AnalyzerBase):
             analyzer = PositionAnalyzer(*args_, **kw_)
             try:
                 nimages = analyzer()
-                if self.settings.get('Output', 'hdf5_create_file') and \
+                if nimages > 0 and not analyzer.is_aborted() and \
+                    self.settings.get('Output', 'hdf5_create_file') and \
                     self.settings.get('Output', 'hdf5_merge_positions'):
                     hdf5_links.append(analyzer.hdf5_filename)
             except Exception as e:
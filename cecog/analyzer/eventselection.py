@@ -86,7 +86,7 @@ class EventSelectionCore(LoggerObject):
         the corresponding feature vector.
         """
         data = []
-        nodes = np.array(self.graph.node_list(), dtype=str)
+        nodes = np.array(self.graph.node_list())
         for node in nodes:
             obj = self.graph.node_data(node)
             data.append(obj.aFeatures)
@@ -207,7 +207,8 @@ class EventSelectionCore(LoggerObject):
                         if is_candidate:
                             track_length = self.track_length
                             backward_nodes.reverse()
-                            startid = backward_nodes[0]
+                            # track ids are strings 'frame_label[_branch]'
+                            startid = Tracker.format_nodeid(backward_nodes[0])
 
                             # searching for split events and linearize split tracks
                             splits = self._split_nodes(forward_nodes)
@@ -18,9 +18,26 @@ __all__ = ["Region", "ImageObject", "ObjectHolder"]
 
 import copy
 import numpy as np
+from itertools import izip
 from collections import OrderedDict
 
-class Region(object):
+class _Slotted(object):
+    """Pickle support for classes with __slots__ (protocols < 2)."""
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for cls in type(self).__mro__
+                    for name in getattr(cls, '__slots__', ())
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+class Region(_Slotted):
+
+    __slots__ = ('upperLeft', 'lowerRight')
 
     def __init__(self, oRoi=None, tplCoords=None):
         if oRoi is not None:
@@ -33,13 +50,28 @@ class Region(object):
             self.upperLeft = None
             self.lowerRight = None
 
-class Orientation(object):
+class Orientation(_Slotted):
+
+    __slots__ = ('angle', 'eccentricity')
 
     def __init__(self, angle=np.nan, eccentricity=np.nan):
         self.angle=angle
         self.eccentricity=eccentricity
 
-class ImageObject(object):
+# shared by all objects without orientation, orientations are replaced,
+# never modified
+NO_ORIENTATION = Orientation()
+
+class ImageObject(_Slotted):
+    """Segmented object of a frame. Objects of all frames of a position are
+    kept for tracking and export, hence the instances are slotted, the
+    crack contour is stored as (n, 2) int32 array and the probability dict
+    is created on first access.
+    """
+
+    __slots__ = ('oCenterAbs', 'oRoi', 'iLabel', '_dctProb', 'strClassName',
+                 'strHexColor', 'iId', 'aFeatures', '_crack_contour', 'file',
+                 'roisize', 'signal', 'orientation')
 
     def __init__(self, oObject=None, iId=None):
         if oObject is not None:
@@ -50,17 +82,38 @@ class ImageObject(object):
             self.oRoi = None
 
         self.iLabel = None
-        self.dctProb = {}
+        self._dctProb = None
         self.strClassName = None
         self.strHexColor = None
         self.iId = iId
         self.aFeatures = None
-        self.crack_contour = None
+        self._crack_contour = None
         self.file = None
         self.roisize = None
         self.signal = None
         # ORIENTATION TEST: orientation of objects (for tracking) #
-        self.orientation = Orientation()
+        self.orientation = NO_ORIENTATION
+
+    @property
+    def dctProb(self):
+        if self._dctProb is None:
+            self._dctProb = {}
+        return self._dctProb
+
+    @dctProb.setter
+    def dctProb(self, probabilities):
+        self._dctProb = probabilities
+
+    @property
+    def crack_contour(self):
+        """Crack contour as (n, 2) array of x, y or None."""
+        return self._crack_contour
+
+    @crack_contour.setter
+    def crack_contour(self, crack):
+        if crack is not None:
+            crack = np.asarray(crack, dtype=np.int32).reshape((-1, 2))
+        self._crack_contour = crack
 
     def squaredMagnitude(self, oObj):
         x = float(oObj.oCenterAbs[0] - self.oCenterAbs[0])
@@ -83,12 +136,97 @@ class ObjectHolder(OrderedDict):
     """Container class for image objects. Provides object access by label (key),
     feature access by name and the possibility to concatenate features
     of different object with the  same label.
+
+    Features can be stored column wise (see set_feature_matrix), aFeatures
+    of the image objects are row views of one (n_objects, n_features)
+    matrix then. The columnar store is used until objects are added or
+    removed, otherwise the arrays are gathered from the image objects.
+    Replace aFeatures of single objects only via methods of the holder or
+    call set_feature_matrix afterwards.
     """
 
     def __init__(self, name):
         super(ObjectHolder, self).__init__()
         self.name = name
         self.feature_names = []
+        self._columns = None
+        # incremented whenever objects are added or removed
+        self._version = 0
+
+    def __setitem__(self, key, value):
+        super(ObjectHolder, self).__setitem__(key, value)
+        self._version += 1
+
+    def __delitem__(self, key):
+        super(ObjectHolder, self).__delitem__(key)
+        self._version += 1
+
+    def clear(self):
+        super(ObjectHolder, self).clear()
+        self._version += 1
+
+    def __reduce__(self):
+        # copies hold independent feature arrays, no columnar store
+        state = self.__dict__.copy()
+        for key in vars(OrderedDict()):
+            state.pop(key, None)
+        state['_columns'] = None
+        return (self.__class__, (self.name, ), state, None,
+                self.iteritems())
+
+    def set_feature_matrix(self, features):
+        """Store the features of all objects (in key order) as one matrix,
+        aFeatures of the objects become views of the matrix rows."""
+        features = np.ascontiguousarray(features, dtype=float)
+        if features.shape[0] != len(self):
+            raise ValueError("Feature matrix has %d rows for %d objects"
+                             %(features.shape[0], len(self)))
+        for obj, row in izip(self.itervalues(), features):
+            obj.aFeatures = row
+        self._columns = {'features': features, 'version': self._version}
+
+    def _column(self, name):
+        """Return the cached column or None if the columnar store is not
+        valid anymore (objects added or removed)."""
+        columns = self._columns
+        if columns is None:
+            return None
+        if columns['version'] != self._version:
+            self._columns = None
+            return None
+        return columns.get(name)
+
+    def _cached(self, name, gather):
+        data = self._column(name)
+        if data is None:
+            data = gather()
+            if self._columns is not None:
+                self._columns[name] = data
+        return data
+
+    def _is_complete(self, obj):
+        return obj.aFeatures is not None and \
+            obj.aFeatures.size == self.n_features
+
+    def select_features(self, feature_names):
+        """Reduce the features of all objects to feature_names. The
+        features of objects with an incomplete feature set can not be
+        reduced, these objects keep no features (see remove_incomplete)."""
+        idx = [self.feature_names.index(fn) for fn in feature_names]
+        data = self._column('features')
+        if (data is not None and data.shape[1] == self.n_features) or \
+                all(self._is_complete(obj) for obj in self.itervalues()):
+            features = self.feature_matrix()[:, idx]
+            self.feature_names = list(feature_names)
+            self.set_feature_matrix(features)
+        else:
+            for obj in self.itervalues():
+                if self._is_complete(obj):
+                    obj.aFeatures = obj.aFeatures[idx]
+                else:
+                    obj.aFeatures = np.empty(0, dtype=float)
+            self.feature_names = list(feature_names)
+            self._columns = None
 
     def has_feature(self, name):
         return name in self.feature_names
@@ -109,6 +247,48 @@ class ObjectHolder(OrderedDict):
         idx = [self.feature_names.index(fn) for fn in feature_names]
         return self[label].aFeatures[idx]
 
+    @property
+    def labels(self):
+        """Return the object labels as integer array."""
+        return self._cached('labels', lambda: np.fromiter(
+                self.iterkeys(), dtype=int, count=len(self)))
+
+    def centers(self):
+        """Return the object centers as (n_objects, 2) array of x, y."""
+        centers = [obj.oCenterAbs for obj in self.itervalues()]
+        return np.array(centers, dtype=int).reshape((-1, 2))
+
+    def bounding_boxes(self):
+        """Return the bounding boxes as (n_objects, 4) array of
+        left, right, top, bottom.
+        """
+        bbox = [(obj.oRoi.upperLeft[0], obj.oRoi.lowerRight[0],
+                 obj.oRoi.upperLeft[1], obj.oRoi.lowerRight[1])
+                for obj in self.itervalues()]
+        return np.array(bbox, dtype=int).reshape((-1, 4))
+
+    def orientations(self):
+        """Return angle and eccentricity as (n_objects, 2) array."""
+        orientations = [(obj.orientation.angle,
+                         obj.orientation.eccentricity)
+                        for obj in self.itervalues()]
+        return np.array(orientations, dtype=float).reshape((-1, 2))
+
+    def feature_matrix(self):
+        """Return the features of all objects as (n_objects, n_features)
+        array. Rows of objects with an incomplete feature set are zero.
+        The matrix of the columnar store is returned without copy.
+        """
+        data = self._column('features')
+        if data is not None and data.shape[1] == self.n_features:
+            return data
+
+        data = np.zeros((len(self), self.n_features), dtype=float)
+        for i, obj in enumerate(self.itervalues()):
+            if self._is_complete(obj):
+                data[i] = obj.aFeatures
+        return data
+
     def copy_samples(self, holder, feature_names):
         """Deepcopy image objects from one holder to self. Feature names must be
         provides separatly.
@@ -135,6 +315,8 @@ class ObjectHolder(OrderedDict):
         the image object, it's added automatically.
         """
         self.feature_names.extend(feature_names)
+        # aFeatures are replaced
+        self._columns = None
 
         for label, sample in holder.iteritems():
             if self.has_key(label):
@@ -15,17 +15,20 @@ __revision__ = '$Rev$'
 __source__ = '$URL$'
 
 import os
+import re
 import shutil
 import numpy as np
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
 from os.path import join, basename, isdir
 
 from cecog.io.imagecontainer import Coordinate
+from cecog.io.imagecache import ImageCache
 from cecog.plugin.metamanager import MetaPluginManager
 from cecog.units.time import TimeConverter
 
 from cecog.analyzer.timeholder import TimeHolder
-from cecog.analyzer.analyzer import CellAnalyzer
+from cecog.analyzer.analyzer import CellAnalyzer, RegionFeaturePool
 from cecog.analyzer.tracker import Tracker
 from cecog.analyzer.eventselection import EventSelection
 from cecog.analyzer.eventselection import UnsupervisedEventSelection
@@ -63,6 +66,42 @@ FEATURE_MAP = {'featurecategory_intensity': ['normbase', 'normbase2'],
                'featurecategory_distance': ['distance'],
                'featurecategory_moments': ['moments']}
 
+# feature names -> feature categories of the c++ container, any of the
+# categories provides the feature (categories compute their dependencies,
+# e.g. moments include axes). First match wins, haralick feature names
+# contain the distance e.g. h4_2ASM
+FEATURE_NAME_CATEGORIES = (
+    (re.compile(r'^h(\d+)_2'), ('haralick2', )),
+    (re.compile(r'^h(\d+)_'), ('haralick', )),
+    (re.compile(r'^n2_'), ('normbase2', )),
+    (re.compile(r'^n_'), ('normbase', )),
+    (re.compile(r'^ls\d+_'), ('levelset', )),
+    (re.compile(r'^granu_'), ('granulometry', )),
+    (re.compile(r'^ch_'), ('convexhull', )),
+    (re.compile(r'^dyn_distance'), ('distance', )),
+    (re.compile(r'^dyn_'), ('dynamics', )),
+    (re.compile(r'^roisize$'), ('roisize', )),
+    (re.compile(r'^circularity$'), ('circularity', )),
+    (re.compile(r'^irregularity$'), ('irregularity', )),
+    (re.compile(r'^irregularity2$'), ('irregularity2', )),
+    (re.compile(r'^perimeter$'), ('circularity', 'convexhull')),
+    (re.compile(r'^dist_(?:max|min|ratio)$'),
+     ('axes', 'moments', 'irregularity')),
+    (re.compile(r'^(?:eccentricity|gyration_r|moment_I|ellip_'
+                r'|princ_gyration_|skewness_)'), ('moments', )))
+
+
+def feature_categories(feature_name):
+    """Return the feature categories providing feature_name and the
+    haralick distance (or None). Categories are None for unknown names.
+    """
+    for pattern, categories in FEATURE_NAME_CATEGORIES:
+        match = pattern.match(feature_name)
+        if match is not None:
+            distance = int(match.group(1)) if pattern.groups else None
+            return categories, distance
+    return None, None
+
 
 class PositionCore(LoggerObject):
 
@@ -93,6 +132,8 @@ class PositionCore(LoggerObject):
         self._out_dir = out_dir
         self.settings = settings
         self._imagecontainer = image_container
+        self._imagecontainer.set_memmap_tiff(
+            settings('Processing', 'memmap_tiff'))
         self.plate_id = plate_id
         self.position = position
 
@@ -107,6 +148,8 @@ class PositionCore(LoggerObject):
 
         self._qthread = qthread
         self._tes = None
+        # feature names per processing channel, None means all features
+        self._required_features = None
 
     def _analyze(self):
         self._info.update({'stage': 2,
@@ -118,6 +161,9 @@ class PositionCore(LoggerObject):
     def zslice_par(self, ch_name):
         """Returns either the number of the zslice to select or a tuple of
         parmeters to control the zslice projcetion"""
+        if self._imagecontainer.preprocessed:
+            # single z-slice
+            return 1
         self.settings.set_section('ObjectDetection')
         if self.settings.get2(self._resolve_name(ch_name, 'zslice_selection')):
             par = self.settings.get2(self._resolve_name(
@@ -138,6 +184,11 @@ class PositionCore(LoggerObject):
     def registration_shift(self):
         # compute values for the registration of multiple channels
         # (translation only)
+        if self._imagecontainer.preprocessed:
+            # images are registered already
+            self.meta_data.real_image_width = self.meta_data.dim_x
+            self.meta_data.real_image_height = self.meta_data.dim_y
+            return (0, 0), (self.meta_data.dim_x, self.meta_data.dim_y)
         self.settings.set_section('ObjectDetection')
         xs = [0]
         ys = [0]
@@ -177,7 +228,7 @@ class PositionCore(LoggerObject):
         # relative start point of registered image
         return (max(xs), max(ys)), image_size
 
-    def feature_params(self, ch_name):
+    def feature_params(self, ch_name, select=True):
 
         # XXX unify list and dict
         f_categories = list()
@@ -204,8 +255,44 @@ class PositionCore(LoggerObject):
         if f_cat_params.has_key("haralick_categories"):
             f_cat_params['haralick_distances'] = (1, 2, 4, 8)
 
+        if select:
+            return self.select_categories(ch_name, f_categories, f_cat_params)
         return f_categories, f_cat_params
 
+    def select_categories(self, ch_name, f_categories, f_cat_params):
+        """Reduce feature categories and haralick distances to the ones
+        providing the required features of the channel."""
+        if self._required_features is None or \
+                self._required_features.get(ch_name) is None:
+            return f_categories, f_cat_params
+
+        lookup = [feature_categories(name)
+                  for name in self._required_features[ch_name]]
+        # unknown feature names, can't tell which categories are needed
+        if any(providers is None for providers, _ in lookup):
+            return f_categories, f_cat_params
+
+        haralick = f_cat_params.get('haralick_categories', [])
+        enabled = set(f_categories + haralick)
+        categories = set()
+        distances = set()
+        # features with a single provider first, others might be covered
+        for providers, distance in sorted(lookup, key=lambda l: len(l[0])):
+            providers = [p for p in providers if p in enabled]
+            if providers and categories.isdisjoint(providers):
+                categories.add(providers[0])
+            if distance is not None:
+                distances.add(distance)
+
+        params = dict()
+        haralick = [c for c in haralick if c in categories]
+        distances = [d for d in f_cat_params.get('haralick_distances', ())
+                     if d in distances]
+        if haralick and distances:
+            params['haralick_categories'] = haralick
+            params['haralick_distances'] = tuple(distances)
+        return [c for c in f_categories if c in categories], params
+
     def setup_channel(self, proc_channel, col_channel, zslice_images):
 
         # determine the list of features to be calculated from each object
@@ -214,8 +301,12 @@ class PositionCore(LoggerObject):
         ch_cls = self.CHANNELS[proc_channel.lower()]
 
         # default value is (0, 0)
-        channel_registration = (self.settings.get2('%s_channelregistration_x' %proc_channel),
-                                self.settings.get2('%s_channelregistration_y' %proc_channel))
+        preprocessed = self._imagecontainer.preprocessed
+        if preprocessed:
+            channel_registration = (0, 0)
+        else:
+            channel_registration = (self.settings.get2('%s_channelregistration_x' %proc_channel),
+                                    self.settings.get2('%s_channelregistration_y' %proc_channel))
         channel = ch_cls(strChannelId=col_channel,
                          oZSliceOrProjection = self.zslice_par(proc_channel),
                          channelRegistration = channel_registration,
@@ -226,12 +317,18 @@ class PositionCore(LoggerObject):
                          bFlatfieldCorrection = self.settings.get2('%s_flat_field_correction' %proc_channel),
                          strBackgroundImagePath = self.settings.get2('%s_flat_field_correction_image_dir' %proc_channel),
                          lstFeatureCategories = f_cats,
-                         dctFeatureParameters = f_params)
+                         dctFeatureParameters = f_params,
+                         preprocessed = preprocessed)
 
         if channel.is_virtual():
             channel.merge_regions = self._channel_regions(proc_channel)
 
-        # loop over the z-slices
+        # loop over the z-slices, the channel holds only the z-slices used
+        if not channel.is_virtual():
+            zslices = channel.zslice_selection(self.meta_data.zslices,
+                                               channel.oZSliceOrProjection)
+            zslice_images = [meta_image for meta_image in zslice_images
+                             if meta_image.coordinate.zslice in zslices]
         for meta_image in zslice_images:
             channel.append_zslice(meta_image)
         return channel
@@ -260,7 +357,12 @@ class PositionCore(LoggerObject):
                   "hdf5_include_label_images": self.settings.get2('hdf5_include_label_images'),
                   "hdf5_include_features": self.settings.get2('hdf5_include_features'),
                   "hdf5_include_crack": self.settings.get2('hdf5_include_crack'),
-                  "hdf5_include_classification": self.settings.get2('hdf5_include_classification')}
+                  "hdf5_include_classification": self.settings.get2('hdf5_include_classification'),
+                  "hdf5_write_buffer": self.settings.get2('hdf5_write_buffer')*2**20,
+                  "hdf5_raw_images_chunks": self.settings.get2('hdf5_raw_images_chunks'),
+                  "hdf5_raw_images_compression": self.settings.get2('hdf5_raw_images_compression'),
+                  "hdf5_label_images_chunks": self.settings.get2('hdf5_label_images_chunks'),
+                  "hdf5_label_images_compression": self.settings.get2('hdf5_label_images_compression')}
 
         # Processing overwrites Output
         if not self.settings.get('Processing', 'tracking'):
@@ -268,6 +370,49 @@ class PositionCore(LoggerObject):
             h5opts["hdf5_include_events"] = False
         return h5opts
 
+    @property
+    def _image_cache(self):
+        """Persistent cache of preprocessed images or None."""
+        if not self.settings('Output', 'image_cache'):
+            return None
+        path = self.settings('Output', 'image_cache_dir')
+        if not path:
+            path = join(self._out_dir, 'cache')
+        return ImageCache(path, self.settings('Output', 'image_cache_size')*2**20)
+
+    def _zslices(self):
+        """Return the z-slices used by any of the processing channels."""
+        zslices = set()
+        for ch_name in self.processing_channels:
+            ch_cls = self.CHANNELS[ch_name.lower()]
+            if ch_cls.is_virtual():
+                continue
+            zslices.update(ch_cls.zslice_selection(self.meta_data.zslices,
+                                                   self.zslice_par(ch_name)))
+        return sorted(zslices)
+
+    def _iter_frames(self, coordinate):
+        """Iterate over (frame, channels) and the z-slices used, images of
+        the next frames are read ahead in a thread pool. Images served from
+        the hdf5 file (reuse) or the image cache are not read ahead."""
+        coordinate = coordinate.copy()
+        coordinate.zslice = self._zslices()
+        prefetch = self.settings('Processing', 'prefetch_frames')
+        if self.settings('Output', 'image_cache'):
+            # cache hits are known only per channel (preprocessing_key)
+            prefetch = 0
+
+        skip = None
+        if self.timeholder is not None:
+            skip = [(self.position, frame)
+                    for frame in self.timeholder.reused_frames()]
+
+        return self._imagecontainer(
+            coordinate, interrupt_channel=True, interrupt_zslice=True,
+            prefetch=prefetch,
+            prefetch_bytes=self.settings('Processing', 'prefetch_memory')*2**20,
+            prefetch_skip=skip)
+
 
     # FIXME the following functions do moreless the same!
     def _resolve_name(self, channel, name):
@@ -359,6 +504,7 @@ class PositionPicker(PositionCore):
                                      self.meta_data, self.settings,
                                      self._frames,
                                      self.plate_id,
+                                     image_cache=self._image_cache,
                                      **self._hdf_options)
 
         ca = CellAnalyzer(timeholder=self.timeholder,
@@ -376,8 +522,7 @@ class PositionPicker(PositionCore):
         crd = Coordinate(self.plate_id, self.position,
                          self._frames, list(set(self.ch_mapping.values())))
 
-        for frame, channels in self._imagecontainer( \
-            crd, interrupt_channel=True, interrupt_zslice=True):
+        for frame, channels in self._iter_frames(crd):
             if self.is_aborted():
                 return 0
             else:
@@ -571,6 +716,68 @@ class PositionAnalyzer(PositionCore):
 
         return features
 
+    def required_features(self):
+        """Return the names of the features needed for export,
+        classification and the hdf5 file per processing channel. None means
+        all features (of a channel)."""
+        hdf5 = self.settings('Output', 'hdf5_create_file')
+        # merged channel concatenates all features of the channels
+        if (hdf5 and self.settings('Output', 'hdf5_include_features')) or \
+                self.MERGED_CHANNEL in self.processing_channels:
+            return None
+
+        required = dict()
+        for ch_name in self.processing_channels:
+            names = set()
+            for feature_names in self.export_features[ch_name].itervalues():
+                if feature_names is None:
+                    names = None
+                    break
+                names.update(feature_names)
+            required[ch_name] = names
+
+        for ch_name, clf in self.classifiers.iteritems():
+            if required[ch_name] is None:
+                continue
+            elif isinstance(clf, ClassDefinitionUnsup) or \
+                    clf.feature_names is None:
+                required[ch_name] = None
+            else:
+                required[ch_name].update(clf.feature_names)
+                # signal and size of classified objects
+                required[ch_name].update(('n2_avg', 'roisize'))
+
+        # orientation (from moments) is always saved in the hdf5 file
+        if hdf5:
+            for names in required.itervalues():
+                if names is not None:
+                    names.add('eccentricity')
+        return required
+
+    def _log_feature_selection(self):
+        for ch_name in self.processing_channels:
+            if self.CHANNELS[ch_name.lower()].is_virtual():
+                continue
+            categories, params = self.feature_params(ch_name, select=False)
+            sel_categories, sel_params = self.select_categories(
+                ch_name, categories, params)
+
+            skipped = [c for c in categories if c not in sel_categories]
+            skipped += ['%s (d=%d)' %(c, d)
+                        for c in params.get('haralick_categories', [])
+                        for d in params['haralick_distances']
+                        if c not in sel_params.get('haralick_categories', [])
+                        or d not in sel_params['haralick_distances']]
+            self.logger.info("%s: skipped feature categories: %s"
+                             %(ch_name, ", ".join(skipped) or "none"))
+
+    def _log_feature_timing(self):
+        timing = sorted(self._feature_timing.iteritems(), key=lambda t: -t[1])
+        for category, seconds in timing:
+            self.logger.info("feature extraction %-14s %8.2fs"
+                             %(category, seconds))
+        self.logger.info("feature extraction %-14s %8.2fs"
+                         %('total', sum(self._feature_timing.values())))
 
     def export_object_counts(self):
         fname = join(self._statistics_dir, 'P%s__object_counts.txt' % self.position)
@@ -697,6 +904,7 @@ class PositionAnalyzer(PositionCore):
                                      self.meta_data, self.settings,
                                      self._frames,
                                      self.plate_id,
+                                     image_cache=self._image_cache,
                                      **self._hdf_options)
 
         self.settings.set_section('Tracking')
@@ -709,16 +917,30 @@ class PositionAnalyzer(PositionCore):
                       self.settings('Tracking', 'tracking_maxtrackinggap'))
             self._tracker = Tracker(*tropts)
 
+        feature_pool = None
+        if self.settings('Processing', 'feature_workers') > 1:
+            feature_pool = RegionFeaturePool(
+                self.settings('Processing', 'feature_workers'))
+
         stopwatch = StopWatch(start=True)
         ca = CellAnalyzer(timeholder=self.timeholder,
                           position = self.position,
                           create_images = True,
                           binning_factor = 1,
                           detect_objects = self.settings('Processing',
-                                                         'objectdetection'))
+                                                         'objectdetection'),
+                          feature_pool = feature_pool)
 
         self.export_features = self.define_exp_features()
-        n_images = self._analyze(ca)
+        self._required_features = self.required_features()
+        self._feature_timing = dict()
+        self._log_feature_selection()
+        try:
+            n_images = self._analyze(ca)
+        finally:
+            if feature_pool is not None:
+                feature_pool.close()
+        self._log_feature_timing()
 
         if n_images > 0:
             # invoke event selection
@@ -793,6 +1015,11 @@ class PositionAnalyzer(PositionCore):
 
         self.touch_finished()
         self.clear()
+        # aborted positions are not merged into _all_positions.ch5
+        if n_images > 0 and not self.is_aborted():
+            self.timeholder.write_manifest()
+        else:
+            self.timeholder.remove_manifest()
         return n_images
 
     @property
@@ -814,23 +1041,22 @@ class PositionAnalyzer(PositionCore):
 
     def _analyze(self, cellanalyzer):
         super(PositionAnalyzer, self)._analyze()
+        nworkers = self.settings('Processing', 'frame_workers')
+        if nworkers > 1:
+            return self._analyze_pipelined(cellanalyzer, nworkers)
+
         n_images = 0
         stopwatch = StopWatch(start=True)
         crd = Coordinate(self.plate_id, self.position,
                          self._frames, list(set(self.ch_mapping.values())))
 
-        for frame, channels in self._imagecontainer( \
-            crd, interrupt_channel=True, interrupt_zslice=True):
+        for frame, channels in self._iter_frames(crd):
 
             if self.is_aborted():
                 self.clear()
                 return 0
             else:
-                txt = 'T %d (%d/%d)' %(frame, self._frames.index(frame)+1,
-                                       len(self._frames))
-                self.update_status({'progress': self._frames.index(frame)+1,
-                                    'text': txt,
-                                    'interval': stopwatch.interim()})
+                self._update_frame_status(frame, stopwatch)
 
             stopwatch.reset(start=True)
             cellanalyzer.initTimepoint(frame)
@@ -838,53 +1064,128 @@ class PositionAnalyzer(PositionCore):
 
             cellanalyzer.process()
             n_images += 1
-            images = []
+            self._finish_frame(cellanalyzer, frame)
+            self.logger.info(" - Frame %d, duration (ms): %3d" \
+                                 %(frame, stopwatch.interim()*1000))
 
-            if self.settings('Processing', 'tracking'):
-                region = self.settings('Tracking', 'region')
-                samples = self.timeholder[frame][PrimaryChannel.NAME].get_region(region)
-                self._tracker.track_next_frame(frame, samples)
-
-                if self.settings('Tracking', 'tracking_visualization'):
-                    size = cellanalyzer.getImageSize(PrimaryChannel.NAME)
-                    nframes = self.settings('Tracking', 'tracking_visualize_track_length')
-                    radius = self.settings('Tracking', 'tracking_centroid_radius')
-                    img_conn, img_split = self._tracker.render_tracks(
-                        frame, size, nframes, radius)
-                    images += [(img_conn, '#FFFF00', 1.0),
-                               (img_split, '#00FFFF', 1.0)]
-
-            # can't cluster on a per frame basis
-            if self.settings("EventSelection", "supervised_event_selection"):
-                for clf in self.classifiers.itervalues():
-                    cellanalyzer.classify_objects(clf)
+        return n_images
 
-            ##############################################################
-            # FIXME - part for browser
-            if 0:
-                self.render_browser(cellanalyzer)
-            ##############################################################
+    def _analyze_pipelined(self, cellanalyzer, nworkers):
+        """Image processing, segmentation and feature extraction of up to
+        nworkers frames run in a thread pool. Results are commited to the
+        hdf5 file, the tracker and the classifiers strictly in frame order.
+        """
+        n_images = 0
+        aborted = False
+        stopwatch = StopWatch(start=True)
+        crd = Coordinate(self.plate_id, self.position,
+                         self._frames, list(set(self.ch_mapping.values())))
 
-            self.settings.set_section('General')
-            # want emit all images at once
-            imgs = {}
-            imgs.update(self.render_classification_images(cellanalyzer, images, frame))
-            imgs.update(self.render_contour_images(cellanalyzer, images, frame))
-            msg = 'PL %s - P %s - T %05d' %(self.plate_id, self.position, frame)
-            self.set_image(imgs, msg, 50)
+        # limits the number of frames in memory
+        max_pending = 2*nworkers
+        pending = deque()
+        pool = ThreadPool(nworkers)
+        try:
+            for frame, channels in self._iter_frames(crd):
 
-            if self.settings('Output', 'rendering_channel_gallery'):
-                self.render_channel_gallery(cellanalyzer, frame)
+                if self.is_aborted():
+                    aborted = True
+                    break
 
-            if self.settings('Output', 'rendering_labels_discwrite'):
-                cellanalyzer.exportLabelImages(self._labels_dir)
+                # channel setup reads the settings, not thread safe
+                ca = cellanalyzer.copy()
+                ca.initTimepoint(frame)
+                self.register_channels(ca, channels)
+                pending.append((frame, ca, pool.apply_async(ca.compute)))
 
-            self.logger.info(" - Frame %d, duration (ms): %3d" \
-                                 %(frame, stopwatch.interim()*1000))
-            cellanalyzer.purge(features=self.export_features)
+                while len(pending) >= max_pending:
+                    self._commit_frame(pending.popleft(), stopwatch)
+                    n_images += 1
 
+            while pending and not aborted:
+                if self.is_aborted():
+                    aborted = True
+                    break
+                self._commit_frame(pending.popleft(), stopwatch)
+                n_images += 1
+        finally:
+            pool.close()
+            pool.join()
+
+        if aborted:
+            self.clear()
+            return 0
         return n_images
 
+    def _commit_frame(self, job, stopwatch):
+        frame, cellanalyzer, result = job
+        self._update_frame_status(frame, stopwatch)
+        stopwatch.reset(start=True)
+        # reraises exceptions of the worker thread
+        result.get()
+        cellanalyzer.commit()
+        self._finish_frame(cellanalyzer, frame)
+        self.logger.info(" - Frame %d, duration (ms): %3d" \
+                             %(frame, stopwatch.interim()*1000))
+
+    def _update_frame_status(self, frame, stopwatch):
+        txt = 'T %d (%d/%d)' %(frame, self._frames.index(frame)+1,
+                               len(self._frames))
+        self.update_status({'progress': self._frames.index(frame)+1,
+                            'text': txt,
+                            'interval': stopwatch.interim()})
+
+    def _finish_frame(self, cellanalyzer, frame):
+        """Tracking, classification and rendering of a processed frame.
+        Frames must be passed in order."""
+        images = []
+
+        if self.settings('Processing', 'tracking'):
+            region = self.settings('Tracking', 'region')
+            samples = self.timeholder[frame][PrimaryChannel.NAME].get_region(region)
+            self._tracker.track_next_frame(frame, samples)
+
+            if self.settings('Tracking', 'tracking_visualization'):
+                size = cellanalyzer.getImageSize(PrimaryChannel.NAME)
+                nframes = self.settings('Tracking', 'tracking_visualize_track_length')
+                radius = self.settings('Tracking', 'tracking_centroid_radius')
+                img_conn, img_split = self._tracker.render_tracks(
+                    frame, size, nframes, radius)
+                images += [(img_conn, '#FFFF00', 1.0),
+                           (img_split, '#00FFFF', 1.0)]
+
+        # can't cluster on a per frame basis
+        if self.settings("EventSelection", "supervised_event_selection"):
+            for clf in self.classifiers.itervalues():
+                cellanalyzer.classify_objects(clf)
+
+        ##############################################################
+        # FIXME - part for browser
+        if 0:
+            self.render_browser(cellanalyzer)
+        ##############################################################
+
+        self.settings.set_section('General')
+        # want emit all images at once
+        imgs = {}
+        imgs.update(self.render_classification_images(cellanalyzer, images, frame))
+        imgs.update(self.render_contour_images(cellanalyzer, images, frame))
+        msg = 'PL %s - P %s - T %05d' %(self.plate_id, self.position, frame)
+        self.set_image(imgs, msg, 50)
+
+        if self.settings('Output', 'rendering_channel_gallery'):
+            self.render_channel_gallery(cellanalyzer, frame)
+
+        if self.settings('Output', 'rendering_labels_discwrite'):
+            cellanalyzer.exportLabelImages(self._labels_dir)
+
+        for channel in cellanalyzer.proc_channels.itervalues():
+            for category, seconds in channel.feature_timing.iteritems():
+                self._feature_timing[category] = \
+                    self._feature_timing.get(category, 0.0) + seconds
+
+        cellanalyzer.purge(features=self.export_features)
+
     def render_channel_gallery(self, cellanalyzer, frame):
         for channel in cellanalyzer.virtual_channels.itervalues():
             chgal = ChannelGallery(channel, frame, self._channel_gallery_dir)
@@ -989,6 +1290,7 @@ class PositionAnalyzerForBrowser(PositionCore):
                                      self.meta_data, self.settings,
                                      self._frames,
                                      self.plate_id,
+                                     image_cache=self._image_cache,
                                      **self._hdf_options)
 
 
@@ -1013,8 +1315,7 @@ class PositionAnalyzerForBrowser(PositionCore):
                          self._frames, list(set(self.ch_mapping.values())))
 
 
-        for frame, channels in self._imagecontainer( \
-            crd, interrupt_channel=True, interrupt_zslice=True):
+        for frame, channels in self._iter_frames(crd):
 
             if self.is_aborted():
                 self.clear()
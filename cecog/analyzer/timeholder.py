@@ -36,19 +36,35 @@ from cecog.colors import Colors
 from cecog.util.stopwatch import StopWatch
 from cecog.io.imagecontainer import Coordinate
 from cecog.io.imagecontainer import MetaImage
+from cecog.io.writebuffer import WriteBuffer
+from cecog.io.manifest import write_position_manifest
+from cecog.io.manifest import remove_position_manifest
 from cecog.analyzer.channel import PrimaryChannel
 from cecog.plugin.metamanager import MetaPluginManager
 from cecog.analyzer.tracker import Tracker
 
 
-def chunk_size(shape):
-    """Helper function to compute chunk size for image data cubes."""
-    c = shape[0]
-    t = 1
-    z = 1
-    y = shape[3] / 4
-    x = shape[4] / 4
-    return (c, t, z, y, x)
+# chunk shape of the 'tiled' layout in frames and pixel
+TILE_FRAMES = 16
+TILE_SIZE = 64
+
+def chunk_size(shape, layout='legacy'):
+    """Helper function to compute chunk size for image data cubes
+    (c, t, z, y, x).
+
+    legacy: all channels and 1/16 of a plane per chunk
+    frame: one plane per chunk, fast writes and reads of full frames
+    tiled: spatio-temporal tiles, fast reads of small crops over many
+           frames (gallery images)
+    """
+    c, t, z, y, x = shape
+    if layout == 'frame':
+        chunks = (1, 1, 1, y, x)
+    elif layout == 'tiled':
+        chunks = (1, TILE_FRAMES, 1, TILE_SIZE, TILE_SIZE)
+    else:
+        chunks = (c, 1, 1, y / 4, x / 4)
+    return tuple(max(1, min(n, m)) for n, m in zip(chunks, shape))
 
 def max_shape(shape):
     """Helper function to compute chunk size for image data cubes."""
@@ -59,6 +75,15 @@ def max_shape(shape):
     x = shape[4]
     return (c, t, z, y, x)
 
+def structured_array(dtype, columns):
+    """Helper function to pack a 2d array column by column into a record
+    array of the given dtype (e.g. to write a hyperslab at once)."""
+    dtype = numpy.dtype(dtype)
+    data = numpy.empty((columns.shape[0], ), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        data[name] = columns[:, i]
+    return data
+
 
 class TimeHolder(OrderedDict):
     
@@ -113,7 +138,12 @@ class TimeHolder(OrderedDict):
                  hdf5_include_label_images=True, hdf5_include_features=True,
                  hdf5_include_classification=True, hdf5_include_crack=True,
                  hdf5_include_tracking=True, hdf5_include_events=True,
-                 hdf5_include_annotation=True):
+                 hdf5_include_annotation=True, hdf5_write_buffer=0,
+                 hdf5_raw_images_chunks='legacy',
+                 hdf5_raw_images_compression='default',
+                 hdf5_label_images_chunks='legacy',
+                 hdf5_label_images_compression='default',
+                 image_cache=None):
         super(TimeHolder, self).__init__()
         try:
             import pydevd
@@ -142,6 +172,15 @@ class TimeHolder(OrderedDict):
         self._hdf5_include_annotation = hdf5_include_annotation
         self._hdf5_compression = hdf5_compression
         self._hdf5_reuse = hdf5_reuse
+        # chunk layout and compression of the image datasets
+        self._hdf5_image_options = {
+            'channel': (hdf5_raw_images_chunks, hdf5_raw_images_compression),
+            'region': (hdf5_label_images_chunks,
+                       hdf5_label_images_compression)}
+        # size of the write-behind buffer in bytes, 0 means synchronous io
+        self._write_buffer = WriteBuffer(hdf5_write_buffer)
+        # persistent cache of preprocessed raw images (ImageCache or None)
+        self._image_cache = image_cache
 
         self._hdf5_features_complete = False
         self.hdf5_filename = filename_hdf5
@@ -179,6 +218,9 @@ class TimeHolder(OrderedDict):
 
         self._feature_to_idx = OrderedDict()
 
+        # in-memory copy of attrs['valid'] of the label and raw images,
+        # written to the file once in close_all()
+        self._valid = dict()
         self._hdf5_found = False
         if self.hdf5_filename is not None and exists(self.hdf5_filename):
             if self._hdf5_check_file():
@@ -213,12 +255,12 @@ class TimeHolder(OrderedDict):
                     # check if label images are there and if reuse is enabled
                     if 'region' in self._grp_cur_position[self.HDF5_GRP_IMAGE]:
                         label_image_cpy = self._grp_cur_position[self.HDF5_GRP_IMAGE]['region'].value
-                        label_image_valid = self._grp_cur_position[self.HDF5_GRP_IMAGE]['region'].attrs['valid']
+                        label_image_valid = self._valid['region']
                         label_image_str = self._grp_cur_position[self.HDF5_GRP_IMAGE].name + '/region'
 
                     if 'channel' in self._grp_cur_position[self.HDF5_GRP_IMAGE]:
                         raw_image_cpy = self._grp_cur_position[self.HDF5_GRP_IMAGE]['channel'].value
-                        raw_image_valid = self._grp_cur_position[self.HDF5_GRP_IMAGE]['channel'].attrs['valid']
+                        raw_image_valid = self._valid['channel']
                         raw_image_str = self._grp_cur_position[self.HDF5_GRP_IMAGE].name + '/channel'
                 except:
                     print 'Loading of Hdf5 failed... '
@@ -255,11 +297,31 @@ class TimeHolder(OrderedDict):
                                                                                                        well,
                                                                                                        position)]
             self._grp_def = self._hdf5_file[self.HDF5_GRP_DEFINITION]
+            self._hdf5_read_valid()
             return 0
         except:
             self._hdf5_file.close()
             return 1
 
+    def _hdf5_read_valid(self):
+        """Read the valid flags of label and raw images once, further checks
+        and updates operate on the in-memory copy."""
+        self._valid = dict()
+        grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
+        for var_name in ('region', 'channel'):
+            if var_name in grp and 'valid' in grp[var_name].attrs:
+                self._valid[var_name] = numpy.array(grp[var_name].attrs['valid'])
+
+    def _hdf5_write_valid(self):
+        grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
+        for var_name, valid in self._valid.iteritems():
+            if var_name in grp:
+                grp[var_name].attrs['valid'] = valid
+
+    def _is_valid(self, var_name, frame_idx):
+        valid = self._valid.get(var_name)
+        return valid is not None and bool(valid[frame_idx])
+
     def _hdf5_check_file(self):
         try:
             f = h5py.File(self.hdf5_filename, 'r')
@@ -420,8 +482,11 @@ class TimeHolder(OrderedDict):
                 self._hdf5_file.close()
             except:
                 print '_hdf5_create_file_structure(): Closing already opended file for rewrite'
+        # the manifest marks the file as complete (see write_manifest)
+        remove_position_manifest(filename)
         f = h5py.File(filename, 'w')
         self._hdf5_file = f
+        self._valid = dict()
 
         grp_sample = f.create_group('sample')
         grp_cur_sample = grp_sample.create_group('0')
@@ -441,6 +506,7 @@ class TimeHolder(OrderedDict):
         grp_cur_experiment = grp_experiment.create_group(well)
         grp_position = grp_cur_experiment.create_group('position')
         grp_cur_position = grp_position.create_group(position)
+        self._position_names = (self.plate_id, well, position)
 
         self._grp_cur_position = grp_cur_position
 
@@ -458,11 +524,12 @@ class TimeHolder(OrderedDict):
             self._hdf5_file.create_dataset(label_image_str,
                                            label_image_cpy.shape,
                                            'uint16',
-                                           chunks=chunk_size(label_image_cpy.shape),
                                            data=label_image_cpy,
                                            maxshape=max_shape(label_image_cpy.shape),
-                                           compression=self._hdf5_compression)
+                                           **self._image_dataset_options(
+                                               'region', label_image_cpy.shape))
             self._hdf5_file[label_image_str].attrs['valid'] = label_image_valid
+            self._valid['region'] = numpy.array(label_image_valid)
 
             if self._hdf5_file[label_image_str].shape[0] != len(self._regions_to_idx):
                 self._hdf5_file[label_image_str].resize(len(self._regions_to_idx), axis=0)
@@ -472,15 +539,27 @@ class TimeHolder(OrderedDict):
             self._hdf5_file.create_dataset(raw_image_str,
                                            raw_image_cpy.shape,
                                            'uint8',
-                                           chunks=chunk_size(raw_image_cpy.shape),
                                            data=raw_image_cpy,
                                            maxshape=max_shape(raw_image_cpy.shape),
-                                           compression=self._hdf5_compression)
+                                           **self._image_dataset_options(
+                                               'channel', raw_image_cpy.shape))
             self._hdf5_file[raw_image_str].attrs['valid'] = raw_image_valid
+            self._valid['channel'] = numpy.array(raw_image_valid)
 
             if self._hdf5_file[raw_image_str].shape[0] != len(self._regions_to_idx):
                 self._hdf5_file[raw_image_str].resize(len(self._regions_to_idx), axis=0)
 
+    def _image_dataset_options(self, var_name, shape):
+        """Return chunks and compression of the image dataset var_name
+        ('channel' or 'region')."""
+        layout, compression = self._hdf5_image_options[var_name]
+        if compression == 'default':
+            compression = self._hdf5_compression
+        elif compression == 'none':
+            compression = None
+        return {'chunks': chunk_size(shape, layout),
+                'compression': compression}
+
     @staticmethod
     def nc_valid_set(var, idx, value):
         helper = var.valid
@@ -492,9 +571,28 @@ class TimeHolder(OrderedDict):
 
     def close_all(self):
         try:
-            self._hdf5_file.close()
-        except:
-            pass
+            # drain pending writes before the file is closed
+            self._write_buffer.close()
+            # valid flags are only written if all data made it to the file
+            if self._hdf5_create:
+                self._hdf5_write_valid()
+        finally:
+            try:
+                self._hdf5_file.close()
+            except:
+                pass
+
+    def write_manifest(self):
+        """Mark the closed position file as complete, merged files are
+        built from the manifests (see link_hdf5_files)."""
+        if self._hdf5_create:
+            write_position_manifest(self.hdf5_filename,
+                                    *self._position_names)
+
+    def remove_manifest(self):
+        """Remove the manifest of an incomplete (e.g. aborted) position."""
+        if self._hdf5_create:
+            remove_position_manifest(self.hdf5_filename)
 
     def initTimePoint(self, iT):
         # HDF5 feature definition is complete after first frame
@@ -530,21 +628,24 @@ class TimeHolder(OrderedDict):
         self[iT][channel.NAME] = channel
 
     def apply_segmentation(self, channel, *args):
+        frame = self._iCurrentT
+        if not self.load_label_images(channel, frame):
+            self.compute_label_images(channel, frame, *args)
+            self.write_label_images(channel, frame)
+
+    def load_label_images(self, channel, frame):
+        """Load the label images of a frame from the hdf5 file (reuse).
+        Returns True on success."""
         stop_watch = StopWatch(start=True)
-
-        desc = '[P %s, T %05d, C %s]' % (self.P, self._iCurrentT,
-                                         channel.strChannelId)
-
         channel_name = channel.NAME.lower()
         label_images_valid = False
         if self._hdf5_found and self._hdf5_reuse:
             ### Try to load them
-            frame_idx = self._frames_to_idx[self._iCurrentT]
+            frame_idx = self._frames_to_idx[frame]
             for region_name in self.reginfo.names[channel_name]:
                 if 'region' in self._grp_cur_position[self.HDF5_GRP_IMAGE]:
                     dset_label_image = self._grp_cur_position[self.HDF5_GRP_IMAGE]['region']
-                    frame_valid = dset_label_image.attrs['valid'][frame_idx]
-                    if frame_valid:
+                    if self._is_valid('region', frame_idx):
                         region_idx = self._regions_to_idx2[(channel.NAME, region_name)]
                         if not (region_idx < dset_label_image.shape[0]):
                             label_images_valid = False
@@ -562,130 +663,188 @@ class TimeHolder(OrderedDict):
                     label_images_valid = False
                     break
 
-        # only True if hdf_create and reuse and label_images are valid!
-        if not label_images_valid:
-            # compute segmentation without (not loading from file)
-            channel.apply_segmentation(*args)
-            self._logger.info('Label images %s computed in %s.'
-                              %(desc, stop_watch.interim()))
-            # write segmentation back to file
-            if self._hdf5_create and self._hdf5_include_label_images:
-                meta = self._meta_data
-                w = meta.real_image_width
-                h = meta.real_image_height
-                z = meta.dim_z
-                t = len(self._frames_to_idx)
-                var_name = 'region'
-                grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
-                # create new group if it does not exist yet!
-                if var_name in grp and grp[var_name].shape[0] == len(self._regions_to_idx2):
-                    var_labels = grp[var_name]
-                else:
-                    nr_labels = len(self._regions_to_idx2)
-                    var_labels = \
-                        grp.create_dataset(var_name,
-                                           (nr_labels, t, z, h, w),
-                                           'uint16',
-                                           chunks=chunk_size((nr_labels, t, z, h, w)),
-                                           compression=self._hdf5_compression)
-                    var_labels.attrs['valid'] = numpy.zeros(t)
+        if label_images_valid:
+            self._logger.info('Label images %s loaded from hdf5 file in %s.'
+                              % (self._desc(channel, frame), stop_watch.interim()))
+        return label_images_valid
 
-                frame_idx = self._frames_to_idx[self._iCurrentT]
-                for region_name in self.reginfo.names[channel_name]:
-                    if channel.is_virtual():
-                        continue
-                    idx = self._regions_to_idx2[(channel.NAME, region_name)]
-                    container = channel.containers[region_name]
-                    array = container.img_labels.toArray(copy=False)
-                    var_labels[idx, frame_idx, 0] = numpy.require(array, 'uint16')
-                    ### Workaround... h5py attributes do not support transparent list types...
-                    tmp = var_labels.attrs['valid']
-                    tmp[frame_idx] = 1
-                    var_labels.attrs['valid'] = tmp
+    def compute_label_images(self, channel, frame, *args):
+        stop_watch = StopWatch(start=True)
+        channel.apply_segmentation(*args)
+        self._logger.info('Label images %s computed in %s.'
+                          %(self._desc(channel, frame), stop_watch.interim()))
+
+    def write_label_images(self, channel, frame):
+        """Write the label images of a frame to the hdf5 file."""
+        if not (self._hdf5_create and self._hdf5_include_label_images):
+            return
+
+        channel_name = channel.NAME.lower()
+        meta = self._meta_data
+        w = meta.real_image_width
+        h = meta.real_image_height
+        z = meta.dim_z
+        t = len(self._frames_to_idx)
+        var_name = 'region'
+        grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
+        # create new group if it does not exist yet!
+        if var_name in grp and grp[var_name].shape[0] == len(self._regions_to_idx2):
+            var_labels = grp[var_name]
         else:
-            self._logger.info('Label images %s loaded from hdf5 file in %s.'
-                              % (desc, stop_watch.interim()))
+            nr_labels = len(self._regions_to_idx2)
+            var_labels = \
+                grp.create_dataset(var_name,
+                                   (nr_labels, t, z, h, w),
+                                   'uint16',
+                                   **self._image_dataset_options(
+                                       var_name, (nr_labels, t, z, h, w)))
+            var_labels.attrs['valid'] = numpy.zeros(t)
+            self._valid[var_name] = numpy.zeros(t)
+
+        frame_idx = self._frames_to_idx[frame]
+        for region_name in self.reginfo.names[channel_name]:
+            if channel.is_virtual():
+                continue
+            idx = self._regions_to_idx2[(channel.NAME, region_name)]
+            container = channel.containers[region_name]
+            array = container.img_labels.toArray(copy=False)
+            # always a copy, the write might be deferred
+            self._write_buffer.write(var_labels, (idx, frame_idx, 0),
+                                     numpy.array(array, dtype='uint16'))
+            self._valid[var_name][frame_idx] = 1
 
     def prepare_raw_image(self, channel):
         if channel.is_virtual():
             # no raw image in a merged channel
             return
 
+        frame = self._iCurrentT
+        if not self.load_raw_image(channel, frame):
+            self.compute_raw_image(channel, frame)
+            self.write_raw_image(channel, frame)
+
+    def reused_frames(self):
+        """Return the frames with raw images in the hdf5 file (reuse), the
+        images are not read from the image files."""
+        if not (self._hdf5_found and self._hdf5_reuse) or \
+                'channel' not in self._grp_cur_position[self.HDF5_GRP_IMAGE]:
+            return set()
+        return set(frame for frame, idx in self._frames_to_idx.iteritems()
+                   if self._is_valid('channel', idx))
+
+    def load_raw_image(self, channel, frame):
+        """Load the raw image of a frame from the hdf5 file (reuse).
+        Returns True on success."""
         stop_watch = StopWatch(start=True)
-        desc = '[P %s, T %05d, C %s]' % (self.P, self._iCurrentT,
-                                         channel.strChannelId)
         frame_valid = False
         if self._hdf5_found and self._hdf5_reuse:
             if 'channel' in self._grp_cur_position[self.HDF5_GRP_IMAGE]:
-                frame_idx = self._frames_to_idx[self._iCurrentT]
+                frame_idx = self._frames_to_idx[frame]
                 dset_raw_image = self._grp_cur_position[self.HDF5_GRP_IMAGE]['channel']
-                frame_valid = dset_raw_image.attrs['valid'][frame_idx]
+                frame_valid = self._is_valid('channel', frame_idx)
                 if frame_valid:
                     # Double check if image_data contains data
-                    coordinate = Coordinate(position=self.P, time=self._iCurrentT,
-                                    channel=channel.strChannelId, zslice=1)
-                    meta_image = MetaImage(image_container=None, coordinate=coordinate)
                     channel_idx = self._channels_to_idx[channel.PREFIX]
                     if not (channel_idx < dset_raw_image.shape[0]):
                         frame_valid = False
 
         if self._hdf5_found and frame_valid:
-            coordinate = Coordinate(position=self.P, time=self._iCurrentT,
-                                    channel=channel.strChannelId, zslice=1)
-            meta_image = MetaImage(image_container=None, coordinate=coordinate)
             channel_idx = self._channels_to_idx[channel.PREFIX]
-
-            img = ccore.numpy_to_image(dset_raw_image[channel_idx, frame_idx, 0, :, :], copy=True)
-            meta_image.set_image(img)
-            meta_image.set_raw_image(img)
-            channel.meta_image = meta_image
+            self._set_raw_image(channel, frame,
+                                dset_raw_image[channel_idx, frame_idx, 0, :, :])
             self._logger.info('Raw image %s loaded from hdf5 file in %s.'
-                              % (desc, stop_watch.interim()))
-        else:
-            channel.apply_zselection()
+                              % (self._desc(channel, frame), stop_watch.interim()))
+            return True
+        return False
+
+    def _set_raw_image(self, channel, frame, data):
+        coordinate = Coordinate(position=self.P, time=frame,
+                                channel=channel.strChannelId, zslice=1)
+        meta_image = MetaImage(image_container=None, coordinate=coordinate)
+        img = ccore.numpy_to_image(data, copy=True)
+        meta_image.set_image(img)
+        meta_image.set_raw_image(img)
+        channel.meta_image = meta_image
+
+    def compute_raw_image(self, channel, frame):
+        """Z-slice selection, normalization and registration. The result is
+        taken from the image cache if possible and stored otherwise.
+        Preprocessed images (see AbstractImporter.preprocessed) are used
+        as they are."""
+        stop_watch = StopWatch(start=True)
+        key = None
+        if self._image_cache is not None:
+            key = channel.preprocessing_key(self.plate_id)
+
+        if key is not None:
+            data = self._image_cache.get(key)
+            if data is not None:
+                self._set_raw_image(channel, frame, data)
+                self._logger.info('Raw image %s loaded from image cache in %s.'
+                                  % (self._desc(channel, frame),
+                                     stop_watch.interim()))
+                return
+
+        channel.apply_zselection()
+        if not channel.preprocessed:
             channel.normalize_image(self.plate_id)
             channel.apply_registration()
-            self._logger.info('Raw image %s prepared in %s.' % (desc, stop_watch.interim()))
-
-            if self._hdf5_create and self._hdf5_include_raw_images:
-                meta = self._meta_data
-                w = meta.real_image_width
-                h = meta.real_image_height
-
-                z = meta.dim_z
-                t = len(self._frames_to_idx)
-                ncolors = len(set(self._channels_to_idx.values()))
-                var_name = 'channel'
-                grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
-                if var_name in grp:
-                    var_images = grp[var_name]
-                else:
-                    var_images = \
-                        grp.create_dataset(var_name,
-                                           (ncolors, t, z, h, w),
-                                           'uint8',
-                                           chunks=chunk_size((ncolors, t, z, h, w)),
-                                           compression=self._hdf5_compression)
-                    var_images.attrs['valid'] = numpy.zeros(t)
-
-                frame_idx = self._frames_to_idx[self._iCurrentT]
-                channel_idx = self._channels_to_idx[channel.PREFIX]
-                img = channel.meta_image.image
-                array = img.toArray(copy=False)
-                var_images[channel_idx, frame_idx, 0] = array
-                tmp = var_images.attrs['valid']
-                tmp[frame_idx] = 1
-                var_images.attrs['valid'] = tmp
-                self._logger.info('Raw image %s written to hdf5 file.' % desc)
+        if key is not None:
+            self._image_cache.put(key, channel.meta_image.image.toArray(copy=True))
+        self._logger.info('Raw image %s prepared in %s.'
+                          % (self._desc(channel, frame), stop_watch.interim()))
+
+    def write_raw_image(self, channel, frame):
+        """Write the raw image of a frame to the hdf5 file."""
+        if not (self._hdf5_create and self._hdf5_include_raw_images):
+            return
+
+        meta = self._meta_data
+        w = meta.real_image_width
+        h = meta.real_image_height
+
+        z = meta.dim_z
+        t = len(self._frames_to_idx)
+        ncolors = len(set(self._channels_to_idx.values()))
+        var_name = 'channel'
+        grp = self._grp_cur_position[self.HDF5_GRP_IMAGE]
+        if var_name in grp:
+            var_images = grp[var_name]
+        else:
+            var_images = \
+                grp.create_dataset(var_name,
+                                   (ncolors, t, z, h, w),
+                                   'uint8',
+                                   **self._image_dataset_options(
+                                       var_name, (ncolors, t, z, h, w)))
+            var_images.attrs['valid'] = numpy.zeros(t)
+            self._valid[var_name] = numpy.zeros(t)
+
+        frame_idx = self._frames_to_idx[frame]
+        channel_idx = self._channels_to_idx[channel.PREFIX]
+        img = channel.meta_image.image
+        # always a copy, the write might be deferred
+        self._write_buffer.write(var_images,
+                                 (channel_idx, frame_idx, 0),
+                                 img.toArray(copy=True))
+        self._valid[var_name][frame_idx] = 1
+        self._logger.info('Raw image %s written to hdf5 file.'
+                          %self._desc(channel, frame))
+
+    def _desc(self, channel, frame):
+        return '[P %s, T %05d, C %s]' % (self.P, frame, channel.strChannelId)
 
     def _get_feature_group(self):
         grp_object_features = self._grp_cur_position.require_group(self.HDF5_GRP_FEATURE)
         return grp_object_features
 
     def apply_features(self, channel):
-        channel_name = channel.NAME.lower()
         channel.apply_features()
+        self.write_features(channel, self._iCurrentT)
 
+    def write_features(self, channel, frame):
+        """Write the objects and features of a frame to the hdf5 file."""
+        channel_name = channel.NAME.lower()
         if self._hdf5_create:
             grp_cur_pos = self._grp_cur_position
             grp_feature = self._get_feature_group()
@@ -832,36 +991,50 @@ class TimeHolder(OrderedDict):
                         dset_crack_contour.resize((nr_objects + offset, ))
 
 
-                frame_idx = self._frames_to_idx[self._iCurrentT]
-                for idx, obj_id in enumerate(region):
-                    obj = region[obj_id]
+                if nr_objects == 0:
+                    continue
 
-                    ### Important: save unified objects and relations lookup into _object_coord_to_id
-                    idx_new = offset + idx
-                    new_obj_id = idx_new + 1
-                    coord = frame_idx, obj_id
+                frame_idx = self._frames_to_idx[frame]
+                obj_ids = region.labels
 
-                    self._object_coord_to_id[(channel.PREFIX, coord)] = new_obj_id
-                    self._object_coord_to_idx[(channel.PREFIX, coord)] = idx_new
+                ### Important: save unified objects and relations lookup into _object_coord_to_id
+                for idx, obj_id in enumerate(region.iterkeys()):
+                    coord = (channel.PREFIX, (frame_idx, obj_id))
+                    self._object_coord_to_id[coord] = offset + idx + 1
+                    self._object_coord_to_idx[coord] = offset + idx
 
-                    dset_bounding_box[idx + offset] = obj.oRoi.upperLeft[0], obj.oRoi.lowerRight[0], obj.oRoi.upperLeft[1], obj.oRoi.lowerRight[1]
-                    dset_center[idx + offset] = obj.oCenterAbs
+                # one hyperslab per dataset and frame, objects are
+                # collected column wise
+                slab = slice(offset, offset + nr_objects)
+                write = self._write_buffer.write
+                write(dset_bounding_box, slab, structured_array(
+                        dset_bounding_box.dtype, region.bounding_boxes()))
+                write(dset_center, slab, structured_array(
+                        dset_center.dtype, region.centers()))
 
-                    # is case one don't wants nan's written to the hdf5 file
-                    # if np.isnan(obj.orientation.angle)
-                    dset_orientation[idx + offset] = obj.orientation.angle, obj.orientation.eccentricity
-                    dset_idx_relation[idx + offset] = frame_idx, obj_id
+                # is case one don't wants nan's written to the hdf5 file
+                # if np.isnan(obj.orientation.angle)
+                write(dset_orientation, slab, structured_array(
+                        dset_orientation.dtype, region.orientations()))
+                write(dset_idx_relation, slab, structured_array(
+                        dset_idx_relation.dtype,
+                        numpy.column_stack((numpy.repeat(frame_idx, nr_objects),
+                                            obj_ids))))
 
-                    if self._hdf5_include_features:
-                        if len(obj.aFeatures) > 0:
-                            dset_object_features[idx + offset] = obj.aFeatures
+                if self._hdf5_include_features and nr_features > 0:
+                    write(dset_object_features, slab, region.feature_matrix())
 
-                    if self._hdf5_include_crack:
+                if self._hdf5_include_crack:
+                    cracks = numpy.empty((nr_objects, ), dtype=object)
+                    for idx, obj in enumerate(region.itervalues()):
                         data = ','.join(map(str, numpy.array(obj.crack_contour).flatten()))
-                        dset_crack_contour[idx + offset] = base64.b64encode(zlib.compress(data))
+                        cracks[idx] = base64.b64encode(zlib.compress(data))
+                    write(dset_crack_contour, slab, cracks)
 
-                    if channel_name != PrimaryChannel.PREFIX:
-                        dset_cross_rel[idx + offset] = (idx, idx)
+                if channel_name != PrimaryChannel.PREFIX:
+                    idx = numpy.arange(nr_objects)
+                    write(dset_cross_rel, slab, structured_array(
+                            dset_cross_rel.dtype, numpy.column_stack((idx, idx))))
 
     def serialize_tracking(self, graph):
 
@@ -1268,16 +1441,24 @@ class TimeHolder(OrderedDict):
                 dset_probability = current_classification_grp[var_name]
                 dset_probability.resize((offset+nr_objects, nr_classes))
 
+        if nr_objects == 0:
+            return
+
         label2idx = dict([(l, i) for i, l in enumerate(predictor.class_names.keys())])
+        prediction = numpy.empty((nr_objects, ), dtype=dset_prediction.dtype)
+        probabilities = numpy.empty((nr_objects, nr_classes), dtype=float)
 
         for i, obj in enumerate(region.itervalues()):
             # replace default for unlabeld object with numerical values
             if obj.iLabel is None:
-                dset_prediction[i+offset] = (self.UNPREDICTED_LABEL, )
-                probs = [self.UNPREDICTED_PROB]*predictor.n_classes
+                prediction[i] = (self.UNPREDICTED_LABEL, )
+                probabilities[i] = self.UNPREDICTED_PROB
             else:
-                dset_prediction[i+offset] = (label2idx[obj.iLabel], )
-                probs = obj.dctProb.values()
+                prediction[i] = (label2idx[obj.iLabel], )
+                if predictor.SAVE_PROBS:
+                    probabilities[i] = obj.dctProb.values()
 
-            if predictor.SAVE_PROBS:
-                dset_probability[i+offset] = probs
+        slab = slice(offset, offset + nr_objects)
+        self._write_buffer.write(dset_prediction, slab, prediction)
+        if predictor.SAVE_PROBS:
+            self._write_buffer.write(dset_probability, slab, probabilities)
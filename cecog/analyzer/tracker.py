@@ -15,8 +15,11 @@ __all__ = ['Tracker']
 import math
 from collections import OrderedDict
 
+import numpy as np
+from scipy.spatial import cKDTree
+
 from cecog.util.logger import LoggerObject
-from cecog.extensions.graphLib import Graph
+from cecog.analyzer.trackgraph import TrackGraph, pack_nodeid, unpack_nodeid
 from cecog import ccore
 
 
@@ -31,7 +34,7 @@ class Tracker(LoggerObject):
 
         if max_frame_gap < 1 or not isinstance(max_frame_gap, int):
             raise ValueError("max_frame_gap must be a positive integer")
-        self.graph = Graph()
+        self.graph = TrackGraph()
         self._frame_data = OrderedDict()
 
         self.max_frame_gap = max_frame_gap
@@ -57,11 +60,21 @@ class Tracker(LoggerObject):
 
     @staticmethod
     def node_id(frame, object_label):
-        return '%d_%s' %(frame, object_label)
+        return pack_nodeid(frame, object_label)
 
     @staticmethod
     def split_nodeid(nodeid):
-        return tuple([int(i) for i in nodeid.split('_')])
+        """Return (frame, label) of a node id or (frame, label[, branch])
+        of a string id of the form 'frame_label[_branch]'."""
+        if isinstance(nodeid, basestring):
+            return tuple([int(i) for i in nodeid.split('_')])
+        return unpack_nodeid(nodeid)
+
+    @staticmethod
+    def format_nodeid(nodeid):
+        """Return the string representation 'frame_label' of a node id,
+        used for track ids and file output."""
+        return '%d_%d' %unpack_nodeid(nodeid)
 
     def track_next_frame(self, frame, samples):
         self._frame_data.setdefault(frame, [])
@@ -91,7 +104,7 @@ class Tracker(LoggerObject):
     def clone_graph(self, timeholder, channel, region):
         """Clone the tracking graph with data from a different channel."""
 
-        ngraph = Graph()
+        ngraph = TrackGraph()
 
         # add nodes from other segmentation region
         for nodeid in self.graph.node_list():
@@ -151,8 +164,76 @@ class Tracker(LoggerObject):
 
         return img_conn, img_split
 
-    def connect_nodes(self, iT):
+    def _centers(self, frame):
+        """Return node ids and centers of all objects of a frame."""
+        node_ids = [self.node_id(frame, label)
+                    for label in self._frame_data[frame]]
+        objects = [self.graph.node_data(node_id) for node_id in node_ids]
+        centers = np.array([obj.oCenterAbs for obj in objects], dtype=float)
+        return node_ids, objects, centers.reshape((-1, 2))
+
+    def find_candidates(self, iPreviousT, iT):
+        """Return the merge and split candidates between two frames.
+
+        dctSplits contains for each node in frame iPreviousT the list of
+        potential successors, dctMerges contains for each node in frame iT
+        the list of potential predecessors within max_object_distance.
+        Both lists hold at most max_node_degree (distance, node_id) tuples.
+
+        A kd-tree over the object centers of frame iT is used to find
+        candidates, the distance criterion is the same as before
+        (squared distance < max_object_distance^2).
+        """
         max_dist2 = math.pow(self.max_object_distance, 2)
+        dctMerges = {}
+        dctSplits = {}
+
+        nodes_p, objects_p, centers_p = self._centers(iPreviousT)
+        nodes_c, objects_c, centers_c = self._centers(iT)
+        if len(nodes_p) == 0 or len(nodes_c) == 0:
+            return dctMerges, dctSplits
+
+        # the ball query is only a prefilter, slightly larger radius
+        # to be independent of rounding
+        radius = self.max_object_distance*(1.0 + 1e-6) + 1e-6
+        neighbors = cKDTree(centers_c).query_ball_point(centers_p, radius)
+
+        # for all nodes in this layer
+        for strNodeIdP, oImageObjectP, indices in \
+                zip(nodes_p, objects_p, neighbors):
+
+            lstNearest = []
+            # keep the order of the objects in the current frame,
+            # the sort below is stable
+            for i in sorted(indices):
+                dist = objects_c[i].squaredMagnitude(oImageObjectP)
+                # take all candidates within a certain distance
+                if dist < max_dist2:
+                    lstNearest.append((dist, nodes_c[i]))
+
+            # lstNearest is the list of nodes in the current frame
+            # whose distance to the previous node is smaller than the
+            # fixed threshold.
+            if len(lstNearest) > 0:
+                # sort ascending by distance (first tuple element)
+                lstNearest.sort(key=lambda x: x[0])
+
+                # take only a certain number as merge candidates (the N closest)
+                # and split candidates (this number is identical).
+                for dist, strNodeIdC in lstNearest[:self.max_node_degree]:
+                    try:
+                        dctMerges[strNodeIdC].append((dist, strNodeIdP))
+                    except KeyError:
+                        dctMerges[strNodeIdC] = [(dist, strNodeIdP)]
+
+                    try:
+                        dctSplits[strNodeIdP].append((dist, strNodeIdC))
+                    except KeyError:
+                        dctSplits[strNodeIdP] = [(dist, strNodeIdC)]
+
+        return dctMerges, dctSplits
+
+    def connect_nodes(self, iT):
         bReturnSuccess = False
 
         # search all nodes in the previous frame
@@ -163,45 +244,7 @@ class Tracker(LoggerObject):
 
         if iPreviousT is not None:
             bReturnSuccess = True
-            dctMerges = {}
-            dctSplits = {}
-
-            # for all nodes in this layer
-            for iObjIdP in self._frame_data[iPreviousT]:
-
-                strNodeIdP = self.node_id(iPreviousT, iObjIdP)
-                oImageObjectP = self.graph.node_data(strNodeIdP)
-
-                lstNearest = []
-
-                for iObjIdC in self._frame_data[iT]:
-                    strNodeIdC = self.node_id(iT, iObjIdC)
-                    oImageObjectC = self.graph.node_data(strNodeIdC)
-                    dist = oImageObjectC.squaredMagnitude(oImageObjectP)
-
-                    # take all candidates within a certain distance
-                    if dist < max_dist2:
-                        lstNearest.append((dist, strNodeIdC))
-
-                # lstNearest is the list of nodes in the current frame
-                # whose distance to the previous node is smaller than the
-                # fixed threshold.
-                if len(lstNearest) > 0:
-                    # sort ascending by distance (first tuple element)
-                    lstNearest.sort(key=lambda x: x[0])
-
-                    # take only a certain number as merge candidates (the N closest)
-                    # and split candidates (this number is identical).
-                    for dist, strNodeIdC in lstNearest[:self.max_node_degree]:
-                        try:
-                            dctMerges[strNodeIdC].append((dist, strNodeIdP))
-                        except KeyError:
-                            dctMerges[strNodeIdC] = [(dist, strNodeIdP)]
-
-                        try:
-                            dctSplits[strNodeIdP].append((dist, strNodeIdC))
-                        except KeyError:
-                            dctSplits[strNodeIdP] = [(dist, strNodeIdC)]
+            dctMerges, dctSplits = self.find_candidates(iPreviousT, iT)
 
             # dctSplits contains for each node the list of potential
             # successors with distance smaller than threshold.
@@ -0,0 +1,270 @@
+"""
+trackgraph.py
+
+Compact directed graph for tracking results.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['TrackGraph', 'pack_nodeid', 'unpack_nodeid']
+
+from array import array
+from collections import Mapping
+
+from cecog.extensions.graphLib import Graph_duplicate_node, Graph_no_edge
+
+
+LABEL_BITS = 32
+LABEL_MASK = (1 << LABEL_BITS) - 1
+# marks deleted edges and the end of adjacency lists
+NONE = -1
+
+
+def pack_nodeid(frame, label):
+    """Return the integer node id of the object label in the frame."""
+    return (int(frame) << LABEL_BITS) | int(label)
+
+def unpack_nodeid(nodeid):
+    """Return the tuple (frame, label) of an integer node id."""
+    nodeid = int(nodeid)
+    return (nodeid >> LABEL_BITS, nodeid & LABEL_MASK)
+
+
+class _EdgeView(Mapping):
+    """Read only mapping edge_id -> (head_id, tail_id, edge_data), the
+    counterpart of graphLib.Graph.edges. Iteration is in edge id order."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, edge_id):
+        graph = self._graph
+        if not graph.has_edge(edge_id):
+            raise KeyError(edge_id)
+        return (graph.head(edge_id), graph.tail(edge_id),
+                graph._edge_data.get(edge_id))
+
+    def __iter__(self):
+        heads = self._graph._heads
+        for edge_id in xrange(len(heads)):
+            if heads[edge_id] != NONE:
+                yield edge_id
+
+    def __len__(self):
+        return self._graph.number_of_edges()
+
+
+class TrackGraph(object):
+    """Directed graph with integer node ids and array backed storage.
+
+    Provides the methods of graphLib.Graph used by tracking, event selection
+    and export (hiding of nodes and edges and the traversals are not
+    supported). Node ids are non-negative integers, usually packed from
+    frame and object label (see pack_nodeid). Edge ids are consecutive
+    integers in the order of insertion.
+
+    Nodes are kept in rows of flat arrays, edges store the rows of head and
+    tail node. In and out arcs of a node are chained through the edge arrays
+    (first/last edge per node, next edge per edge), hence no per node
+    containers are allocated and adjacency queries do not copy any lists but
+    the ones they return.
+    """
+
+    __slots__ = ['_rows', '_node_ids', '_node_data', '_out_first',
+                 '_out_last', '_in_first', '_in_last', '_out_deg', '_in_deg',
+                 '_heads', '_tails', '_out_next', '_in_next', '_edge_data',
+                 '_nedges', 'edges']
+
+    def __init__(self):
+        super(TrackGraph, self).__init__()
+        # node id -> row
+        self._rows = dict()
+        self._node_ids = list()
+        self._node_data = list()
+        self._out_first = array('i')
+        self._out_last = array('i')
+        self._in_first = array('i')
+        self._in_last = array('i')
+        self._out_deg = array('i')
+        self._in_deg = array('i')
+
+        # indexed by edge id, edge data is sparse
+        self._heads = array('i')
+        self._tails = array('i')
+        self._out_next = array('i')
+        self._in_next = array('i')
+        self._edge_data = dict()
+        self._nedges = 0
+
+        self.edges = _EdgeView(self)
+
+    def add_node(self, node_id, node_data=None):
+        if node_id in self._rows:
+            raise Graph_duplicate_node(node_id)
+
+        self._rows[node_id] = len(self._node_ids)
+        self._node_ids.append(node_id)
+        self._node_data.append(node_data)
+        for adj in (self._out_first, self._out_last,
+                    self._in_first, self._in_last):
+            adj.append(NONE)
+        self._out_deg.append(0)
+        self._in_deg.append(0)
+
+    def update_node_data(self, node_id, node_data):
+        self._node_data[self._rows[node_id]] = node_data
+
+    def delete_node(self, node_id):
+        """Deletes the node and all in and out arcs."""
+        for edge_id in self.in_arcs(node_id):
+            self.delete_edge(edge_id)
+        for edge_id in self.out_arcs(node_id):
+            self.delete_edge(edge_id)
+        row = self._rows.pop(node_id)
+        # the row remains allocated
+        self._node_data[row] = None
+        self._node_ids[row] = None
+
+    def add_edge(self, head_id, tail_id, edge_data=None):
+        head = self._rows[head_id]
+        tail = self._rows[tail_id]
+        edge_id = len(self._heads)
+
+        self._heads.append(head)
+        self._tails.append(tail)
+        self._out_next.append(NONE)
+        self._in_next.append(NONE)
+        if edge_data is not None:
+            self._edge_data[edge_id] = edge_data
+
+        self._append_arc(head, edge_id, self._out_first, self._out_last,
+                         self._out_next)
+        self._append_arc(tail, edge_id, self._in_first, self._in_last,
+                         self._in_next)
+        self._out_deg[head] += 1
+        self._in_deg[tail] += 1
+        self._nedges += 1
+        return edge_id
+
+    def delete_edge(self, edge_id):
+        if not self.has_edge(edge_id):
+            raise KeyError(edge_id)
+        head = self._heads[edge_id]
+        tail = self._tails[edge_id]
+        self._remove_arc(head, edge_id, self._out_first, self._out_last,
+                         self._out_next)
+        self._remove_arc(tail, edge_id, self._in_first, self._in_last,
+                         self._in_next)
+        self._out_deg[head] -= 1
+        self._in_deg[tail] -= 1
+        self._heads[edge_id] = NONE
+        self._tails[edge_id] = NONE
+        self._edge_data.pop(edge_id, None)
+        self._nedges -= 1
+
+    @staticmethod
+    def _append_arc(row, edge_id, first, last, next_):
+        if last[row] == NONE:
+            first[row] = edge_id
+        else:
+            next_[last[row]] = edge_id
+        last[row] = edge_id
+
+    @staticmethod
+    def _remove_arc(row, edge_id, first, last, next_):
+        prev = NONE
+        current = first[row]
+        while current != edge_id:
+            prev = current
+            current = next_[current]
+
+        if prev == NONE:
+            first[row] = next_[edge_id]
+        else:
+            next_[prev] = next_[edge_id]
+        if last[row] == edge_id:
+            last[row] = prev
+        next_[edge_id] = NONE
+
+    @staticmethod
+    def _arcs(edge_id, next_):
+        arcs = []
+        while edge_id != NONE:
+            arcs.append(edge_id)
+            edge_id = next_[edge_id]
+        return arcs
+
+    def has_node(self, node_id):
+        return node_id in self._rows
+
+    def has_edge(self, edge_id):
+        return 0 <= edge_id < len(self._heads) and \
+            self._heads[edge_id] != NONE
+
+    def edge(self, head_id, tail_id):
+        """Returns the edge that connects (head_id, tail_id)."""
+        tail = self._rows.get(tail_id)
+        for edge_id in self.out_arcs(head_id):
+            if self._tails[edge_id] == tail:
+                return edge_id
+        raise Graph_no_edge((head_id, tail_id))
+
+    def number_of_nodes(self):
+        return len(self._rows)
+
+    def number_of_edges(self):
+        return self._nedges
+
+    def node_list(self):
+        """Return the node ids in the order of insertion."""
+        return [node_id for node_id in self._node_ids if node_id is not None]
+
+    def edge_list(self):
+        return list(self.edges)
+
+    def node_data(self, node_id):
+        return self._node_data[self._rows[node_id]]
+
+    def edge_data(self, edge_id):
+        if not self.has_edge(edge_id):
+            raise KeyError(edge_id)
+        return self._edge_data.get(edge_id)
+
+    def head(self, edge_id):
+        row = self._heads[edge_id]
+        if row == NONE:
+            raise KeyError(edge_id)
+        return self._node_ids[row]
+
+    def tail(self, edge_id):
+        row = self._tails[edge_id]
+        if row == NONE:
+            raise KeyError(edge_id)
+        return self._node_ids[row]
+
+    def out_arcs(self, node_id):
+        return self._arcs(self._out_first[self._rows[node_id]],
+                          self._out_next)
+
+    def in_arcs(self, node_id):
+        return self._arcs(self._in_first[self._rows[node_id]], self._in_next)
+
+    def arc_list(self, node_id):
+        return self.in_arcs(node_id) + self.out_arcs(node_id)
+
+    def out_degree(self, node_id):
+        return self._out_deg[self._rows[node_id]]
+
+    def in_degree(self, node_id):
+        return self._in_deg[self._rows[node_id]]
+
+    def degree(self, node_id):
+        row = self._rows[node_id]
+        return self._in_deg[row] + self._out_deg[row]
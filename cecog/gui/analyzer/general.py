@@ -34,6 +34,7 @@ class GeneralFrame(BaseFrame):
         self.add_group('image_import_namingschema', [('namingscheme',),],
                        layout='flow')
         self.add_group('image_import_structurefile', [('structure_filename',)])
+        self.add_input('image_import_ch5')
         self.add_group(None,
                        [('structure_file_pathin', (0,0,1,1)),
                         ('structure_file_pathout', (0,1,1,1)),
@@ -25,7 +25,11 @@ class OutputFrame(BaseFrame):
 
         self.add_group('hdf5_create_file',
                        [('hdf5_include_raw_images', (0,0,1,1)),
+                        ('hdf5_raw_images_chunks', (0,1,1,1)),
+                        ('hdf5_raw_images_compression', (0,2,1,1)),
                         ('hdf5_include_label_images', (1,0,1,1)),
+                        ('hdf5_label_images_chunks', (1,1,1,1)),
+                        ('hdf5_label_images_compression', (1,2,1,1)),
                         ('hdf5_include_crack', (3,0,1,1)),
                         ('hdf5_include_features', (4,0,1,1)),
                         ('hdf5_include_classification', (5,0,1,1)),
@@ -34,8 +38,13 @@ class OutputFrame(BaseFrame):
                         (None, (8,0,1,3)),
                         ('hdf5_compression', (9,0,1,1)),
                         ('hdf5_merge_positions', (10,0,1,1)),
+                        ('hdf5_write_buffer', (11,0,1,1)),
                         ])
         self.add_group('hdf5_reuse', [])
+        self.add_group('image_cache',
+                       [('image_cache_dir', (0,0,1,1)),
+                        ('image_cache_size', (1,0,1,1)),
+                        ])
 
         self.add_line()
         self.add_group(None,
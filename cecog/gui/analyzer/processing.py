@@ -220,6 +220,14 @@ class ProcessingFrame(BaseProcessorFrame, ExportSettings):
                         ('merged_errorcorrection', (2,0,1,1))],
                         sublinks=False, label='Merged channel')
 
+        self.add_line()
+        self.add_input('frame_workers')
+        self.add_input('feature_workers')
+        self.add_input('prefetch_frames')
+        self.add_input('prefetch_memory')
+        self.add_input('shared_image_memory')
+        self.add_input('memmap_tiff')
+
         self.add_expanding_spacer()
         self._init_control()
         self.log_window = SubProcessLogWindow()
@@ -188,7 +188,7 @@ class ImageViewer(QGraphicsView):
         scene = self.scene()
         for obj_id, obj in coords.iteritems():
             crack = obj.crack_contour
-            poly = QPolygonF([QPointF(*pos) for pos in crack])
+            poly = QPolygonF([QPointF(*pos) for pos in crack.tolist()])
             item = HoverPolygonItem(poly)
             item.setData(0, obj_id)
             item.setPen(QPen(self.contour_color))
@@ -200,7 +200,7 @@ class ImageViewer(QGraphicsView):
         scene = self.scene()
         for obj_id, obj in coords.iteritems():
             crack = obj.crack_contour
-            poly = QPolygonF([QPointF(*pos) for pos in crack])
+            poly = QPolygonF([QPointF(*pos) for pos in crack.tolist()])
             item = HoverPolygonItem(poly)
             item.setData(0, obj_id)
             if obj.roisize is not None:
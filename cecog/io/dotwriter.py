@@ -63,20 +63,21 @@ class DotWriter(object):
                 # scale the node size between 1.1 (100% prob) and 0.1 (1/n% prob, less possible)
                 width = 1.0 * (prob - classes) / (1.01 - classes) + 0.1
                 height = width
-                node_attrs += ['label="%s"' %node_id,
+                node_attrs += ['label="%s"' %self.tracker.format_nodeid(node_id),
                                "width=\"%.2f\"" % width,
                                "height=\"%.2f\"" % height,
                                'fixedsize="%s\"' % True]
             else:
                 node_attrs += ['fixedsize="%s\"' % True]
 
-            node = tmp_node %(node_id, ",".join(node_attrs))
+            node = tmp_node %(self.tracker.format_nodeid(node_id),
+                              ",".join(node_attrs))
             self._file.write(node)
 
         # write ranks (force node to be on the same ranks)
         for node, (frame, object_ids) in zip(timestrings, tracker.frames.iteritems()):
             tmp = "{%s}\n" % "; ".join(['rank=same'] +
-                                       ['"%s"' % tracker.node_id(frame, object_id)
+                                       ['"%d_%d"' % (frame, object_id)
                                         for object_id in object_ids])
             self._file.write(tmp)
 
@@ -99,4 +100,7 @@ class DotWriter(object):
                 self._traverseGraph(node_id, level+1)
 
     def _writeEdge(self, node_id, node_idn):
-        self._file.write('"%s" -> "%s"%s;\n' %(node_id, node_idn, self.EDGE_STYLE))
+        self._file.write('"%s" -> "%s"%s;\n'
+                         %(self.tracker.format_nodeid(node_id),
+                           self.tracker.format_nodeid(node_idn),
+                           self.EDGE_STYLE))
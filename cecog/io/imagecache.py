@@ -0,0 +1,119 @@
+"""
+imagecache.py
+
+Persistent on-disk cache of preprocessed images.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['ImageCache']
+
+import os
+import hashlib
+import tempfile
+import threading
+from os.path import join, dirname
+
+import numpy
+
+from cecog.util.util import makedirs
+
+
+class ImageCache(object):
+    """Content addressed cache of numpy arrays in a directory.
+
+    Keys are arbitrary tuples with a stable repr (strings, numbers, nested
+    tuples), the file name is the sha1 digest of the key. Hence a key must
+    contain everything the cached data depends on, e.g. source file names
+    and modification times and all processing parameters.
+
+    The total size of the cache is limited to max_bytes. If the limit is
+    exceeded, least recently used files are removed (files are touched on
+    every hit). The directory can be shared by several processes, files are
+    written atomically and files vanishing due to eviction by another
+    process are treated as misses.
+    """
+
+    EXTENSION = '.npy'
+    # evict down to this fraction of max_bytes to avoid a rescan per put
+    LOW_WATER = 0.9
+
+    def __init__(self, path, max_bytes):
+        super(ImageCache, self).__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # unknown until the first eviction scan
+        self._nbytes = None
+        makedirs(path)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return join(self.path, digest[:2], digest + self.EXTENSION)
+
+    def get(self, key):
+        """Return the cached array or None."""
+        filename = self._filename(key)
+        try:
+            data = numpy.load(filename)
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return data
+
+    def put(self, key, data):
+        filename = self._filename(key)
+        path = dirname(filename)
+        tmpfile = None
+        try:
+            makedirs(path)
+            fd, tmpfile = tempfile.mkstemp(suffix='.tmp', dir=path)
+            with os.fdopen(fd, 'wb') as fp:
+                numpy.save(fp, data)
+            nbytes = os.path.getsize(tmpfile)
+            os.rename(tmpfile, filename)
+        except (IOError, OSError):
+            # e.g. disk full or the same key was written concurrently
+            # (rename does not replace files on Windows)
+            if tmpfile is not None and os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            return
+
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes += nbytes
+            if self._nbytes is None or self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith(self.EXTENSION):
+                    continue
+                filename = join(dirpath, filename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filename))
+
+        nbytes = sum(f[1] for f in files)
+        if nbytes > self.max_bytes:
+            files.sort()
+            for _, size, filename in files:
+                if nbytes <= self.max_bytes*self.LOW_WATER:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                nbytes -= size
+        self._nbytes = nbytes
@@ -21,6 +21,7 @@ __all__ = ['DIMENSION_NAME_POSITION',
            'DIMENSION_NAME_WIDTH',
            'AxisIterator',
            'ImageContainer',
+           'ImagePrefetcher',
            'MetaData',
            'MetaImage',
            ]
@@ -28,8 +29,12 @@ __all__ = ['DIMENSION_NAME_POSITION',
 import os
 import copy
 import types
+import logging
+import sqlite3
+import threading
 import numpy
 import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 from PyQt4.QtCore import *
 
 from collections import OrderedDict
@@ -37,6 +42,7 @@ import vigra
 
 from cecog.environment import CecogEnvironment
 from cecog.traits.analyzer.general import SECTION_NAME_GENERAL
+from cecog.io.structurefile import read_structure_file, write_structure_file
 from cecog import ccore
 
 # XXX derive all this from numpy
@@ -61,7 +67,9 @@ META_INFO_TIMESTAMP = 'timestamp'
 META_INFO_WELL = 'well'
 META_INFO_SUBWELL = 'subwell'
 
-IMAGECONTAINER_FILENAME = 'cecog_imagecontainer___PL%s.pkl'
+IMAGECONTAINER_FILENAME = 'cecog_imagecontainer___PL%s.sqlite'
+# pickled importers up to version 1.6.0
+IMAGECONTAINER_FILENAME_PKL = 'cecog_imagecontainer___PL%s.pkl'
 IMAGECONTAINER_FILENAME_OLD = '.cecog_imagecontainer___PL%s.pkl'
 
 def importer_pickle(obj, filename):
@@ -75,6 +83,13 @@ def importer_unpickle(filename):
     f.close()
     return obj
 
+def importer_load(filename, scan_cache=False):
+    """Return the importer of a structure file or of a pickled importer
+    (legacy format)."""
+    if filename.endswith('.pkl'):
+        return importer_unpickle(filename)
+    return read_structure_file(filename, scan_cache)
+
 
 class MetaData(object):
 
@@ -326,6 +341,11 @@ class MetaImage(object):
     def set_raw_image(self, img):
         self._img = img
 
+    def clear(self):
+        """Release the image data, the image is read again on demand."""
+        self._img = None
+        self._img_c = None
+
     def set_cropped_image(self, img):
         self._img_c = img
 
@@ -423,6 +443,112 @@ class AxisIterator(object):
                 yield value, self.image_container.get_meta_image(coordinate)
 
 
+def _load_image(meta_image):
+    return meta_image._raw_image
+
+
+class ImagePrefetcher(object):
+    """Reads the images of the next frames ahead of the consumer.
+
+    The coordinates are grouped into frames (position, time) in the order
+    of iteration. A thread pool reads all channels and zslices of up to
+    depth frames ahead of the frame the consumer is currently at, as long
+    as the estimated size of images that are read but not yet consumed does
+    not exceed max_bytes (one frame is always read ahead).
+
+    The prefetcher replaces the image container in an AxisIterator chain,
+    get_meta_image returns the prefetched MetaImage and hands it over to
+    the consumer. Coordinates that were not scheduled are passed on to the
+    image container. Frames (position, time) in skip are not read ahead,
+    e.g. frames whose images are taken from a file written before.
+    """
+
+    NTHREADS = 4
+
+    def __init__(self, image_container, coordinates, depth, max_bytes=None,
+                 nthreads=None, skip=None):
+        super(ImagePrefetcher, self).__init__()
+        self.image_container = image_container
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+        meta_data = image_container.get_meta_data()
+        self._dim_x = meta_data.dim_x
+        self._dim_y = meta_data.dim_y
+        self._image_bytes = meta_data.dim_x*meta_data.dim_y* \
+            (1 if meta_data.pixel_type in (UINT8, INT8) else 2)
+
+        self._frames = []
+        self._frame_index = dict()
+        skip = set() if skip is None else set(skip)
+        for coordinate in coordinates:
+            frame = (coordinate.position, coordinate.time)
+            if frame in skip:
+                continue
+            if frame not in self._frame_index:
+                self._frame_index[frame] = len(self._frames)
+                self._frames.append([])
+            self._frames[self._frame_index[frame]].append(coordinate)
+
+        self._lock = threading.Lock()
+        # coordinate -> (MetaImage, AsyncResult)
+        self._pending = dict()
+        self._nbytes = 0
+        self._next = 0
+        self._current = -1
+        self._pool = ThreadPool(nthreads or self.NTHREADS)
+        with self._lock:
+            self._schedule()
+
+    @staticmethod
+    def _key(coordinate):
+        return (coordinate.position, coordinate.time, coordinate.channel,
+                coordinate.zslice)
+
+    def _schedule(self):
+        while self._next < len(self._frames) and \
+                self._next <= self._current + self.depth:
+            coordinates = self._frames[self._next]
+            nbytes = len(coordinates)*self._image_bytes
+            if self.max_bytes is not None and self._nbytes > 0 and \
+                    self._nbytes + nbytes > self.max_bytes:
+                break
+            for coordinate in coordinates:
+                meta_image = MetaImage(self.image_container, coordinate,
+                                       self._dim_y, self._dim_x)
+                result = self._pool.apply_async(_load_image, (meta_image, ))
+                self._pending[self._key(coordinate)] = (meta_image, result)
+            self._nbytes += nbytes
+            self._next += 1
+
+    def get_meta_image(self, coordinate):
+        key = self._key(coordinate)
+        with self._lock:
+            index = self._frame_index.get(key[:2])
+            if index is not None and index > self._current:
+                self._current = index
+            try:
+                meta_image, result = self._pending.pop(key)
+            except KeyError:
+                meta_image = result = None
+            else:
+                self._nbytes -= self._image_bytes
+            self._schedule()
+
+        if meta_image is None:
+            return self.image_container.get_meta_image(coordinate)
+        # a failed read is repeated (and raises) upon access of the image
+        result.wait()
+        return meta_image
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        with self._lock:
+            self._pending.clear()
+            self._nbytes = 0
+
+
 class Coordinate(object):
 
     def __init__(self, plate=None, position=None, time=None, channel=None,
@@ -459,6 +585,7 @@ class ImageContainer(object):
         self._path_in = OrderedDict()
         self._path_out = OrderedDict()
         self._importer = None
+        self._memmap_tiff = False
         self.current_plate = None
         self.has_timelapse = None
 
@@ -468,33 +595,91 @@ class ImageContainer(object):
         self._path_out[plate_id] = path_out
         # FIXME: check some dimensions!!!
 
+    def __getstate__(self):
+        # the importer is not pickled, a process that unpickles the
+        # container loads the structure file of the plate by path
+        state = self.__dict__.copy()
+        state['_importer'] = None
+        state['current_plate'] = None
+        return state
+
     def iterator(self, coordinate,
                  interrupt_time=False,
                  interrupt_channel=False,
-                 interrupt_zslice=False):
+                 interrupt_zslice=False,
+                 prefetch=0,
+                 prefetch_bytes=None,
+                 prefetch_skip=None):
+        """Nested iteration over the image coordinates (see AxisIterator).
+        With prefetch > 0 the images of up to prefetch frames are read ahead
+        in a thread pool, prefetch_bytes limits the memory of images read
+        ahead and frames (position, time) in prefetch_skip are not read
+        ahead (see ImagePrefetcher)."""
+        if prefetch > 0:
+            return self._iter_prefetched(coordinate, interrupt_time,
+                                         interrupt_channel, interrupt_zslice,
+                                         prefetch, prefetch_bytes,
+                                         prefetch_skip)
+        return self._axis_iterator(self, coordinate, interrupt_time,
+                                   interrupt_channel, interrupt_zslice)()
+
+    __call__ = iterator
+
+    def _axis_iterator(self, image_container, coordinate,
+                       interrupt_time=False,
+                       interrupt_channel=False,
+                       interrupt_zslice=False):
         meta_data = self.get_meta_data()
         # FIXME: linking of iterators should adapt to any scan-order
-        iter_zslice = AxisIterator(self, coordinate.zslice,
+        iter_zslice = AxisIterator(image_container, coordinate.zslice,
                                    meta_data.zslices, 'zslice')
-        iter_channel = AxisIterator(self, coordinate.channel,
+        iter_channel = AxisIterator(image_container, coordinate.channel,
                                     meta_data.channels, 'channel',
                                     interrupt_zslice, iter_zslice)
-        iter_time = AxisIterator(self, coordinate.time,
+        iter_time = AxisIterator(image_container, coordinate.time,
                                  meta_data.times, 'time',
                                  interrupt_channel, iter_channel)
-        iter_position = AxisIterator(self, coordinate.position,
+        iter_position = AxisIterator(image_container, coordinate.position,
                                      meta_data.positions, 'position',
                                      interrupt_time, iter_time)
-        return iter_position()
-
-    __call__ = iterator
+        return iter_position
+
+    def _iter_prefetched(self, coordinate, interrupt_time, interrupt_channel,
+                         interrupt_zslice, prefetch, prefetch_bytes,
+                         prefetch_skip=None):
+        # MetaImages read their image lazily, no image is read here
+        coordinates = [meta_image.coordinate for _, meta_image in
+                       self._axis_iterator(self, coordinate)()]
+        prefetcher = ImagePrefetcher(self, coordinates, prefetch,
+                                     prefetch_bytes, skip=prefetch_skip)
+        try:
+            for item in self._axis_iterator(prefetcher, coordinate,
+                                            interrupt_time, interrupt_channel,
+                                            interrupt_zslice)():
+                yield item
+        finally:
+            prefetcher.close()
 
     def set_plate(self, plate):
         if plate != self.current_plate:
             self.current_plate = plate
             filename = self._plates[plate]
-            self._importer = importer_unpickle(filename)
+            self._importer = importer_load(filename)
             self._importer.path = self._path_in[plate]
+            self._importer.memmap_tiff = self._memmap_tiff
+
+    def set_memmap_tiff(self, enabled):
+        """Read uncompressed multi-page tiff files memory mapped, see
+        AbstractImporter.memmap_tiff."""
+        self._memmap_tiff = enabled
+        if self._importer is not None:
+            self._importer.memmap_tiff = enabled
+
+    @property
+    def preprocessed(self):
+        """True if the images of the current plate are already preprocessed
+        (see AbstractImporter.preprocessed)."""
+        return self._importer is not None and self._importer.preprocessed
 
     def check_dimensions(self):
         self.has_timelapse = self._importer.meta_data.has_timelapse
@@ -506,6 +691,10 @@ class ImageContainer(object):
     def get_image(self, coordinate):
         return self._importer.get_image(coordinate)
 
+    def get_image_source(self, coordinate):
+        """Return filename and image index of the coordinate."""
+        return self._importer.get_image_source(coordinate)
+
     def get_meta_data(self):
         return self._importer.meta_data
 
@@ -529,7 +718,8 @@ class ImageContainer(object):
 
     @classmethod
     def _get_structure_filename(cls, settings, plate_id,
-                                path_plate_in, path_plate_out, use_old=False):
+                                path_plate_in, path_plate_out, use_old=False,
+                                use_pkl=False):
         if settings('General', 'structure_file_pathin'):
             path_structure = path_plate_in
         elif settings('General', 'structure_file_pathout'):
@@ -539,6 +729,8 @@ class ImageContainer(object):
                 settings('General', 'structure_file_extra_path_name')
         if use_old:
             filename_container = IMAGECONTAINER_FILENAME_OLD % plate_id
+        elif use_pkl:
+            filename_container = IMAGECONTAINER_FILENAME_PKL % plate_id
         else:
             filename_container = IMAGECONTAINER_FILENAME % plate_id
         return os.path.join(path_structure, filename_container)
@@ -567,14 +759,17 @@ class ImageContainer(object):
             # check if structure file exists
             filename = cls._get_structure_filename(settings, plate_id, path_plate_in, path_plate_out)
             if not os.path.isfile(filename):
-                # check old (hidden) filename for compatibility reasons
-                filename = cls._get_structure_filename(settings, plate_id, path_plate_in, path_plate_out, use_old=True)
+                # check pickled and old (hidden) filename for compatibility reasons
+                filename = cls._get_structure_filename(settings, plate_id, path_plate_in, path_plate_out, use_pkl=True)
                 if not os.path.isfile(filename):
-                    filename = None
+                    filename = cls._get_structure_filename(settings, plate_id, path_plate_in, path_plate_out, use_old=True)
+                    if not os.path.isfile(filename):
+                        filename = None
             yield plate_id, path_plate_in, path_plate_out, filename
 
     def iter_import_from_settings(self, settings, scan_plates=None):
-        from cecog.io.importer import IniFileImporter, FlatFileImporter
+        from cecog.io.importer import (IniFileImporter, FlatFileImporter,
+                                       CH5Importer)
         settings.set_section(SECTION_NAME_GENERAL)
 
         for info in self.iter_check_plates(settings):
@@ -597,10 +792,23 @@ class ImageContainer(object):
                     section_name = settings.get2('namingscheme')
                     importer = IniFileImporter(path_plate_in,
                                                config_parser, section_name)
+                    # incremental rescan based on the previous structure file
+                    if filename is not None:
+                        try:
+                            importer.use_previous_scan(
+                                importer_load(filename, scan_cache=True))
+                        except (EnvironmentError, EOFError, KeyError,
+                                pickle.UnpicklingError, sqlite3.Error) as e:
+                            logging.getLogger().warning(
+                                "Full rescan of plate '%s', structure file "
+                                "'%s' not usable: %s" %(plate_id, filename, e))
                 # read file structure according to dimension/structure file
                 elif settings.get2('image_import_structurefile'):
                     filename = settings.get2('structure_filename')
                     importer = FlatFileImporter(path_plate_in, filename)
+                # read raw images from the cellh5 files of a previous analysis
+                elif settings.get2('image_import_ch5'):
+                    importer = CH5Importer(path_plate_in)
 
                 # scan the file structure
                 importer.scan()
@@ -611,7 +819,7 @@ class ImageContainer(object):
                                                             path_plate_in,
                                                             path_plate_out)
 
-                    importer_pickle(importer, filename)
+                    write_structure_file(importer, filename)
                     self.register_plate(plate_id, path_plate_in,
                                         path_plate_out, filename)
             else:
@@ -20,11 +20,17 @@ __all__ = ['FileTokenImporter',
 
 import os
 import re
+import numpy
+import threading
+import h5py
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from cecog import ccore
 from cecog.util.util import read_table
 from cecog.util.stopwatch import StopWatch
 from cecog.util.token import Token, TokenHandler
+from cecog.io.tiffstack import open_tiff_stack
 
 from cecog.io.imagecontainer import (MetaData,
                                      DIMENSION_NAME_POSITION,
@@ -37,6 +43,9 @@ from cecog.io.imagecontainer import (MetaData,
                                      UINT8,
                                      UINT16,
                                      )
+
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'pixel_type',
+                                     'images'])
 TOKEN_P = Token('P', type_code='i', length='+', prefix='',
                 name=DIMENSION_NAME_POSITION)
 TOKEN_T = Token('T', type_code='i', length='+', prefix='',
@@ -82,6 +91,21 @@ class AbstractImporter(object):
     MULTIIMAGE_IGNORE = 'ignore'
     MULTIIMAGE_USE_ZSLICE = 'zslice'
 
+    # number of threads for directory listings and stat calls
+    SCAN_THREADS = 16
+
+    # read the pages of uncompressed multi-page tiff files from memory
+    # mapped files (opt-in, see ImageContainer.set_memmap_tiff)
+    memmap_tiff = False
+
+    # images are already preprocessed, i.e. a single 8 bit z-slice,
+    # normalized and registered (see CH5Importer)
+    preprocessed = False
+
+    # SharedImagePool of the process or None, images are decoded once
+    # by any process of a multiprocessing pool
+    image_pool = None
+
     def __init__(self, path,
                  extensions=None, ignore_prefixes=None, multi_image=None):
         self.path = os.path.normpath(path)
@@ -113,7 +137,9 @@ class AbstractImporter(object):
         """
         return self.meta_data.image_files > 0
 
-    def get_image(self, coordinate):
+    def get_image_source(self, coordinate):
+        """Return the absolute filename and the image index within the file
+        of an image coordinate."""
         index = 0
         zslice = coordinate.zslice
         if (self.has_multi_images and
@@ -127,6 +153,23 @@ class AbstractImporter(object):
         filename_abs = os.path.join(self.path, filename_rel)
         # make sure no back-slashes are left in the path
         filename_abs = filename_abs.replace('\\', '/')
+        return filename_abs, index
+
+    def get_image(self, coordinate):
+        filename_abs, index = self.get_image_source(coordinate)
+        if self.image_pool is None:
+            return self._read_image(filename_abs, index)
+
+        decode = lambda: self._read_image(filename_abs, index).toArray(True)
+        with self.image_pool.image((filename_abs, index), decode) as array:
+            return ccore.numpy_to_image(array, copy=True)
+
+    def _read_image(self, filename_abs, index):
+        if self.memmap_tiff:
+            image = self._get_mapped_image(filename_abs, index)
+            if image is not None:
+                return image
+
         if self.meta_data.pixel_type == UINT8:
             image = ccore.readImage(filename_abs, index)
         elif self.meta_data.pixel_type == UINT16:
@@ -135,6 +178,23 @@ class AbstractImporter(object):
             image = ccore.readImageUInt16(filename_abs, index)
         return image
 
+    def _get_mapped_image(self, filename, index):
+        """Return the image from the memory mapped tiff file or None if the
+        file has a single page, the page is not mappable or of another pixel
+        type. Single page files are read by ccore."""
+        if os.path.splitext(filename)[1].lower() not in ('.tif', '.tiff'):
+            return None
+        stack = open_tiff_stack(filename)
+        if stack is None or len(stack) < 2 or not stack.is_supported(index):
+            return None
+
+        page = stack[index]
+        if page.dtype != (numpy.uint8 if self.meta_data.pixel_type == UINT8
+                          else numpy.uint16):
+            return None
+        # ccore images own their data, the only copy of the page
+        return ccore.numpy_to_image(page, copy=True)
+
     def _build_dimension_lookup(self):
         s = StopWatch(start=True)
         lookup = {}
@@ -148,6 +208,9 @@ class AbstractImporter(object):
         print("Get dimensions: %s" %s.interim())
         s.reset(start=True)
 
+        if self.timestamps_from_file in ['mtime', 'ctime']:
+            self._read_file_timestamps(dimension_items)
+
         # if use_frame_indices is set in the ini file,
         # we make a first scan of the items and determine for each position
         # the list of timepoints.
@@ -179,8 +242,7 @@ class AbstractImporter(object):
             # import image info only once
             if not has_xy:
                 has_xy = True
-                info = ccore.ImageImportInfo(os.path.join(self.path,
-                                                          item['filename']))
+                info = self._image_info(item['filename'])
                 self.meta_data.set_image_info(info)
                 self.has_multi_images = False #info.images > 1
 
@@ -226,18 +288,10 @@ class AbstractImporter(object):
             if not zslice in lookup[position][time][channel]:
                 lookup[position][time][channel][zslice] = item['filename']
 
-            # allow to read timestamps from file if not present
+            # timestamps from file are already set, if enabled
             if META_INFO_TIMESTAMP in item:
                 timestamp = float(item[META_INFO_TIMESTAMP])
                 self.meta_data.append_absolute_time(position, time, timestamp)
-            elif self.timestamps_from_file in ['mtime', 'ctime']:
-                filename_full = os.path.join(self.path, item['filename'])
-                if self.timestamps_from_file == 'mtime':
-                    timestamp = os.path.getmtime(filename_full)
-                else:
-                    timestamp = os.path.getctime(filename_full)
-                item[META_INFO_TIMESTAMP] = timestamp
-                self.meta_data.append_absolute_time(position, time, timestamp)
 
             if META_INFO_WELL in item:
                 well = item[META_INFO_WELL]
@@ -280,9 +334,37 @@ class AbstractImporter(object):
         print('Build time: %s' %s.stop())
         return lookup
 
+    def _image_info(self, filename):
+        """Return the image info (width, height, pixel_type and images) of
+        an image file relative to path."""
+        return ccore.ImageImportInfo(os.path.join(self.path, filename))
+
     def _get_dimension_items(self):
         raise NotImplementedError()
 
+    def _read_file_timestamps(self, dimension_items):
+        """Set the timestamp of all items without one to the modification or
+        creation time of the file. The stat calls are issued concurrently,
+        which matters on network file systems."""
+        if self.timestamps_from_file == 'mtime':
+            get_time = os.path.getmtime
+        else:
+            get_time = os.path.getctime
+
+        items = [item for item in dimension_items
+                 if META_INFO_TIMESTAMP not in item]
+        filenames = [os.path.join(self.path, item['filename'])
+                     for item in items]
+        pool = ThreadPool(self.SCAN_THREADS)
+        try:
+            timestamps = pool.map(get_time, filenames, chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+
+        for item, timestamp in zip(items, timestamps):
+            item[META_INFO_TIMESTAMP] = timestamp
+
 
 class FileTokenImporter(AbstractImporter):
 
@@ -397,6 +479,149 @@ class FlatFileImporter(AbstractImporter):
         return table
 
 
+class _Hdf5Files(object):
+    """Keeps hdf5 files open for reading, per process."""
+
+    def __init__(self):
+        self._files = dict()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self, filename):
+        with self._lock:
+            if self._pid != os.getpid():
+                # file handles must not be shared with the parent process
+                self._files = dict()
+                self._pid = os.getpid()
+            if filename not in self._files:
+                self._files[filename] = h5py.File(filename, 'r')
+            return self._files[filename]
+
+_open_hdf5 = _Hdf5Files()
+
+
+class CH5Importer(AbstractImporter):
+    """Imports the raw images of the cellh5 files written by a previous
+    analysis (see TimeHolder) instead of the original image files.
+
+    path is a directory of cellh5 files of single positions, i.e. the hdf5
+    output directory (the file linking all positions is ignored). Images
+    are read from the 'channel' dataset of the positions, only frames
+    marked as valid are imported. The stored images are 8 bit images of a
+    single z-slice (z-slice selection, normalization and registration
+    already applied), the analysis skips these steps and the cropping of
+    images (see AbstractImporter.preprocessed).
+
+    The output directory of the analysis must be a different one, since
+    cellh5 files are overwritten.
+    """
+
+    EXTENSIONS = ['.ch5']
+    IGNORE_FILENAMES = ['_all_positions.ch5']
+
+    preprocessed = True
+
+    POSITION_PREFIX = '/sample/0/plate/%s/experiment/%s/position/%s'
+    CHANNEL_DEFINITION = '/definition/image/channel'
+
+    def __init__(self, path):
+        super(CH5Importer, self).__init__(path)
+        # position -> (dataset name, color -> channel index,
+        #              frame -> frame index)
+        self._ch5_index = dict()
+
+    def get_image_source(self, coordinate):
+        """Return filename and the index (channel, frame, zslice) of the
+        image in the dataset."""
+        filename, _ = super(CH5Importer, self).get_image_source(coordinate)
+        _, colors, frames = self._ch5_index[coordinate.position]
+        return filename, (colors[coordinate.channel],
+                          frames[coordinate.time], 0)
+
+    def get_image(self, coordinate):
+        filename, index = self.get_image_source(coordinate)
+        dset = _open_hdf5(filename)[self._ch5_index[coordinate.position][0]]
+        return ccore.numpy_to_image(dset[index], copy=True)
+
+    def _image_info(self, filename):
+        dset_name = self._ch5_index[os.path.splitext(filename)[0]][0]
+        f = h5py.File(os.path.join(self.path, filename), 'r')
+        try:
+            height, width = f[dset_name].shape[-2:]
+        finally:
+            f.close()
+        return ImageInfo(width, height, UINT8, 1)
+
+    @staticmethod
+    def _color_index(f):
+        """Return the mapping color channel -> index in the dataset. The
+        index enumerates the distinct colors of the processing channels."""
+        indices = dict()
+        colors = dict()
+        for row in f[CH5Importer.CHANNEL_DEFINITION]:
+            color = row['description']
+            if color not in indices:
+                indices[color] = len(indices)
+            if row['is_physical']:
+                colors[color] = indices[color]
+        return colors
+
+    def _get_dimension_items(self):
+        self._ch5_index = dict()
+        items = []
+        for filename in sorted(os.listdir(self.path)):
+            if os.path.splitext(filename)[1] not in self.extensions or \
+                    filename in self.IGNORE_FILENAMES or \
+                    filename[0] in self.ignore_prefixes:
+                continue
+            position = os.path.splitext(filename)[0]
+
+            f = h5py.File(os.path.join(self.path, filename), 'r')
+            try:
+                plate = f['/sample/0/plate'].keys()[0]
+                well = f['/sample/0/plate/%s/experiment' %plate].keys()[0]
+                pos = f['/sample/0/plate/%s/experiment/%s/position'
+                        %(plate, well)].keys()[0]
+                grp = f[self.POSITION_PREFIX %(plate, well, pos)]['image']
+                if 'channel' not in grp:
+                    continue
+
+                dset = grp['channel']
+                nframes = dset.shape[1]
+                valid = dset.attrs.get('valid', numpy.ones(nframes))
+                if 'time_lapse' in grp:
+                    time_lapse = grp['time_lapse'][:]
+                    frames = [int(f_) for f_ in time_lapse['frame']]
+                    timestamps = time_lapse['timestamp_abs']
+                else:
+                    frames = range(nframes)
+                    timestamps = None
+                colors = self._color_index(f)
+                self._ch5_index[position] = \
+                    (dset.name, colors, dict((frame, i) for i, frame
+                                             in enumerate(frames)))
+            finally:
+                f.close()
+
+            for idx, frame in enumerate(frames):
+                if not valid[idx]:
+                    continue
+                for color in colors:
+                    item = {DIMENSION_NAME_POSITION: position,
+                            DIMENSION_NAME_TIME: frame,
+                            DIMENSION_NAME_CHANNEL: color,
+                            DIMENSION_NAME_ZSLICE: 1,
+                            'filename': filename}
+                    if timestamps is not None:
+                        item[META_INFO_TIMESTAMP] = timestamps[idx]
+                    # position groups are named by subwell if well based
+                    if well != '0':
+                        item[META_INFO_WELL] = well
+                        item[META_INFO_SUBWELL] = pos
+                    items.append(item)
+        return items
+
+
 class IniFileImporter(AbstractImporter):
     '''
     Scan file structure based on config file (see ConfigParser) definitions.
@@ -494,15 +719,108 @@ class IniFileImporter(AbstractImporter):
 
         #print 'use_frame_indices: ', self.use_frame_indices
 
+        # a previous scan can be reused only with the same naming schema
+        self._scan_signature = (self._regex_subdirectories,
+                                self._regex_filename_substr,
+                                self._regex_dimensions,
+                                tuple(self.extensions),
+                                self.reformat_well,
+                                self.timestamps_from_file,
+                                self.allow_subfolder)
+        # per directory: mtime, sub-directories, dimension items
+        self._dir_cache = dict()
+        self._previous_dir_cache = dict()
+
     def __setstate__(self, state):
         super(IniFileImporter, self).__setstate__(state)
         if 'config_parser' in state:
             del self.config_parser
 
+    def use_previous_scan(self, importer):
+        """Reuse the directory scan of a previous importer (e.g. from the
+        structure file) for an incremental rescan. Directories whose mtime
+        did not change since are neither listed nor parsed again."""
+        if getattr(importer, '_scan_signature', None) == self._scan_signature:
+            self._previous_dir_cache = importer._dir_cache
+
+    def _scan_directory(self, dirpath, key):
+        """Return mtime, sub-directories and filenames of a directory. The
+        filenames are None if the directory is unchanged since the previous
+        scan."""
+        mtime = os.stat(dirpath).st_mtime
+        cached = self._previous_dir_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return mtime, cached[1], None
+
+        dirnames = []
+        filenames = []
+        for name in os.listdir(dirpath):
+            name_full = os.path.join(dirpath, name)
+            if os.path.isdir(name_full):
+                # like os.walk, symbolic links to directories are not followed
+                if not os.path.islink(name_full):
+                    dirnames.append(name)
+            else:
+                filenames.append(name)
+        # prune filenames by file extension
+        if len(self.extensions) > 0:
+            filenames = [x for x in filenames
+                         if os.path.splitext(x)[1].lower() in self.extensions]
+        # prune dirnames by regex search
+        dirnames = [x for x in dirnames
+                    if self._re_subdir.search(x) is not None]
+        return mtime, sorted(dirnames), sorted(filenames)
+
+    def _scan_tree(self, path, sub_folder=None):
+        """Scan the directory tree level by level, the directories of one
+        level are listed concurrently. Returns the directories in the order
+        of os.walk (top-down, sorted) and a dict of the scan results."""
+        key = lambda dirpath: (sub_folder, os.path.relpath(dirpath, path))
+        scans = dict()
+        level = [path]
+        pool = ThreadPool(self.SCAN_THREADS)
+        try:
+            while level:
+                results = pool.map(lambda d: self._scan_directory(d, key(d)),
+                                   level)
+                next_level = []
+                for dirpath, result in zip(level, results):
+                    scans[dirpath] = result
+                    next_level.extend([os.path.join(dirpath, x)
+                                       for x in result[1]])
+                level = next_level
+        finally:
+            pool.close()
+            pool.join()
+
+        ordered = []
+        stack = [path]
+        while stack:
+            dirpath = stack.pop()
+            ordered.append(dirpath)
+            stack.extend([os.path.join(dirpath, x)
+                          for x in reversed(scans[dirpath][1])])
+        return [(dirpath, key(dirpath), scans[dirpath]) for dirpath in ordered]
+
     def __get_token_list(self, path, sub_folder=None):
         token_list = []
 
-        re_subdir = re.compile(self._regex_subdirectories)
+        self._re_subdir = re.compile(self._regex_subdirectories)
+        for dirpath, key, (mtime, dirnames, filenames) in \
+                self._scan_tree(path, sub_folder):
+            if filenames is None:
+                tokens = self._previous_dir_cache[key][2]
+            else:
+                tokens = self.__parse_directory(path, dirpath, filenames,
+                                                sub_folder)
+            self._dir_cache[key] = (mtime, dirnames, tokens)
+            token_list.extend(tokens)
+        return token_list
+
+    def __parse_directory(self, path, dirpath, filenames, sub_folder=None):
+        tokens = []
+
+        re_subdir = self._re_subdir
         re_substr = re.compile(self._regex_filename_substr)
         re_dim = re.compile(self._regex_dimensions)
 
@@ -512,95 +830,87 @@ class IniFileImporter(AbstractImporter):
         re_well_str2 = r"\d{1,5}"
         re_well2 = re.compile(re_well_str2)
 
-        for dirpath, dirnames, filenames in os.walk(path):
-            # prune filenames by file extension
-            if len(self.extensions) > 0:
-                filenames = [x for x in filenames
-                             if os.path.splitext(x)[1].lower() in self.extensions]
-                filenames.sort()
-            # prune dirnames by regex search for next iteration of os.walk
-            # dirnames must be removed in-place!
-            for dirname in dirnames[:]:
-                if re_subdir.search(dirname) is None:
-                    dirnames.remove(dirname)
-
-            # extract dimension informations according to regex patterns from
-            # relative filename (including extension)
-            path_rel = os.path.relpath(dirpath, path)
-            search_path = re_subdir.search(os.path.split(dirpath)[1])
-
-            if not search_path is None:
-                result_path = search_path.groupdict()
-            else:
-                result_path = {}
-
-            for filename in filenames:
-                filename_rel = os.path.join(path_rel, filename)
-                # search substring to reduce relative filename for
-                # dimension search
-                search = re_substr.search(filename_rel)
-                if not search is None and len(search.groups()) > 0:
-                    found_name = search.groups()[0]
-                    # check substring according to regex pattern
-                    # extract dimension information
-                    search2 = re_dim.search(found_name)
-                    if not search2 is None:
-                        result = search2.groupdict()
-                        # use path data if not defined for the filename
-                        for key in [DIMENSION_NAME_POSITION, META_INFO_WELL,
-                                    META_INFO_SUBWELL]:
-                            if not key in result and key in result_path:
-                                result[key] = result_path[key]
-
-                        if META_INFO_WELL in result:
+        # extract dimension informations according to regex patterns from
+        # relative filename (including extension)
+        path_rel = os.path.relpath(dirpath, path)
+        search_path = re_subdir.search(os.path.split(dirpath)[1])
 
-                            # reformat well information
-                            if self.reformat_well:
-                                well = result[META_INFO_WELL]
-                                if re_well.match(well) is None:
-                                    if re_well2.match(well) is None:
-                                        raise MetaDataError("Well data '%s' not "
-                                                            "valid.\nValid are '%s' or '%s'"
-                                                            % (well, re_well_str, re_well_str2))
-                                    else:
-                                        result[META_INFO_WELL] = "%05d" % int(well)
+        if not search_path is None:
+            result_path = search_path.groupdict()
+        else:
+            result_path = {}
+
+        for filename in filenames:
+            filename_rel = os.path.join(path_rel, filename)
+            # search substring to reduce relative filename for
+            # dimension search
+            search = re_substr.search(filename_rel)
+            if not search is None and len(search.groups()) > 0:
+                found_name = search.groups()[0]
+                # check substring according to regex pattern
+                # extract dimension information
+                search2 = re_dim.search(found_name)
+                if not search2 is None:
+                    result = search2.groupdict()
+                    # use path data if not defined for the filename
+                    for key in [DIMENSION_NAME_POSITION, META_INFO_WELL,
+                                META_INFO_SUBWELL]:
+                        if not key in result and key in result_path:
+                            result[key] = result_path[key]
+
+                    if META_INFO_WELL in result:
+
+                        # reformat well information
+                        if self.reformat_well:
+                            well = result[META_INFO_WELL]
+                            if re_well.match(well) is None:
+                                if re_well2.match(well) is None:
+                                    raise MetaDataError("Well data '%s' not "
+                                                        "valid.\nValid are '%s' or '%s'"
+                                                        % (well, re_well_str, re_well_str2))
                                 else:
-                                    result[META_INFO_WELL] = "%s%02d" % (well[0].upper(), int(well[1:]))
-
-                            # subwell is converted to int (default 1)
-                            if not result.has_key(META_INFO_SUBWELL):
-                                result[META_INFO_SUBWELL] = 1
-                            elif result[META_INFO_SUBWELL] is None:
-                                result[META_INFO_SUBWELL] = 1
+                                    result[META_INFO_WELL] = "%05d" % int(well)
                             else:
-                                result[META_INFO_SUBWELL] = \
-                                    int(result[META_INFO_SUBWELL])
-
-                        # create position value if not found
-                        if not DIMENSION_NAME_POSITION in result:
-                            if META_INFO_WELL in result:
-                                result[DIMENSION_NAME_POSITION] = '%s_%02d' % \
-                                    (result[META_INFO_WELL],
-                                     result[META_INFO_SUBWELL])
-                            else:
-                                raise MetaDataError("Either 'position' or "
-                                                    "'well' information "
-                                                    "required in naming schema."
-                                                    )
-                        if sub_folder is None:
-                            result['filename'] = filename_rel
+                                result[META_INFO_WELL] = "%s%02d" % (well[0].upper(), int(well[1:]))
+
+                        # subwell is converted to int (default 1)
+                        if not result.has_key(META_INFO_SUBWELL):
+                            result[META_INFO_SUBWELL] = 1
+                        elif result[META_INFO_SUBWELL] is None:
+                            result[META_INFO_SUBWELL] = 1
                         else:
-                            result['filename'] = os.path.join(sub_folder, filename_rel)
-                        token_list.append(result)
-        return token_list
+                            result[META_INFO_SUBWELL] = \
+                                int(result[META_INFO_SUBWELL])
+
+                    # create position value if not found
+                    if not DIMENSION_NAME_POSITION in result:
+                        if META_INFO_WELL in result:
+                            result[DIMENSION_NAME_POSITION] = '%s_%02d' % \
+                                (result[META_INFO_WELL],
+                                 result[META_INFO_SUBWELL])
+                        else:
+                            raise MetaDataError("Either 'position' or "
+                                                "'well' information "
+                                                "required in naming schema."
+                                                )
+                    if sub_folder is None:
+                        result['filename'] = filename_rel
+                    else:
+                        result['filename'] = os.path.join(sub_folder, filename_rel)
+                    tokens.append(result)
+        return tokens
 
     def _get_dimension_items(self):
+        self._dir_cache = dict()
         token_list = self.__get_token_list(self.path)
         # try a possible allowed sub-folder in case no results are found in the original path
         if len(token_list) == 0 and not self.allow_subfolder is None:
             path = os.path.join(self.path, self.allow_subfolder)
             if os.path.isdir(path):
                 token_list = self.__get_token_list(path, self.allow_subfolder)
+        # not needed anymore, keeps the structure file small
+        self._previous_dir_cache = dict()
+        del self._re_subdir
         return token_list
 
 
@@ -0,0 +1,67 @@
+"""
+manifest.py
+
+Manifest of a per-position ch5 file, written once the file is complete.
+It holds plate, well and position name of the file, hence the merged file
+of all positions can be built without opening the position files.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['write_position_manifest', 'remove_position_manifest',
+           'read_position_manifest', 'find_position_manifests']
+
+import os
+import glob
+import json
+import tempfile
+from os.path import join, split, exists, isfile
+
+MANIFEST_EXTENSION = '.manifest'
+
+
+def replace_file(tmpfile, filename):
+    # os.rename does not replace files on Windows
+    if os.name == 'nt' and isfile(filename):
+        os.remove(filename)
+    os.rename(tmpfile, filename)
+
+def write_position_manifest(hdf5_filename, plate, well, position):
+    """Write the manifest of a complete ch5 file. The manifest is written
+    atomically, i.e. an existing manifest always refers to a closed file."""
+    path, fname = split(hdf5_filename)
+    fd, tmpfile = tempfile.mkstemp(prefix=fname, suffix='.tmp', dir=path)
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({'plate': plate, 'well': well, 'position': position,
+                       'filename': fname}, fp)
+        replace_file(tmpfile, hdf5_filename + MANIFEST_EXTENSION)
+    except:
+        if exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+def remove_position_manifest(hdf5_filename):
+    """Remove the manifest of a ch5 file that is going to be rewritten."""
+    try:
+        os.remove(hdf5_filename + MANIFEST_EXTENSION)
+    except OSError:
+        pass
+
+def read_position_manifest(filename):
+    """Return plate, well, position and the ch5 file name of a manifest."""
+    with open(filename, 'r') as fp:
+        manifest = json.load(fp)
+    return (str(manifest['plate']), str(manifest['well']),
+            str(manifest['position']),
+            join(split(filename)[0], manifest['filename']))
+
+def find_position_manifests(path):
+    return glob.glob(join(path, '*.ch5' + MANIFEST_EXTENSION))
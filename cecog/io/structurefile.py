@@ -0,0 +1,198 @@
+"""
+structurefile.py
+
+Indexed structure file of an imported plate. The image table holds one row
+per image file (position, time, channel, zslice, filename, timestamp, well,
+subwell) and is loaded per position on demand.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['DimensionLookup', 'write_structure_file', 'read_structure_file']
+
+import os
+import sqlite3
+import tempfile
+import threading
+import cPickle as pickle
+from collections import Mapping
+
+VERSION = 1
+
+# attributes stored in the image table or separately in the meta table
+_IMPORTER_SKIP = ('dimension_lookup', '_dir_cache', '_previous_dir_cache')
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE images (position, time INTEGER, channel, zslice INTEGER,
+                     filename TEXT, timestamp REAL, well TEXT, subwell TEXT);
+CREATE UNIQUE INDEX images_coordinate ON images
+    (position, time, channel, zslice);
+CREATE INDEX images_well ON images (well, subwell);
+"""
+
+
+def _connect(filename):
+    conn = sqlite3.connect(filename, check_same_thread=False)
+    # position and channel have no column type and keep their type,
+    # text is returned as str not unicode
+    conn.text_factory = str
+    return conn
+
+def _iter_rows(importer):
+    meta_data = importer.meta_data
+    for position, times in importer.dimension_lookup.iteritems():
+        well, subwell = meta_data.get_well_and_subwell(position)
+        timestamps = meta_data._timestamps_absolute.get(position, {})
+        for time, channels in times.iteritems():
+            timestamp = timestamps.get(time)
+            for channel, zslices in channels.iteritems():
+                for zslice, filename in zslices.iteritems():
+                    yield (position, time, channel, zslice, filename,
+                           timestamp, well, subwell)
+
+def write_structure_file(importer, filename):
+    """Write the dimension lookup of a scanned importer to the image table.
+    The importer itself is pickled without the lookup, the directory scan
+    cache of an IniFileImporter is stored separately and read only for
+    rescans (see read_structure_file).
+
+    The file is written to a temporary file first and replaced at the end.
+    """
+    state = dict((k, v) for k, v in importer.__dict__.iteritems()
+                 if k not in _IMPORTER_SKIP)
+    scan_cache = getattr(importer, '_dir_cache', None)
+
+    fd, tmpfile = tempfile.mkstemp(suffix='.tmp',
+                                   dir=os.path.dirname(filename))
+    os.close(fd)
+    try:
+        conn = _connect(tmpfile)
+        try:
+            conn.executescript(_SCHEMA)
+            meta = [('version', VERSION),
+                    ('importer', pickle.dumps((importer.__class__, state),
+                                              pickle.HIGHEST_PROTOCOL)),
+                    ('scan_cache', pickle.dumps(scan_cache,
+                                                pickle.HIGHEST_PROTOCOL))]
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             [(k, sqlite3.Binary(v) if isinstance(v, str)
+                               else v) for k, v in meta])
+            conn.executemany("INSERT INTO images VALUES (?,?,?,?,?,?,?,?)",
+                             _iter_rows(importer))
+            conn.commit()
+        finally:
+            conn.close()
+        # os.rename does not replace files on Windows
+        if os.path.isfile(filename):
+            os.remove(filename)
+        os.rename(tmpfile, filename)
+    except:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+def read_structure_file(filename, scan_cache=False):
+    """Return the importer of a structure file. The dimension lookup is
+    loaded lazily (see DimensionLookup). The directory scan cache is loaded
+    only if scan_cache is True."""
+    conn = _connect(filename)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    finally:
+        conn.close()
+
+    if meta.get('version') != VERSION:
+        raise IOError("Unsupported structure file version '%s'"
+                      %meta.get('version'))
+
+    cls, state = pickle.loads(str(meta['importer']))
+    importer = cls.__new__(cls)
+    importer.__setstate__(state)
+    importer.dimension_lookup = DimensionLookup(filename)
+    if scan_cache:
+        importer._dir_cache = pickle.loads(str(meta['scan_cache']))
+    return importer
+
+
+class DimensionLookup(Mapping):
+    """Read only nested mapping position -> time -> channel -> zslice ->
+    filename backed by the image table of a structure file.
+
+    Positions are loaded on first access. The database connection is opened
+    on demand, shared by all threads and reopened in forked processes.
+    Pickling preserves only the filename, hence positions are loaded again
+    in the process that unpickles the lookup.
+    """
+
+    def __init__(self, filename):
+        super(DimensionLookup, self).__init__()
+        self.filename = filename
+        self._init()
+
+    def _init(self):
+        self._positions = dict()
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.filename = state['filename']
+        self._init()
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._conn = _connect(self.filename)
+                self._pid = os.getpid()
+            return self._conn.execute(query, args).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._pid = None
+
+    def __getitem__(self, position):
+        try:
+            return self._positions[position]
+        except KeyError:
+            pass
+
+        rows = self._execute("SELECT time, channel, zslice, filename "
+                             "FROM images WHERE position=?", (position, ))
+        if not rows:
+            raise KeyError(position)
+
+        lookup = dict()
+        for time, channel, zslice, filename in rows:
+            lookup.setdefault(time, {}).setdefault(channel, {})[zslice] = \
+                filename
+        self._positions[position] = lookup
+        return lookup
+
+    def __contains__(self, position):
+        if position in self._positions:
+            return True
+        return bool(self._execute("SELECT 1 FROM images WHERE position=? "
+                                  "LIMIT 1", (position, )))
+
+    def __iter__(self):
+        rows = self._execute("SELECT DISTINCT position FROM images "
+                             "ORDER BY position")
+        return (row[0] for row in rows)
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(DISTINCT position) "
+                             "FROM images")[0][0]
@@ -0,0 +1,232 @@
+"""
+tiffstack.py
+
+Memory mapped access to the pages of uncompressed (multi-page) TIFF files
+e.g. OME-TIFF stacks. The image file directories (IFD) are parsed once,
+pages are returned as numpy views into the mapped file.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['TiffStack', 'TiffStackError', 'open_tiff_stack']
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy
+
+
+class TiffStackError(IOError):
+    pass
+
+
+# tiff tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+ORIENTATION = 274
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+TILE_WIDTH = 322
+SAMPLE_FORMAT = 339
+
+COMPRESSION_NONE = 1
+PHOTOMETRIC_MINISBLACK = 1
+ORIENTATION_TOPLEFT = 1
+SAMPLE_FORMAT_UINT = 1
+SAMPLE_FORMAT_INT = 2
+
+# field type -> struct format
+FIELD_TYPES = {1: 'B', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i', 16: 'Q',
+               17: 'q'}
+
+TAGS = (IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION,
+        PHOTOMETRIC, STRIP_OFFSETS, ORIENTATION, SAMPLES_PER_PIXEL,
+        STRIP_BYTE_COUNTS, TILE_WIDTH, SAMPLE_FORMAT)
+
+
+def _read_ifds(fp):
+    """Yield the tags (see TAGS) of all image file directories as dict."""
+    header = fp.read(4)
+    if header[:2] == 'II':
+        byteorder = '<'
+    elif header[:2] == 'MM':
+        byteorder = '>'
+    else:
+        raise TiffStackError('Not a tiff file')
+
+    version = struct.unpack(byteorder+'H', header[2:])[0]
+    if version == 42:
+        offset_fmt, count_fmt, entry_size, inline = 'I', 'H', 12, 4
+    elif version == 43:
+        # BigTIFF
+        fp.read(4)
+        offset_fmt, count_fmt, entry_size, inline = 'Q', 'Q', 20, 8
+    else:
+        raise TiffStackError('Unknown tiff version %d' %version)
+
+    def unpack(fmt, data):
+        return struct.unpack(byteorder+fmt, data)
+
+    offset_size = struct.calcsize(offset_fmt)
+    count_size = struct.calcsize(count_fmt)
+    entry_fmt = 'HH%s%ds' %(offset_fmt, inline)
+
+    offset = unpack(offset_fmt, fp.read(offset_size))[0]
+    visited = set()
+    while offset and offset not in visited:
+        visited.add(offset)
+        fp.seek(offset)
+        nentries = unpack(count_fmt, fp.read(count_size))[0]
+        entries = fp.read(nentries*entry_size)
+        next_offset = unpack(offset_fmt, fp.read(offset_size))[0]
+
+        tags = dict()
+        for i in xrange(nentries):
+            tag, ftype, count, value = unpack(
+                entry_fmt, entries[i*entry_size:(i+1)*entry_size])
+            if tag not in TAGS or ftype not in FIELD_TYPES:
+                continue
+            fmt = '%d%s' %(count, FIELD_TYPES[ftype])
+            size = struct.calcsize(fmt)
+            if size > inline:
+                fp.seek(unpack(offset_fmt, value[:offset_size])[0])
+                value = fp.read(size)
+            tags[tag] = unpack(fmt, value[:size])
+        yield byteorder, tags
+        offset = next_offset
+
+def _page(byteorder, tags):
+    """Return offset, shape and dtype of a page or None, if the page can not
+    be mapped (compressed, tiled, multi sample or non contiguous data) or
+    needs a transformation (photometric other than min-is-black,
+    orientation other than top-left)."""
+    try:
+        width = tags[IMAGE_WIDTH][0]
+        height = tags[IMAGE_LENGTH][0]
+        offsets = tags[STRIP_OFFSETS]
+        counts = tags[STRIP_BYTE_COUNTS]
+        photometric = tags[PHOTOMETRIC][0]
+    except KeyError:
+        return None
+
+    if photometric != PHOTOMETRIC_MINISBLACK or \
+            tags.get(ORIENTATION, (ORIENTATION_TOPLEFT, ))[0] != \
+            ORIENTATION_TOPLEFT:
+        return None
+
+    if tags.get(COMPRESSION, (COMPRESSION_NONE, ))[0] != COMPRESSION_NONE or \
+            tags.get(SAMPLES_PER_PIXEL, (1, ))[0] != 1 or \
+            TILE_WIDTH in tags:
+        return None
+
+    bits = tags.get(BITS_PER_SAMPLE, (1, ))[0]
+    sample_format = tags.get(SAMPLE_FORMAT, (SAMPLE_FORMAT_UINT, ))[0]
+    if bits not in (8, 16) or \
+            sample_format not in (SAMPLE_FORMAT_UINT, SAMPLE_FORMAT_INT):
+        return None
+    dtype = numpy.dtype('%s%s%d' %(byteorder,
+                                   'u' if sample_format == SAMPLE_FORMAT_UINT
+                                   else 'i', bits//8))
+
+    # strips must be stored en bloc
+    for i in xrange(1, len(offsets)):
+        if offsets[i] != offsets[i-1] + counts[i-1]:
+            return None
+    if sum(counts) < width*height*dtype.itemsize:
+        return None
+    return offsets[0], (height, width), dtype
+
+
+class TiffStack(object):
+    """Pages of a tiff file as numpy arrays.
+
+    Pages of uncompressed single sample images of 8 or 16 bit are returned
+    as read only views into the memory mapped file (data of non native
+    byte order is swapped into a copy). Other pages are reported as not
+    supported.
+    """
+
+    def __init__(self, filename):
+        super(TiffStack, self).__init__()
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as fp:
+                self._pages = [_page(*ifd) for ifd in _read_ifds(fp)]
+        except struct.error:
+            raise TiffStackError('Truncated tiff file %s' %filename)
+
+        if any(page is not None for page in self._pages):
+            self._data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+        else:
+            self._data = None
+
+    def __len__(self):
+        return len(self._pages)
+
+    def is_supported(self, index):
+        return 0 <= index < len(self._pages) and \
+            self._pages[index] is not None
+
+    def __getitem__(self, index):
+        if not self.is_supported(index):
+            raise TiffStackError('Page %d of %s is not supported'
+                                 %(index, self.filename))
+
+        offset, shape, dtype = self._pages[index]
+        nbytes = shape[0]*shape[1]*dtype.itemsize
+        page = self._data[offset:offset+nbytes].view(dtype).reshape(shape)
+        if not dtype.isnative:
+            page = page.astype(dtype.newbyteorder('='))
+        return page
+
+
+class _StackCache(object):
+    """Keeps the most recently used stacks of a process open. Stacks are
+    reopened if the file was modified."""
+
+    MAX_OPEN = 32
+
+    def __init__(self):
+        self._stacks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        signature = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            entry = self._stacks.pop(filename, None)
+            if entry is not None and entry[0] == signature:
+                self._stacks[filename] = entry
+                return entry[1]
+
+        try:
+            stack = TiffStack(filename)
+        except (IOError, ValueError):
+            # not a tiff file or not mappable, reported by stack = None
+            stack = None
+
+        with self._lock:
+            self._stacks[filename] = (signature, stack)
+            while len(self._stacks) > self.MAX_OPEN:
+                self._stacks.popitem(last=False)
+        return stack
+
+# returns the TiffStack of a file or None, if the file can not be parsed
+open_tiff_stack = _StackCache()
@@ -0,0 +1,144 @@
+"""
+writebuffer.py
+
+Write-behind buffer for hdf5 datasets.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['WriteBuffer', 'WriteBufferError']
+
+import threading
+from collections import deque
+
+import numpy
+
+
+class WriteBufferError(IOError):
+    pass
+
+
+class WriteBuffer(object):
+    """Queues assignments to h5py datasets in memory and performs them in
+    one dedicated writer thread. This allows to overlap hdf5 file io with
+    the processing of the next frame.
+
+    The amount of pending data is limited by max_bytes, write() blocks if
+    the limit would be exceeded. max_bytes = 0 disables the buffering, all
+    writes are performed synchronously.
+
+    Only the data transfer is deferred, creating or resizing datasets from
+    the calling thread is fine, since h5py serializes all calls into the
+    hdf5 library. Data passed to write() must not be modified afterwards.
+    """
+
+    def __init__(self, max_bytes=0):
+        super(WriteBuffer, self).__init__()
+        self.max_bytes = max_bytes
+        self._queue = deque()
+        self._nbytes = 0
+        self._error = None
+        self._closing = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    @property
+    def is_buffered(self):
+        return self.max_bytes > 0
+
+    @property
+    def pending_bytes(self):
+        return self._nbytes
+
+    @staticmethod
+    def nbytes(data):
+        """Estimate the memory footprint of data, variable length strings
+        are counted by their length."""
+        data = numpy.asarray(data)
+        if data.dtype == object:
+            return sum(len(item) for item in data.flat)
+        return data.nbytes
+
+    def write(self, dset, key, data):
+        """Deferred 'dset[key] = data'."""
+        if not self.is_buffered:
+            dset[key] = data
+            return
+
+        nbytes = self.nbytes(data)
+        with self._cond:
+            self._raise_error()
+            # a single item larger than max_bytes is accepted by an
+            # empty queue, otherwise it would block forever
+            while self._queue and (self._nbytes + nbytes > self.max_bytes):
+                self._cond.wait()
+                self._raise_error()
+
+            self._queue.append((dset, key, data, nbytes))
+            self._nbytes += nbytes
+            self._start()
+            self._cond.notify_all()
+
+    def flush(self):
+        """Block until all pending writes are performed."""
+        with self._cond:
+            while self._queue and self._error is None:
+                self._cond.wait()
+            self._raise_error()
+
+    def close(self):
+        """Drain the queue and stop the writer thread."""
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closing = True
+                self._cond.notify_all()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+            self._closing = False
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise WriteBufferError("Deferred hdf5 write failed: %s" %error)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='Hdf5WriteBuffer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._queue or self._closing):
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                dset, key, data, nbytes = self._queue[0]
+
+            try:
+                dset[key] = data
+            except Exception as e:
+                with self._cond:
+                    # pending writes are discarded after an error, the
+                    # file would be inconsistent anyway
+                    self._error = e
+                    self._queue.clear()
+                    self._nbytes = 0
+                    self._cond.notify_all()
+            else:
+                with self._cond:
+                    self._queue.popleft()
+                    self._nbytes -= nbytes
+                    self._cond.notify_all()
@@ -18,6 +18,7 @@ __source__ = '$URL$'
 import os
 from os.path import join,  isfile
 
+import numpy
 from svm import svm_model
 from cecog.learning.util import Normalizer
 from cecog.util.logger import LoggerObject
@@ -74,3 +75,28 @@ class LibSvmClassifier(LoggerObject):
             label = int(label)
             prob = {label: 1.0}
         return label, prob
+
+    def predict(self, samples):
+        """Classify a (n_samples, n_features) array. Normalization is done
+        for all samples at once, libSVM predicts sample by sample.
+        Returns a list of labels and a list of probability dicts.
+        """
+        return self.predict_scaled(self.normalizer.scale_samples(samples))
+
+    def predict_scaled(self, samples):
+        """Classify an already normalized (n_samples, n_features) array."""
+        if self.has_zero_insert:
+            samples = numpy.hstack((numpy.zeros((len(samples), 1)), samples))
+
+        labels = []
+        probs = []
+        for sample in samples.tolist():
+            if self.probability:
+                label, prob = self.svm_model.predict_probability(sample)
+                label = int(label)
+            else:
+                label = int(self.svm_model.predict(sample))
+                prob = {label: 1.0}
+            labels.append(label)
+            probs.append(prob)
+        return labels, probs
@@ -16,6 +16,7 @@ __source__ = '$URL$'
 
 import os
 import csv
+import multiprocessing
 
 from os.path import join, isdir, splitext, isfile
 from collections import OrderedDict
@@ -29,6 +30,7 @@ import svm
 from cecog.colors import unsupervised_cmap
 from cecog.learning.confusion_matrix import ConfusionMatrix
 from cecog.learning.util import SparseWriter, ArffWriter, ArffReader
+from cecog.learning.util import scale_factors
 from cecog.learning.classifier import LibSvmClassifier as Classifier
 from cecog.util.logger import LoggerObject
 from cecog.util.util import makedirs
@@ -371,6 +373,7 @@ class CommonClassPredictor(BaseLearner):
         self.strModelPrefix = "features"
         self.classifier = None
         self.nan_features = []
+        self._transforms = dict()
 
     def has_nan_features(self):
         for data in self.feature_data.itervalues():
@@ -383,14 +386,47 @@ class CommonClassPredictor(BaseLearner):
                                      svm_prefix=model_prefix,
                                      has_zero_insert=self.has_zero_insert)
         self.bProbability = self.classifier.probability
+        self._transforms = dict()
+
+    def _feature_transform(self, feature_names):
+        """Return column index, scale factor and offset arrays that turn
+        samples with columns feature_names into normalized classifier input.
+        The arrays are cached per tuple of feature names.
+        """
+        key = tuple(feature_names)
+        try:
+            return self._transforms[key]
+        except KeyError:
+            pass
+
+        normalizer = self.classifier.normalizer
+        if len(normalizer) != len(self._feature_names):
+            raise ValueError(('Number of features (%d) differs from length '
+                              'of scale factor list (%d)! Perhaps you need to '
+                              'repick and retrain your classifier.'
+                              %(len(self._feature_names), len(normalizer))))
+
+        # ensures to get the right features in the right order
+        lookup = dict([(name, i) for i, name in enumerate(feature_names)])
+        idx = np.array([lookup[name] for name in self._feature_names])
+        transform = (idx[normalizer.index], normalizer.factor,
+                     normalizer.offset)
+        self._transforms[key] = transform
+        return transform
 
     def predict(self, aFeatureData, feature_names):
-        # ensurse to get the right fearues in the right order
         # FIX what if NaN's are in in feature data
-        dctNameLookup = dict([(name,i) for i,name in enumerate(feature_names)])
-        lstRequiredFeatureData = [aFeatureData[dctNameLookup[x]]
-                                  for x in self._feature_names]
-        return self.classifier(lstRequiredFeatureData)
+        labels, probs = self.predict_batch(np.atleast_2d(aFeatureData),
+                                           feature_names)
+        return labels[0], probs[0]
+
+    def predict_batch(self, features, feature_names):
+        """Classify a (n_samples, n_features) array, the columns are given
+        by feature_names. Returns a list of labels and a list of probability
+        dicts."""
+        idx, factor, offset = self._feature_transform(feature_names)
+        samples = np.asarray(features)[:, idx] * factor + offset
+        return self.classifier.predict_scaled(samples)
 
     def getData(self, normalize=True):
         labels = []
@@ -402,10 +438,10 @@ class CommonClassPredictor(BaseLearner):
         labels = np.asarray(labels)
         samples = np.asarray(samples)
         if normalize:
-            lo = np.min(samples, 0)
-            hi = np.max(samples, 0)
-            # scale between -1 and +1
-            samples = 2.0 * (samples - lo) / (hi - lo + 0.0000001) - 1.0
+            # scale between -1 and +1, same as the Normalizer does
+            factor, offset = scale_factors(np.min(samples, 0),
+                                           np.max(samples, 0))
+            samples = samples * factor + offset
         # FIXME: stupid libSVM conversions
         labels = map(int, labels)
         samples = samples.tolist()
@@ -510,7 +546,8 @@ class CommonClassPredictor(BaseLearner):
         return weight, weight_label
 
     def gridSearch(self, fold=5, c_info=None, g_info=None,
-                   probability=False, compensation=True):
+                   probability=False, compensation=True, processes=None,
+                   refine=False):
         best_accuracy = 0
         best_l2c = None
         best_l2g = None
@@ -519,7 +556,9 @@ class CommonClassPredictor(BaseLearner):
         for n,l2c,l2g,conf in self.iterGridSearchSVM(c_info=c_info, g_info=g_info,
                                                      fold=fold,
                                                      probability=probability,
-                                                     compensation=compensation):
+                                                     compensation=compensation,
+                                                     processes=processes,
+                                                     refine=refine):
             accuracy = conf.ac_sample
             if accuracy > best_accuracy:
                 best_accuracy = accuracy
@@ -529,7 +568,20 @@ class CommonClassPredictor(BaseLearner):
         return n, best_l2c, best_l2g, best_conf
 
     def iterGridSearchSVM(self, c_info=None, g_info=None, fold=5,
-                          probability=False, compensation=True):
+                          probability=False, compensation=True,
+                          processes=None, refine=False):
+        """Cross validation of a RBF-SVM on a grid of log2(C) and log2(gamma)
+        values. Yields tuples (n, log2c, log2g, confusion matrix), n is the
+        total number of grid points.
+
+        The grid points are evaluated in a pool of 'processes' worker
+        processes (None means one per cpu, 1 disables the pool), results are
+        yielded in grid order as soon as they are available.
+
+        If refine is True, the grid is evaluated with twice the step size
+        first and afterwards only the neighbours of the best point of this
+        coarse grid are evaluated with the original step size.
+        """
         swap = lambda a,b: (b,a)
         if not c_info is None and len(c_info) >= 3:
             c_begin, c_end, c_step = c_info[:3]
@@ -548,36 +600,104 @@ class CommonClassPredictor(BaseLearner):
         g_step = abs(g_step)
 
         labels, samples = self.getData(normalize=True)
-        problem = svm.svm_problem(labels, samples)
 
         if compensation:
             weight, weight_label = self._calculateCompensation(labels)
+        else:
+            weight, weight_label = None, None
 
-        n = (c_end - c_begin) / c_step + 1
-        n *= (g_end - g_begin) / g_step + 1
-
-        l2c = c_begin
-        while l2c <= c_end:
-            l2g = g_begin
-            while l2g <= g_end:
-
-                param = svm.svm_parameter(kernel_type=svm.RBF,
-                                          C=2.**l2c, gamma=2.**l2g,
-                                          probability=1 if probability else 0)
-                if compensation:
-                    param.weight = weight
-                    param.weight_label = weight_label
-                    param.nr_weight = len(weight)
+        def grid(c_step_, g_step_):
+            return [(l2c, l2g) for l2c in _grid_axis(c_begin, c_end, c_step_)
+                    for l2g in _grid_axis(g_begin, g_end, g_step_)]
 
-                predictions = svm.cross_validation(problem, param, fold)
-                predictions = map(int, predictions)
+        if refine:
+            points = grid(2*c_step, 2*g_step)
+            # upper bound, the exact number is known after the coarse grid
+            n = len(points) + 8
+        else:
+            points = grid(c_step, g_step)
+            n = len(points)
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = min(processes, len(points))
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes,
+                                        initializer=_init_gridsearch,
+                                        initargs=(labels, samples))
+            evaluate = lambda tasks: pool.imap(_cross_validation_task, tasks)
+        else:
+            pool = None
+            problem = svm.svm_problem(labels, samples)
+            evaluate = lambda tasks: (_cross_validation(problem, *task)
+                                      for task in tasks)
 
-                conf = ConfusionMatrix.from_lists(labels, predictions,
-                                                  self.class_names.keys())
-                yield n, l2c, l2g, conf
+        try:
+            best = None
+            best_accuracy = -1
+            evaluated = set()
+            while points:
+                tasks = [(l2c, l2g, fold, probability, weight, weight_label)
+                         for l2c, l2g in points]
+                for (l2c, l2g), predictions in zip(points, evaluate(tasks)):
+                    conf = ConfusionMatrix.from_lists(labels, predictions,
+                                                      self.class_names.keys())
+                    if conf.ac_sample > best_accuracy:
+                        best_accuracy = conf.ac_sample
+                        best = (l2c, l2g)
+                    evaluated.add((l2c, l2g))
+                    yield n, l2c, l2g, conf
+
+                if not refine or best is None:
+                    break
+                # neighbours of the best point on the fine grid
+                fine = grid(c_step, g_step)
+                points = [(l2c, l2g) for l2c, l2g in fine
+                          if abs(l2c - best[0]) <= c_step and
+                          abs(l2g - best[1]) <= g_step and
+                          (l2c, l2g) not in evaluated]
+                n = len(evaluated) + len(points)
+                refine = False
+        finally:
+            if pool is not None:
+                # the generator might not be exhausted e.g. on user abort
+                pool.terminate()
+                pool.join()
+
+
+def _grid_axis(begin, end, step):
+    values = []
+    value = begin
+    while value <= end:
+        values.append(value)
+        value += step
+    return values
+
+def _cross_validation(problem, l2c, l2g, fold, probability, weight,
+                      weight_label):
+    param = svm.svm_parameter(kernel_type=svm.RBF,
+                              C=2.**l2c, gamma=2.**l2g,
+                              probability=1 if probability else 0)
+    if weight is not None:
+        param.weight = weight
+        param.weight_label = weight_label
+        param.nr_weight = len(weight)
+
+    predictions = svm.cross_validation(problem, param, fold)
+    return map(int, predictions)
+
+# svm problem of a grid search worker process, libsvm objects can not be
+# pickled, they are created once per process
+_gridsearch_problem = None
+
+def _init_gridsearch(labels, samples):
+    global _gridsearch_problem
+    _gridsearch_problem = svm.svm_problem(labels, samples)
+
+def _cross_validation_task(task):
+    return _cross_validation(_gridsearch_problem, *task)
 
-                l2g += g_step
-            l2c += c_step
 
 class CommonObjectLearner(BaseLearner):
 
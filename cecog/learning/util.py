@@ -16,6 +16,19 @@ __source__ = '$URL$'
 
 import numpy
 
+
+def scale_factors(lo, hi, mode=0):
+    """Return factor and offset arrays that map values from [lo, hi] to
+    [-1, 1] (mode 0) or [0, 1] (mode 1), i.e. value*factor + offset.
+    """
+    factor = 1.0 / (numpy.asarray(hi) - lo + 0.0000001)
+    offset = -lo * factor
+    if mode == 0:
+        factor = 2.0 * factor
+        offset = 2.0 * offset - 1.0
+    return factor, offset
+
+
 class Normalizer(object):
 
     def __init__(self, strFilepath):
@@ -34,26 +47,30 @@ class Normalizer(object):
                                   float(lstLine[2])))
         oFile.close()
 
+        # the range file compiled to arrays, scaling is one array expression
+        scale = numpy.array(self.lstScale, dtype=float).reshape((-1, 3))
+        self.index = scale[:, 0].astype(int)
+        self.factor, self.offset = scale_factors(scale[:, 1], scale[:, 2],
+                                                 self.iMode)
+
+    def __len__(self):
+        return len(self.lstScale)
+
     def scale(self, lstValues):
-        if len(lstValues) != len(self.lstScale):
+        return self.scale_samples([lstValues])[0].tolist()
+
+    __call__ = scale
+
+    def scale_samples(self, samples):
+        """Scale a (n_samples, n_features) array at once."""
+        samples = numpy.asarray(samples, dtype=float)
+        if samples.ndim != 2 or samples.shape[1] != len(self):
             raise ValueError('Length of value list (%d) differs from length '
                              'of scale factor list (%d)!'
                              'Perhaps you need to repick and retrain'
                              'your classfier' % \
-                                 (len(lstValues), len(self.lstScale)))
-        if self.iMode == 0:
-            # range [-1,1]
-            lstResults = [2.0 * (lstValues[i] - lo) / (hi - lo + 0.0000001) - 1.0
-                          for i,lo,hi in self.lstScale
-                         ]
-        else:
-            # range [0,1]
-            lstResults = [(lstValues[i] - lo) / (hi - lo + 0.0000001)
-                          for i,lo,hi in self.lstScale
-                         ]
-        return lstResults
-
-    __call__ = scale
+                                 (samples.shape[-1], len(self)))
+        return samples[:, self.index] * self.factor + self.offset
 
 
 class ArffReader(object):
@@ -0,0 +1,169 @@
+"""
+imagepool.py
+
+Decoded images shared by the processes of a multiprocessing pool.
+
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+__all__ = ['SharedImagePool']
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from os.path import join, isdir, exists
+from contextlib import contextmanager
+
+import numpy
+
+# memory backed file system, falls back to the default temp directory
+SHM_DIR = '/dev/shm' if isdir('/dev/shm') else None
+
+
+class SharedImagePool(object):
+    """Pool of named shared buffers holding decoded images.
+
+    A buffer is a file in a memory backed directory (/dev/shm), processes
+    attach to it as read only numpy memmap, i.e. all processes share the
+    same physical pages. The buffer table (name, shape, dtype, size,
+    reference count, last access) is a dict of a multiprocessing.Manager
+    and guarded by a manager lock, hence the pool can be passed to the
+    worker processes of a multiprocessing.Pool (e.g. as initargs).
+
+    Buffers are reference counted. Unreferenced buffers are kept as cache
+    and removed (least recently used first) if the pool exceeds max_bytes.
+    Referenced buffers are never removed, i.e. the pool may temporarily
+    grow beyond max_bytes. The process that created the pool removes all
+    buffers on close().
+    """
+
+    def __init__(self, manager, max_bytes, path=None):
+        super(SharedImagePool, self).__init__()
+        self.max_bytes = max_bytes
+        self.path = tempfile.mkdtemp(prefix='cecog-images-',
+                                     dir=SHM_DIR if path is None else path)
+        self._owner = os.getpid()
+        self._entries = manager.dict()
+        self._lock = manager.Lock()
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def _map(self, entry):
+        name, shape, dtype = entry[:3]
+        return numpy.memmap(join(self.path, name), dtype=numpy.dtype(dtype),
+                            mode='r', shape=shape)
+
+    def _acquire(self, name):
+        """Increment the reference count and return the entry of name or
+        None if name is not in the pool."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry = entry[:4] + (entry[4]+1, time.time())
+                self._entries[name] = entry
+            return entry
+
+    def attach(self, key):
+        """Return the image of key as read only array and increment the
+        reference count or return None if the key is not in the pool."""
+        entry = self._acquire(self._name(key))
+        if entry is None:
+            return None
+        return self._map(entry)
+
+    def _write(self, name, array):
+        # buffers are complete once renamed
+        fd, tmpfile = tempfile.mkstemp(prefix=name, suffix='.tmp',
+                                       dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(array.data)
+            os.rename(tmpfile, join(self.path, name))
+        except OSError:
+            # rename does not replace files on Windows
+            os.remove(tmpfile)
+
+    def create(self, key, array):
+        """Copy array into the buffer of key (unless another process was
+        faster) and attach to it."""
+        name = self._name(key)
+        array = numpy.ascontiguousarray(array)
+
+        # referenced buffers are never evicted
+        entry = self._acquire(name)
+        if entry is None:
+            # data is written outside the lock
+            self._write(name, array)
+
+            with self._lock:
+                # the buffer of another process might have been evicted
+                # in the meantime
+                if not exists(join(self.path, name)):
+                    self._write(name, array)
+                entry = self._entries.get(name)
+                if entry is None:
+                    entry = (name, array.shape, array.dtype.str,
+                             array.nbytes, 1, time.time())
+                else:
+                    entry = entry[:4] + (entry[4]+1, time.time())
+                self._entries[name] = entry
+                self._evict()
+        return self._map(entry)
+
+    def release(self, key):
+        name = self._name(key)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries[name] = entry[:4] + (max(0, entry[4]-1),
+                                                   entry[5])
+
+    @contextmanager
+    def image(self, key, decode):
+        """Attach to the image of key, decode() is called only if the image
+        is not in the pool yet. The reference is released on exit."""
+        array = self.attach(key)
+        if array is None:
+            array = self.create(key, decode())
+        try:
+            yield array
+        finally:
+            self.release(key)
+
+    def _evict(self):
+        # caller holds the lock
+        entries = self._entries.values()
+        nbytes = sum(e[3] for e in entries)
+        for entry in sorted(entries, key=lambda e: e[5]):
+            if nbytes <= self.max_bytes:
+                break
+            if entry[4] > 0:
+                continue
+            del self._entries[entry[0]]
+            nbytes -= entry[3]
+            try:
+                os.remove(join(self.path, entry[0]))
+            except OSError:
+                # still mapped by a process on Windows, removed by close()
+                pass
+
+    @property
+    def nbytes(self):
+        return sum(e[3] for e in self._entries.values())
+
+    def close(self):
+        """Remove all buffers, only effective in the creating process."""
+        if os.getpid() == self._owner:
+            self._entries.clear()
+            shutil.rmtree(self.path, ignore_errors=True)
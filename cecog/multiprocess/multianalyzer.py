@@ -18,7 +18,7 @@ import logging
 import traceback
 import threading
 import SocketServer
-from multiprocessing import Pool
+from multiprocessing import Pool, Manager
 
 from PyQt4 import QtCore
 
@@ -29,6 +29,8 @@ from cecog.analyzer.core import AnalyzerCore
 from cecog.threads.analyzer import AnalyzerThread
 from cecog.threads.corethread import ProgressMsg
 from cecog.multiprocess import mplogging as lg
+from cecog.multiprocess.imagepool import SharedImagePool
+from cecog.io.importer import AbstractImporter
 from cecog.environment import CecogEnvironment
 from cecog.traits.config import ConfigSettings
 
@@ -37,6 +39,11 @@ class MultiProcessingError(Exception):
     pass
 
 
+def initialyze_process(port, image_pool=None):
+    lg.initialyze_process(port)
+    AbstractImporter.image_pool = image_pool
+
+
 def core_helper(plate, settings_dict, imagecontainer, position, version,
                 redirect=True, debug=False):
     """Embeds analysis of a positon in a single function"""
@@ -103,8 +110,21 @@ class MultiAnalyzerThread(AnalyzerThread):
         self.log_receiver = lg.LoggingReceiver(port=0)
         port = self.log_receiver.server_address[1]
 
-        self.pool = Pool(self.ncpu, initializer=lg.initialyze_process,
-                         initargs=(port,))
+        # images decoded once and shared by all workers. Opt-in, workers
+        # process disjoint positions and do not read the same images yet,
+        # hence the pool only adds overhead for now.
+        self._manager = None
+        self.image_pool = None
+        pool_size = self._settings('Processing', 'shared_image_memory')
+        if pool_size > 0:
+            logging.getLogger().warning(
+                "Shared image memory gives no benefit, positions are "
+                "processed by one process each.")
+            self._manager = Manager()
+            self.image_pool = SharedImagePool(self._manager, pool_size*2**20)
+
+        self.pool = Pool(self.ncpu, initializer=initialyze_process,
+                         initargs=(port, self.image_pool))
 
         self.parent().log_window.init_process_list( \
             [str(p.pid) for p in self.pool._pool])
@@ -132,6 +152,12 @@ class MultiAnalyzerThread(AnalyzerThread):
         self.log_receiver.server_close()
         self.log_receiver_thread.join()
 
+    def close_image_pool(self):
+        if self.image_pool is not None:
+            self.image_pool.close()
+            self._manager.shutdown()
+            self.image_pool = None
+
     def join(self):
         self.pool.close()
         self.pool.join()
@@ -155,6 +181,7 @@ class MultiAnalyzerThread(AnalyzerThread):
                 raise MultiProcessingError(msg)
         finally:
             self.close_logreceiver()
+            self.close_image_pool()
             if len(hdf5_link_list) > 0:
                 hdf5_link_list = reduce(lambda x, y: x + y, hdf5_link_list)
             link_hdf5_files(sorted(hdf5_link_list))
@@ -167,6 +194,7 @@ class MultiAnalyzerThread(AnalyzerThread):
             self._mutex.unlock()
         # timing is essential, flag must be set before terminate is called
         self.pool.terminate()
+        self.close_image_pool()
         if wait:
             self.wait()
         self.aborted.emit()
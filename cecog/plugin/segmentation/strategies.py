@@ -12,6 +12,8 @@
 import os
 import re
 import numpy
+from scipy import ndimage
+from multiprocessing.pool import ThreadPool
 from cecog import ccore
 from cecog.gui.guitraits import (BooleanTrait,
                                  IntTrait,
@@ -52,6 +54,10 @@ class SegmentationPluginPrimary(_SegmentationPlugin):
               ('postprocessing_intensity_max', IntTrait(-1, -1, 1000000, label='Max. average intensity')),
               ('removeborderobjects', BooleanTrait(True, label='Remove border objects')),
               ('holefilling', BooleanTrait(True, label='Fill holes')),
+              ('tiled', BooleanTrait(False, label='Tiled segmentation')),
+              ('tile_size', IntTrait(2048, 128, 1000000, label='Tile size')),
+              ('tile_overlap', IntTrait(128, 0, 100000, label='Tile overlap')),
+              ('tile_workers', IntTrait(1, 1, 64, label='Parallel tiles')),
              ]
 
     # the : at the beginning indicates a QRC link with alias 'plugins/segmentation/local_adaptive_threshold'
@@ -80,6 +86,11 @@ class SegmentationPluginPrimary(_SegmentationPlugin):
                          ('postprocessing_intensity_min', (1, 0, 1, 1)),
                          ('postprocessing_intensity_max', (1, 1, 1, 1)),
                          ])
+        panel.add_group('tiled',
+                        [('tile_size', (0, 0, 1, 1)),
+                         ('tile_overlap', (0, 1, 1, 1)),
+                         ('tile_workers', (1, 0, 1, 1)),
+                         ])
 
     @stopwatch()
     def prefilter(self, img_in, radius=None):
@@ -148,10 +159,9 @@ class SegmentationPluginPrimary(_SegmentationPlugin):
         container.valid_ids = valid_ids
         container.rejected_ids = rejected_ids
 
-    @stopwatch()
-    def _run(self, meta_image):
-        image = meta_image.image
-
+    def binary(self, image, dtype):
+        """Binary image of the local adaptive threshold(s), hole filling
+        and split & merge correction."""
         img_prefiltered = self.prefilter(image)
         img_bin1 = self.threshold(img_prefiltered, self.params['latwindowsize'], self.params['latlimit'])
 
@@ -164,7 +174,7 @@ class SegmentationPluginPrimary(_SegmentationPlugin):
 
             # replacement for not working ccore.projectImage
             img_bin = numpy.zeros((img_bin2.height, img_bin2.width),
-                                 dtype=meta_image.format)
+                                 dtype=dtype)
             img_bin = ccore.numpy_to_image(img_bin, copy=True)
             ccore.zproject(img_bin, [img_bin1, img_bin2], ccore.ProjectionType.MaxProjection)
         else:
@@ -185,8 +195,102 @@ class SegmentationPluginPrimary(_SegmentationPlugin):
                                                self.params['intensitywatershed_maximasize'],
                                                self.params['intensitywatershed_minmergesize'],
                                                kind='intensity')
+        return img_bin
+
+    def _tile_overlap(self):
+        # the threshold windows must fit into the overlap, otherwise
+        # the thresholds differ at the tile borders
+        windows = [self.params['latwindowsize']]
+        if self.params['lat2']:
+            windows.append(self.params['latwindowsize2'])
+        return max(self.params['tile_overlap'],
+                   max(windows) + self.params['medianradius'])
+
+    def _tiles(self, height, width):
+        size = self.params['tile_size']
+        for y0 in xrange(0, height, size):
+            for x0 in xrange(0, width, size):
+                yield (y0, min(y0+size, height), x0, min(x0+size, width))
+
+    def _segment_tile(self, array, tile, overlap):
+        """Segment a tile incl. overlap. Return the upper left corner and
+        the labels of the objects owned by the tile, i.e. with the centroid
+        inside the tile (without overlap), and the number of objects."""
+        y0, y1, x0, x1 = tile
+        height, width = array.shape
+        ty0, tx0 = max(0, y0-overlap), max(0, x0-overlap)
+        ty1, tx1 = min(height, y1+overlap), min(width, x1+overlap)
+
+        image = ccore.numpy_to_image(
+            numpy.ascontiguousarray(array[ty0:ty1, tx0:tx1]), copy=True)
+        img_bin = self.binary(image, array.dtype).toArray(copy=False) > 0
+
+        # 8-neighborhood as the labeling of ImageMaskContainer
+        labels, nlabels = ndimage.label(img_bin, numpy.ones((3, 3)))
+        centers = ndimage.center_of_mass(img_bin, labels,
+                                         xrange(1, nlabels+1))
+        centers = numpy.floor(numpy.array(centers).reshape((-1, 2)))
+        owned = ((centers[:, 0] + ty0 >= y0) & (centers[:, 0] + ty0 < y1) &
+                 (centers[:, 1] + tx0 >= x0) & (centers[:, 1] + tx0 < x1))
+
+        # consecutive labels for the owned objects, others are removed
+        lut = numpy.zeros(nlabels+1, dtype=numpy.int32)
+        lut[1:][owned] = numpy.arange(1, owned.sum()+1)
+        return (ty0, tx0), lut[labels], int(owned.sum())
 
-        container = ccore.ImageMaskContainer(image, img_bin, self.params['removeborderobjects'])
+    @stopwatch()
+    def tiled_labels(self, image):
+        """Label image of the segmentation of overlapping tiles. Tiles are
+        segmented in parallel, each object belongs to the tile containing its
+        centroid. Objects are numbered in tile order, pixels claimed by
+        objects of different tiles belong to the first one."""
+        array = image.toArray(copy=False)
+        overlap = self._tile_overlap()
+        tiles = list(self._tiles(*array.shape))
+        label_max = numpy.iinfo(numpy.int16).max
+
+        labels = numpy.zeros(array.shape, dtype=numpy.int16)
+        sizes = [0]
+        pool = ThreadPool(self.params['tile_workers'])
+        try:
+            results = pool.imap(
+                lambda tile: self._segment_tile(array, tile, overlap), tiles)
+            for (ty0, tx0), tile_labels, nlabels in results:
+                offset = len(sizes) - 1
+                if offset + nlabels > label_max:
+                    raise RuntimeError(("Tiled segmentation: more than %d "
+                                        "objects per image") %label_max)
+                view = labels[ty0:ty0+tile_labels.shape[0],
+                              tx0:tx0+tile_labels.shape[1]]
+                mask = (tile_labels > 0) & (view == 0)
+                view[mask] = tile_labels[mask] + offset
+                sizes.extend(numpy.bincount(tile_labels[mask],
+                                            minlength=nlabels+1)[1:])
+        finally:
+            pool.close()
+            pool.join()
+
+        # objects completely covered by objects of other tiles
+        sizes = numpy.array(sizes)
+        if numpy.any(sizes[1:] == 0):
+            lut = numpy.zeros(sizes.size, dtype=numpy.int16)
+            lut[sizes > 0] = numpy.arange(1, numpy.count_nonzero(sizes)+1)
+            labels = lut[labels]
+        return ccore.numpy_to_image(labels, copy=True)
+
+    @stopwatch()
+    def _run(self, meta_image):
+        image = meta_image.image
+
+        if self.params['tiled'] and \
+                max(image.width, image.height) > self.params['tile_size']:
+            img_labels = self.tiled_labels(image)
+            container = ccore.ImageMaskContainer(image, img_labels,
+                                                 self.params['removeborderobjects'],
+                                                 True, True)
+        else:
+            img_bin = self.binary(image, meta_image.format)
+            container = ccore.ImageMaskContainer(image, img_bin, self.params['removeborderobjects'])
 
         self.postprocessing(container, self.params['postprocessing'],
                             (self.params['postprocessing_roisize_min'], self.params['postprocessing_roisize_max']),
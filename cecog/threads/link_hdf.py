@@ -12,72 +12,74 @@ __copyright__ = ('The CellCognition Project'
 __licence__ = 'LGPL'
 __url__ = 'www.cellcognition.org'
 
-from os.path import join, split, exists
+import os
+import tempfile
+from os.path import join, split, exists, isfile, abspath
 import h5py
 import logging
 
-def link_hdf5_files(post_hdf5_link_list):
-    logger = logging.getLogger()
-    
-    if len(post_hdf5_link_list) == 0:
-        return
-    
-    if post_hdf5_link_list[0] == 0:
-        return
+from cecog.io.manifest import replace_file
+from cecog.io.manifest import read_position_manifest
+from cecog.io.manifest import find_position_manifests
+
+ALL_POSITIONS_FILENAME = '_all_positions.ch5'
 
-    PLATE_PREFIX = '/sample/0/plate/'
-    WELL_PREFIX = PLATE_PREFIX + '%s/experiment/'
-    POSITION_PREFIX = WELL_PREFIX + '%s/position/'
+PLATE_PREFIX = '/sample/0/plate/'
+WELL_PREFIX = PLATE_PREFIX + '%s/experiment/'
+POSITION_PREFIX = WELL_PREFIX + '%s/position/'
 
-    def get_plate_and_postion(hf_file):
-        plate = hf_file[PLATE_PREFIX].keys()[0]
-        well = hf_file[WELL_PREFIX % plate].keys()[0]
-        position = hf_file[POSITION_PREFIX % (plate, well)].keys()[0]
-        return plate, well, position
 
-    all_pos_hdf5_filename = join(split(post_hdf5_link_list[0])[0],
-                                 '_all_positions.ch5')
+def link_hdf5_files(post_hdf5_link_list):
+    """(Re)build _all_positions.ch5 in the directory of the ch5 files.
 
-    if exists(all_pos_hdf5_filename):
-        f = h5py.File(all_pos_hdf5_filename, 'a')
-        ### This is dangerous, several processes open the file for writing...
-        logger.info(("_all_positons.hdf file found, "
-                     "trying to reuse it by overwrite old external links..."))
+    Only positions with a manifest (see cecog.io.manifest) are linked, i.e.
+    positions that finished, including those processed by other processes
+    or earlier runs. The file is written to a temporary file and renamed,
+    hence concurrent calls (e.g. cluster batch jobs) never write to the
+    same file and the last call leaves a file that links all positions finished at that time.
+    """
+    logger = logging.getLogger()
 
-        if 'definition' in f:
-            del f['definition']
-            f['definition'] = h5py.ExternalLink(post_hdf5_link_list[0],
-                                                '/definition')
+    if len(post_hdf5_link_list) == 0:
+        return
 
-        for fname in post_hdf5_link_list:
-            fh = h5py.File(fname, 'r')
-            fplate, fwell, fpos = get_plate_and_postion(fh)
-            fh.close()
+    if post_hdf5_link_list[0] == 0:
+        return
 
-            msg = "Linking into _all_positons.hdf:" + \
-                ((POSITION_PREFIX + '%s') % (fplate, fwell, fpos))
-            logger.info(msg)
-            if (POSITION_PREFIX + '%s') % (fplate, fwell, fpos) in f:
-                del f[(POSITION_PREFIX + '%s') % (fplate, fwell, fpos)]
-            f[(POSITION_PREFIX + '%s') % (fplate, fwell, fpos)] = \
-                h5py.ExternalLink(fname, (POSITION_PREFIX + '%s')
-                                  % (fplate, fwell, fpos))
-        f.close()
+    hdf5_dir = split(abspath(post_hdf5_link_list[0]))[0]
+    all_pos_hdf5_filename = join(hdf5_dir, ALL_POSITIONS_FILENAME)
 
-    else:
-        f = h5py.File(all_pos_hdf5_filename, 'w')
-        logger.info("_all_positons.hdf file created...")
+    positions = dict()
+    for manifest in find_position_manifests(hdf5_dir):
+        try:
+            plate, well, position, fname = read_position_manifest(manifest)
+        except (IOError, ValueError, KeyError):
+            logger.warning("Skipping unreadable manifest %s" %manifest)
+            continue
+        if isfile(fname):
+            positions[(POSITION_PREFIX + '%s') %(plate, well, position)] = \
+                fname
 
-        f['definition'] = h5py.ExternalLink(post_hdf5_link_list[0],'/definition')
+    if not positions:
+        logger.warning("No finished positions found in %s" %hdf5_dir)
+        return
 
-        for fname in post_hdf5_link_list:
-            fh = h5py.File(fname, 'r')
-            fplate, fwell, fpos = get_plate_and_postion(fh)
-            fh.close()
-            msg = "Linking into _all_positons.hdf:" + \
-                ((POSITION_PREFIX + '%s') % (fplate, fwell, fpos))
-            logger.info(msg)
-            f[(POSITION_PREFIX + '%s') % (fplate, fwell, fpos)] = \
-                h5py.ExternalLink(fname, (POSITION_PREFIX + '%s')
-                                  % (fplate, fwell, fpos))
-        f.close()
+    fd, tmpfile = tempfile.mkstemp(prefix=ALL_POSITIONS_FILENAME,
+                                   suffix='.tmp', dir=hdf5_dir)
+    os.close(fd)
+    try:
+        f = h5py.File(tmpfile, 'w')
+        try:
+            f['definition'] = h5py.ExternalLink(
+                sorted(positions.values())[0], '/definition')
+            for path, fname in sorted(positions.iteritems()):
+                f[path] = h5py.ExternalLink(fname, path)
+        finally:
+            f.close()
+        replace_file(tmpfile, all_pos_hdf5_filename)
+    except:
+        if exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    logger.info("_all_positons.hdf written, %d positions linked"
+                %len(positions))
@@ -55,9 +55,15 @@ class TrainingThread(CoreThread):
         if self._learner.has_nan_features():
             self._learner.filter_nans(apply=True)
 
+        processes = self._settings('Classification',
+                                   'svm_gridsearch_processes')
+        refine = self._settings('Classification', 'svm_gridsearch_refine')
+
         t0 = time.time()
         for info in self._learner.iterGridSearchSVM(c_info=c_info,
-                                                    g_info=g_info):
+                                                    g_info=g_info,
+                                                    processes=processes or None,
+                                                    refine=refine):
             n, log2c, log2g, conf = info
             status.update({'min': 1,
                            'max': n,
@@ -22,6 +22,7 @@ from cecog import CHANNEL_PREFIX, CH_PRIMARY, CH_OTHER, CH_VIRTUAL
 
 from cecog.traits.analyzer.section_core import SectionCore
 from cecog.gui.guitraits import StringTrait, BooleanTrait, SelectionTrait2
+from cecog.gui.guitraits import IntTrait
 
 class SectionClassification(SectionCore):
 
@@ -38,7 +39,11 @@ class SectionClassification(SectionCore):
                                  ('collectsamples_prefix', StringTrait('',100))]),
              ('merged_channel', [ ('merge_primary', BooleanTrait(True, label='primary')),
                                   ('merge_secondary', BooleanTrait(True, label='secondary')),
-                                  ('merge_tertiary', BooleanTrait(True, label='tertiary')) ])
+                                  ('merge_tertiary', BooleanTrait(True, label='tertiary')) ]),
+             ('svm_gridsearch', [ ('svm_gridsearch_processes',
+                                   IntTrait(0, 0, 256, label='Grid search processes (0 = all cores)')),
+                                  ('svm_gridsearch_refine',
+                                   BooleanTrait(False, label='Coarse-to-fine grid search')) ])
              ] + \
              [('%s_classification' %CH_VIRTUAL[0],
                [ ('%s_classification_envpath' %CH_VIRTUAL[0], \
@@ -51,6 +51,9 @@ class SectionGeneral(SectionCore):
         ('image_import_structurefile',
             BooleanTrait(False, label='Import via coordinate file',
                          widget_info=BooleanTrait.RADIOBUTTON)),
+        ('image_import_ch5',
+            BooleanTrait(False, label='Import from CellH5 files',
+                         widget_info=BooleanTrait.RADIOBUTTON)),
         ('namingscheme',
             SelectionTrait(CecogEnvironment.naming_schema.sections()[0],
                            CecogEnvironment.naming_schema.sections(),
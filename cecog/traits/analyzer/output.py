@@ -17,7 +17,9 @@ __source__ = '$URL$'
 __all__ = ['SectionOutput']
 
 from cecog.traits.analyzer.section_core import SectionCore
-from cecog.gui.guitraits import BooleanTrait, IntTrait
+from cecog.gui.guitraits import BooleanTrait, IntTrait, StringTrait, \
+    SelectionTrait
+from cecog.analyzer import CH5_CHUNK_LAYOUTS, CH5_IMAGE_COMPRESSIONS
 
 SECTION_NAME_OUTPUT = 'Output'
 
@@ -83,5 +85,28 @@ class SectionOutput(SectionCore):
         BooleanTrait(True, label='Enable gzip compression (recommended!)')),
        ('hdf5_merge_positions',
         BooleanTrait(True, label='Merge positions into one file')),
+       ('hdf5_write_buffer',
+        IntTrait(128, 0, 16384, label='Write buffer (MB, 0 = off)')),
+       ('hdf5_raw_images_chunks',
+        SelectionTrait(CH5_CHUNK_LAYOUTS[0], CH5_CHUNK_LAYOUTS,
+                       label='Chunk layout')),
+       ('hdf5_raw_images_compression',
+        SelectionTrait(CH5_IMAGE_COMPRESSIONS[0], CH5_IMAGE_COMPRESSIONS,
+                       label='Compression')),
+       ('hdf5_label_images_chunks',
+        SelectionTrait(CH5_CHUNK_LAYOUTS[0], CH5_CHUNK_LAYOUTS,
+                       label='Chunk layout')),
+       ('hdf5_label_images_compression',
+        SelectionTrait(CH5_IMAGE_COMPRESSIONS[0], CH5_IMAGE_COMPRESSIONS,
+                       label='Compression')),
+       ]),
+     ('image_cache',
+      [('image_cache',
+        BooleanTrait(False, label='Cache preprocessed images')),
+       ('image_cache_dir',
+        StringTrait('', 1000, label='Cache directory (empty = output directory)',
+                    widget_info=StringTrait.STRING_PATH)),
+       ('image_cache_size',
+        IntTrait(4096, 1, 1048576, label='Cache size (MB)')),
        ]),
      ]
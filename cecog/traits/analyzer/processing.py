@@ -18,7 +18,7 @@ __all__ = ['SectionProcessing']
 
 
 from cecog.traits.analyzer.section_core import SectionCore
-from cecog.gui.guitraits import BooleanTrait
+from cecog.gui.guitraits import BooleanTrait, IntTrait
 
 
 SECTION_NAME_PROCESSING = 'Processing'
@@ -63,6 +63,20 @@ class SectionProcessing(SectionCore):
              BooleanTrait(False, label='Classification')),
             ('merged_errorcorrection',
              BooleanTrait(False, label='Error correction')),
+
+            ('frame_workers',
+             IntTrait(1, 1, 64, label='Parallel frames per position')),
+            ('feature_workers',
+             IntTrait(1, 1, 64, label='Parallel feature extraction')),
+            ('prefetch_frames',
+             IntTrait(0, 0, 64, label='Frames read ahead')),
+            ('prefetch_memory',
+             IntTrait(512, 1, 65536, label='Read ahead memory (MB)')),
+            ('shared_image_memory',
+             IntTrait(0, 0, 65536,
+                      label='Shared image memory (MB, currently no benefit)')),
+            ('memmap_tiff',
+             BooleanTrait(False, label='Memory mapped multi-page tiff files')),
             ]
           )
          ]
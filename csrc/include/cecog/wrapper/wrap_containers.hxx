@@ -28,6 +28,7 @@
 #include <boost/python/args.hpp>
 
 #include "cecog/containers.hxx"
+#include "vigra/python_utility.hxx"
 
 using namespace boost::python;
 
@@ -35,7 +36,6 @@ namespace cecog
 {
   namespace python
   {
-    BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(apply_feature_overloads, applyFeature, 1, 2)
     BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(export_rgb_overloads, exportRGB, 1, 3)
     BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(draw_ellipse_overloads, drawEllipse, 4, 6)
     BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(connect_objects_overloads, connectObjects, 2, 4)
@@ -58,6 +58,15 @@ namespace cecog
       return result;
     }
 
+    // feature calculation does not touch python objects, hence containers
+    // of different regions can be processed in concurrent python threads
+    template <class OBJECT_CONTAINER>
+    int pyApplyFeature(OBJECT_CONTAINER &c, std::string name, bool force)
+    {
+      vigra::PyAllowThreads _pythread;
+      return c.applyFeature(name, force);
+    }
+
     template <class OBJECT_CONTAINER>
     list pyCrackCoordinates(OBJECT_CONTAINER &c, unsigned objId)
     {
@@ -76,12 +85,15 @@ void wrap_containers()
   using namespace cecog::python;
   typedef cecog::ObjectContainerBase<8> _ObjectContainerBase;
 
+  // applyFeature releases the GIL
+  scope().attr("FEATURES_RELEASE_GIL") = true;
+
   void (_ObjectContainerBase::*fx1)(std::vector<unsigned>, cecog::RGBValue, bool, bool, bool, bool) = &_ObjectContainerBase::markObjects;
   void (_ObjectContainerBase::*fx2)(cecog::RGBValue, bool, bool, bool, bool) = &_ObjectContainerBase::markObjects;
 
   class_< _ObjectContainerBase >("ObjectContainerBase")
-    .def("applyFeature", &_ObjectContainerBase::applyFeature,
-         apply_feature_overloads())
+    .def("applyFeature", &pyApplyFeature<_ObjectContainerBase>,
+         (arg("name"), arg("force")=false))
     .def("markObjects", fx1, mark_objects_overloads1(args("color", "quad", "showIds", "fill", "force")))
     .def("markObjects", fx2, mark_objects_overloads2(args("color", "quad", "showIds", "fill", "force")))
     .def("makeRGB", &_ObjectContainerBase::makeRGB)
@@ -0,0 +1,122 @@
+"""
+ch5chunks.py - benchmark of the chunk layouts of the hdf5 image datasets
+
+Writes a synthetic image dataset (c, t, z, y, x) one plane at a time, as
+TimeHolder does during the analysis, for each chunk layout and compression
+filter. Reports the write throughput, the file size and the latency of
+reading small crops over many frames, as the gallery and browser do.
+
+>>>ch5chunks.py -t 100 -s 1024 --crop 50 --frames 20
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from os.path import join, getsize
+
+import h5py
+import numpy as np
+
+try:
+    import cecog
+except ImportError:
+    sys.path.append(os.pardir)
+    import cecog
+
+from cecog.util.stopwatch import StopWatch
+from cecog.analyzer import CH5_CHUNK_LAYOUTS
+from cecog.analyzer.timeholder import chunk_size
+
+
+def images(shape, n=8, seed=None):
+    """Smooth random images with noise, i.e. compressible like micrographs.
+    Only n images are generated and reused to keep the image generation out
+    of the timing."""
+    rs = np.random.RandomState(seed)
+    c, t, z, y, x = shape
+    yy, xx = np.mgrid[0:y, 0:x]
+    return [(60 + 40*np.sin(xx/(17.+i) + i)*np.cos(yy/23.) +
+             rs.randint(0, 20, (y, x))).astype(np.uint8) for i in xrange(n)]
+
+def write(filename, shape, layout, compression, imgs):
+    c, t = shape[:2]
+    stopwatch = StopWatch(start=True)
+    f = h5py.File(filename, 'w')
+    try:
+        dset = f.create_dataset('channel', shape, 'uint8',
+                                chunks=chunk_size(shape, layout),
+                                compression=compression)
+        # one plane at a time, as written by the TimeHolder
+        for frame in xrange(t):
+            for channel in xrange(c):
+                dset[channel, frame, 0] = imgs[(frame+channel) % len(imgs)]
+    finally:
+        f.close()
+    return stopwatch.stop()
+
+def read_crops(filename, shape, crop, nframes, ncrops, seed=None):
+    """Mean time per crop of size crop x crop over nframes frames."""
+    rs = np.random.RandomState(seed)
+    c, t, z, y, x = shape
+    f = h5py.File(filename, 'r')
+    try:
+        dset = f['channel']
+        stopwatch = StopWatch(start=True)
+        for i in xrange(ncrops):
+            t0 = rs.randint(0, t-nframes+1)
+            y0 = rs.randint(0, y-crop+1)
+            x0 = rs.randint(0, x-crop+1)
+            dset[0, t0:t0+nframes, 0, y0:y0+crop, x0:x0+crop]
+        return stopwatch.stop()/ncrops
+    finally:
+        f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark of chunk layouts of hdf5 image datasets')
+    parser.add_argument('-c', '--channels', type=int, default=2,
+                        help='number of channels')
+    parser.add_argument('-t', '--nframes', type=int, default=100,
+                        help='number of frames')
+    parser.add_argument('-s', '--size', type=int, default=1024,
+                        help='image width and height')
+    parser.add_argument('--crop', type=int, default=50,
+                        help='crop size (gallery image size)')
+    parser.add_argument('--frames', type=int, default=20,
+                        help='frames per crop')
+    parser.add_argument('--ncrops', type=int, default=200,
+                        help='number of crops read')
+    args = parser.parse_args()
+
+    shape = (args.channels, args.nframes, 1, args.size, args.size)
+    nbytes = np.prod(shape)/1024.**2
+    imgs = images(shape, seed=1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print '%8s %6s %18s %12s %10s %14s' %('layout', 'filter', 'chunks',
+                                              'write (MB/s)', 'size (MB)',
+                                              'crop read (ms)')
+        for layout in CH5_CHUNK_LAYOUTS:
+            for compression in (None, 'lzf', 'gzip'):
+                filename = join(tmpdir, '%s_%s.ch5' %(layout, compression))
+                twrite = write(filename, shape, layout, compression, imgs)
+                tread = read_crops(filename, shape, args.crop, args.frames,
+                                   args.ncrops, seed=1)
+                print '%8s %6s %18s %12.1f %10.1f %14.2f' \
+                    %(layout, compression or 'none',
+                      'x'.join(map(str, chunk_size(shape, layout))),
+                      nbytes/twrite, getsize(filename)/1024.**2, tread*1000)
+                os.remove(filename)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,186 @@
+"""
+h5objects.py - benchmark of per-object vs. batched hdf5 object writes
+
+Writes synthetic image objects the way TimeHolder.apply_features does, once
+object by object (as up to version 1.6.0) and once as one hyperslab per
+dataset and frame. Reports objects per second and checks that both files
+contain identical data.
+
+>>>h5objects.py -n 2000 -t 20
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+import os
+import sys
+import zlib
+import base64
+import shutil
+import argparse
+import tempfile
+from os.path import join
+
+import h5py
+import numpy as np
+
+try:
+    import cecog
+except ImportError:
+    sys.path.append(os.pardir)
+    import cecog
+
+from cecog.util.stopwatch import StopWatch
+from cecog.analyzer.object import ImageObject, ObjectHolder, Orientation
+from cecog.analyzer.object import Region
+from cecog.analyzer.timeholder import structured_array
+
+
+DTYPES = {'bounding_box': np.dtype([('left', 'int32'), ('right', 'int32'),
+                                    ('top', 'int32'), ('bottom', 'int32')]),
+          'center': np.dtype([('x', 'int32'), ('y', 'int32')]),
+          'orientation': np.dtype([('angle', 'float'),
+                                   ('eccentricity', 'float')]),
+          'object': np.dtype([('time_idx', 'int32'),
+                              ('obj_label_id', 'int32')])}
+
+
+def random_holder(nobjects, nfeatures, size=1000, seed=None):
+    rs = np.random.RandomState(seed)
+    holder = ObjectHolder('primary')
+    holder.feature_names = ['f%03d' %i for i in xrange(nfeatures)]
+
+    for label in xrange(1, nobjects+1):
+        obj = ImageObject(iId=label)
+        x, y = rs.randint(10, size-10, 2)
+        obj.oCenterAbs = (x, y)
+        obj.oRoi = Region(tplCoords=(x-8, y-8, x+8, y+8))
+        obj.orientation = Orientation(rs.rand(), rs.rand())
+        obj.aFeatures = rs.rand(nfeatures)
+        angles = np.linspace(0, 2*np.pi, 32)
+        obj.crack_contour = zip((x + 8*np.cos(angles)).astype(int),
+                                (y + 8*np.sin(angles)).astype(int))
+        holder[label] = obj
+    return holder
+
+def create_datasets(filename, nfeatures, compression):
+    f = h5py.File(filename, 'w')
+    dsets = dict()
+    for name, dtype in DTYPES.iteritems():
+        dsets[name] = f.create_dataset(name, (0, ), dtype, chunks=True,
+                                       compression=compression,
+                                       maxshape=(None, ))
+    dsets['object_features'] = f.create_dataset(
+        'object_features', (0, nfeatures), 'float', chunks=True,
+        compression=compression, maxshape=(None, nfeatures))
+    dsets['crack_contour'] = f.create_dataset(
+        'crack_contour', (0, ), h5py.new_vlen(str), chunks=True,
+        compression=compression, maxshape=(None, ))
+    return f, dsets
+
+def resize(dsets, nobjects):
+    offset = len(dsets['object'])
+    for dset in dsets.itervalues():
+        dset.resize(nobjects + offset, axis=0)
+    return offset
+
+def encode_crack(crack_contour):
+    data = ','.join(map(str, np.array(crack_contour).flatten()))
+    return base64.b64encode(zlib.compress(data))
+
+def write_per_object(dsets, holder, frame_idx):
+    offset = resize(dsets, len(holder))
+    for idx, (obj_id, obj) in enumerate(holder.iteritems()):
+        dsets['bounding_box'][idx + offset] = \
+            (obj.oRoi.upperLeft[0], obj.oRoi.lowerRight[0],
+             obj.oRoi.upperLeft[1], obj.oRoi.lowerRight[1])
+        dsets['center'][idx + offset] = obj.oCenterAbs
+        dsets['orientation'][idx + offset] = \
+            (obj.orientation.angle, obj.orientation.eccentricity)
+        dsets['object'][idx + offset] = (frame_idx, obj_id)
+        dsets['object_features'][idx + offset] = obj.aFeatures
+        dsets['crack_contour'][idx + offset] = encode_crack(obj.crack_contour)
+
+def write_batched(dsets, holder, frame_idx):
+    nobjects = len(holder)
+    offset = resize(dsets, nobjects)
+    slab = slice(offset, offset + nobjects)
+
+    dsets['bounding_box'][slab] = structured_array(
+        DTYPES['bounding_box'], holder.bounding_boxes())
+    dsets['center'][slab] = structured_array(
+        DTYPES['center'], holder.centers())
+    dsets['orientation'][slab] = structured_array(
+        DTYPES['orientation'], holder.orientations())
+    dsets['object'][slab] = structured_array(
+        DTYPES['object'], np.column_stack((np.repeat(frame_idx, nobjects),
+                                           holder.labels)))
+    dsets['object_features'][slab] = holder.feature_matrix()
+
+    cracks = np.empty((nobjects, ), dtype=object)
+    for idx, obj in enumerate(holder.itervalues()):
+        cracks[idx] = encode_crack(obj.crack_contour)
+    dsets['crack_contour'][slab] = cracks
+
+def run(writer, filename, holders, nfeatures, compression):
+    f, dsets = create_datasets(filename, nfeatures, compression)
+    try:
+        stopwatch = StopWatch(start=True)
+        for frame_idx, holder in enumerate(holders):
+            writer(dsets, holder, frame_idx)
+        f.flush()
+        return stopwatch.stop()
+    finally:
+        f.close()
+
+def compare(file1, file2):
+    f1 = h5py.File(file1, 'r')
+    f2 = h5py.File(file2, 'r')
+    try:
+        for name in f1:
+            if not np.array_equal(f1[name][:], f2[name][:]):
+                return False
+        return True
+    finally:
+        f1.close()
+        f2.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark per-object vs. batched hdf5 object writes')
+    parser.add_argument('-n', '--nobjects', type=int, default=2000,
+                        help='number of objects per frame')
+    parser.add_argument('-t', '--nframes', type=int, default=10,
+                        help='number of frames')
+    parser.add_argument('-f', '--nfeatures', type=int, default=239,
+                        help='number of features per object')
+    parser.add_argument('--no-compression', action='store_true',
+                        help='disable gzip compression')
+    args = parser.parse_args()
+
+    compression = None if args.no_compression else 'gzip'
+    holders = [random_holder(args.nobjects, args.nfeatures, seed=i)
+               for i in xrange(args.nframes)]
+    ntotal = args.nobjects*args.nframes
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname1 = join(tmpdir, 'per_object.h5')
+        fname2 = join(tmpdir, 'batched.h5')
+        t1 = run(write_per_object, fname1, holders, args.nfeatures,
+                 compression)
+        t2 = run(write_batched, fname2, holders, args.nfeatures, compression)
+
+        print 'objects: %d (%d frames)' %(ntotal, args.nframes)
+        print 'per object: %10.1f objects/s' %(ntotal/t1)
+        print 'batched:    %10.1f objects/s' %(ntotal/t2)
+        print 'speedup:    %10.1fx' %(t1/t2)
+        print 'identical data: %s' %compare(fname1, fname2)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,162 @@
+"""
+imageobjects.py - memory footprint of image objects
+
+Compares the bytes per ImageObject of the former object layout (instance
+dict, crack contour as list of tuples, one feature array and one
+probability dict per object) with the slotted ImageObject whose features
+are row views of the ObjectHolder matrix. Sizes are the recursive
+sys.getsizeof of all objects reachable from an ImageObject, shared
+objects (e.g. small ints, the feature matrix) are counted once.
+
+>>>imageobjects.py -n 3000 -f 200 -c 60
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+try:
+    import cecog
+except ImportError:
+    sys.path.append(os.pardir)
+    import cecog
+
+from cecog.analyzer.object import ImageObject, ObjectHolder
+from cecog.analyzer.object import Region, Orientation
+
+
+class LegacyRegion(object):
+
+    def __init__(self, tplCoords):
+        self.upperLeft = (tplCoords[0], tplCoords[1])
+        self.lowerRight = (tplCoords[2], tplCoords[3])
+
+class LegacyOrientation(object):
+
+    def __init__(self, angle=np.nan, eccentricity=np.nan):
+        self.angle=angle
+        self.eccentricity=eccentricity
+
+class LegacyImageObject(object):
+    """ImageObject as up to version 1.6.0"""
+
+    def __init__(self, iId=None):
+        self.oCenterAbs = None
+        self.oRoi = None
+        self.iLabel = None
+        self.dctProb = {}
+        self.strClassName = None
+        self.strHexColor = None
+        self.iId = iId
+        self.aFeatures = None
+        self.crack_contour = None
+        self.file = None
+        self.roisize = None
+        self.signal = None
+        self.orientation = LegacyOrientation()
+
+
+def sizeof(obj, seen):
+    """Recursive size of obj, objects in seen are skipped."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, np.ndarray):
+        # views do not own their data
+        if obj.base is not None:
+            size += sizeof(obj.base, seen)
+        return size
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen)
+                    for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(sizeof(item, seen) for item in obj)
+
+    if hasattr(obj, '__dict__'):
+        size += sizeof(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(obj, name):
+                size += sizeof(getattr(obj, name), seen)
+    return size
+
+def contour(x, y, npoints):
+    angles = np.linspace(0, 2*np.pi, npoints)
+    return zip((x + 8*np.cos(angles)).astype(int).tolist(),
+               (y + 8*np.sin(angles)).astype(int).tolist())
+
+def legacy_objects(nobjects, nfeatures, npoints, rs):
+    objects = []
+    for label in xrange(1, nobjects+1):
+        obj = LegacyImageObject(iId=label)
+        x, y = rs.randint(100, 5000, 2).tolist()
+        obj.oCenterAbs = (x, y)
+        obj.oRoi = LegacyRegion((x-8, y-8, x+8, y+8))
+        obj.orientation = LegacyOrientation(rs.rand(), rs.rand())
+        obj.aFeatures = rs.rand(nfeatures)
+        obj.crack_contour = contour(x, y, npoints)
+        obj.iLabel = 1
+        obj.dctProb = {0: 0.1, 1: 0.8, 2: 0.1}
+        obj.strClassName = 'inter'
+        objects.append(obj)
+    return objects
+
+def compact_objects(nobjects, nfeatures, npoints, rs):
+    holder = ObjectHolder('primary')
+    holder.feature_names = ['f%03d' %i for i in xrange(nfeatures)]
+    for label in xrange(1, nobjects+1):
+        obj = ImageObject(iId=label)
+        x, y = rs.randint(100, 5000, 2).tolist()
+        obj.oCenterAbs = (x, y)
+        obj.oRoi = Region(tplCoords=(x-8, y-8, x+8, y+8))
+        obj.orientation = Orientation(rs.rand(), rs.rand())
+        obj.crack_contour = contour(x, y, npoints)
+        obj.iLabel = 1
+        obj.dctProb = {0: 0.1, 1: 0.8, 2: 0.1}
+        obj.strClassName = 'inter'
+        holder[label] = obj
+    holder.set_feature_matrix(rs.rand(nobjects, nfeatures))
+    return holder.values()
+
+def bytes_per_object(objects):
+    seen = set()
+    # interned class names and small ints are shared by all objects
+    sizeof('inter', seen)
+    return sum(sizeof(obj, seen) for obj in objects)/float(len(objects))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Memory footprint of image objects')
+    parser.add_argument('-n', '--nobjects', type=int, default=3000,
+                        help='number of objects per frame')
+    parser.add_argument('-f', '--nfeatures', type=int, default=200,
+                        help='number of features per object')
+    parser.add_argument('-c', '--contour', type=int, default=60,
+                        help='points of the crack contour')
+    args = parser.parse_args()
+
+    opts = (args.nobjects, args.nfeatures, args.contour)
+    before = bytes_per_object(legacy_objects(*opts, rs=np.random.RandomState(1)))
+    after = bytes_per_object(compact_objects(*opts, rs=np.random.RandomState(1)))
+    features = args.nfeatures*8
+
+    print '%22s %12s %12s' %('', 'bytes/object', 'w/o features')
+    print '%22s %12.0f %12.0f' %('before (dict, lists)', before,
+                                 before - features)
+    print '%22s %12.0f %12.0f' %('after (slots, arrays)', after,
+                                 after - features)
+    print '%22s %12.1f %12.1f' %('ratio', before/after,
+                                 (before - features)/(after - features))
@@ -0,0 +1,122 @@
+"""
+trackgraph.py - benchmark of the tracking graph
+
+Builds a tracking graph of synthetic lineages once with graphLib.Graph and
+string node ids (as up to version 1.6.0) and once with the array backed
+TrackGraph, reports the memory used by the graph structure (node data
+excluded) and the time of the adjacency queries issued by event selection.
+Both graphs must report the same topology.
+
+>>>trackgraph.py -n 1000 -t 200
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+import os
+import sys
+import argparse
+from array import array
+
+import numpy as np
+
+try:
+    import cecog
+except ImportError:
+    sys.path.append(os.pardir)
+    import cecog
+
+from cecog.util.stopwatch import StopWatch
+from cecog.extensions.graphLib import Graph
+from cecog.analyzer.trackgraph import TrackGraph, pack_nodeid
+
+
+def str_nodeid(frame, label):
+    return '%d_%s' %(frame, label)
+
+def build(graph, nodeid, nobjects, nframes, seed=None):
+    """Objects are linked to the object of the same label in the next frame,
+    a few objects split into two."""
+    rs = np.random.RandomState(seed)
+    stopwatch = StopWatch(start=True)
+    for label in xrange(1, nobjects+1):
+        graph.add_node(nodeid(0, label), label)
+    for frame in xrange(1, nframes):
+        for label in xrange(1, nobjects+1):
+            graph.add_node(nodeid(frame, label), label)
+        for label in xrange(1, nobjects+1):
+            graph.add_edge(nodeid(frame-1, label), nodeid(frame, label))
+        for label in rs.randint(1, nobjects, nobjects//50):
+            graph.add_edge(nodeid(frame-1, label), nodeid(frame, label+1))
+    return stopwatch.stop()
+
+def traverse(graph, nodes):
+    """Adjacency queries in the manner of EventSelection._linearize."""
+    stopwatch = StopWatch(start=True)
+    result = []
+    for node in nodes:
+        data = graph.node_data(node)
+        degree = (graph.in_degree(node), graph.out_degree(node))
+        tails = [graph.node_data(graph.tail(e)) for e in graph.out_arcs(node)]
+        result.append((data, degree, tails))
+    return stopwatch.stop(), result
+
+def sizeof(obj, seen=None):
+    """Recursive size of containers, strings and numbers in bytes."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen)
+                    for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(sizeof(item, seen) for item in obj)
+    return size
+
+def graph_size(graph):
+    if isinstance(graph, TrackGraph):
+        # node data is shared by both graphs and excluded
+        return sum(sizeof(getattr(graph, attr)) for attr in graph.__slots__
+                   if attr not in ('_node_data', 'edges')) + \
+                   sys.getsizeof(graph._node_data)
+    return sizeof(graph.nodes) + sizeof(graph.edges)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark graphLib.Graph vs. TrackGraph')
+    parser.add_argument('-n', '--nobjects', type=int, default=1000,
+                        help='number of objects per frame')
+    parser.add_argument('-t', '--nframes', type=int, default=200,
+                        help='number of frames')
+    args = parser.parse_args()
+
+    graph1 = Graph()
+    graph2 = TrackGraph()
+    b1 = build(graph1, str_nodeid, args.nobjects, args.nframes, seed=1)
+    b2 = build(graph2, pack_nodeid, args.nobjects, args.nframes, seed=1)
+
+    nodes1 = [str_nodeid(f, l) for f in xrange(args.nframes)
+              for l in xrange(1, args.nobjects+1)]
+    nodes2 = [pack_nodeid(f, l) for f in xrange(args.nframes)
+              for l in xrange(1, args.nobjects+1)]
+    t1, result1 = traverse(graph1, nodes1)
+    t2, result2 = traverse(graph2, nodes2)
+
+    m1 = graph_size(graph1)/1024.**2
+    m2 = graph_size(graph2)/1024.**2
+
+    print 'nodes: %d, edges: %d' %(graph2.number_of_nodes(),
+                                   graph2.number_of_edges())
+    print '%12s %10s %10s %12s' %('', 'build (s)', 'query (s)', 'memory (MB)')
+    print '%12s %10.3f %10.3f %12.1f' %('graphLib', b1, t1, m1)
+    print '%12s %10.3f %10.3f %12.1f' %('TrackGraph', b2, t2, m2)
+    print 'identical topology: %s' %(result1 == result2)
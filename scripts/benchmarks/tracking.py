@@ -0,0 +1,145 @@
+"""
+tracking.py - regression check and benchmark of the tracking candidate search
+
+Compares Tracker.find_candidates (kd-tree) with the former brute force
+search on synthetic point clouds. Merge and split candidate lists and the
+resulting tracking graphs must be identical. Timings are reported for
+increasing numbers of objects per frame.
+
+>>>tracking.py -n 100 1000 10000
+"""
+
+__author__ = 'rudolf.hoefler@gmail.com'
+__copyright__ = ('The CellCognition Project'
+                 'Copyright (c) 2006 - 2012'
+                 'Gerlich Lab, IMBA Vienna, Austria'
+                 'see AUTHORS.txt for contributions')
+__licence__ = 'LGPL'
+__url__ = 'www.cellcognition.org'
+
+import os
+import sys
+import math
+import argparse
+
+import numpy as np
+
+try:
+    import cecog
+except ImportError:
+    sys.path.append(os.pardir)
+    import cecog
+
+from cecog.util.stopwatch import StopWatch
+from cecog.analyzer.object import ImageObject, ObjectHolder
+from cecog.analyzer.tracker import Tracker
+
+
+def find_candidates_bruteforce(tracker, iPreviousT, iT):
+    """Candidate search as up to version 1.6.0, O(N^2) per frame."""
+    max_dist2 = math.pow(tracker.max_object_distance, 2)
+    dctMerges = {}
+    dctSplits = {}
+
+    for iObjIdP in tracker.frames[iPreviousT]:
+        strNodeIdP = tracker.node_id(iPreviousT, iObjIdP)
+        oImageObjectP = tracker.graph.node_data(strNodeIdP)
+
+        lstNearest = []
+        for iObjIdC in tracker.frames[iT]:
+            strNodeIdC = tracker.node_id(iT, iObjIdC)
+            oImageObjectC = tracker.graph.node_data(strNodeIdC)
+            dist = oImageObjectC.squaredMagnitude(oImageObjectP)
+            if dist < max_dist2:
+                lstNearest.append((dist, strNodeIdC))
+
+        if len(lstNearest) > 0:
+            lstNearest.sort(key=lambda x: x[0])
+            for dist, strNodeIdC in lstNearest[:tracker.max_node_degree]:
+                dctMerges.setdefault(strNodeIdC, []).append((dist, strNodeIdP))
+                dctSplits.setdefault(strNodeIdP, []).append((dist, strNodeIdC))
+
+    return dctMerges, dctSplits
+
+
+class BruteForceTracker(Tracker):
+
+    def find_candidates(self, iPreviousT, iT):
+        return find_candidates_bruteforce(self, iPreviousT, iT)
+
+
+def random_frames(nobjects, nframes, size, step=5, seed=None):
+    """Random walk of nobjects integer centers, some objects vanish and
+    appear in each frame. Duplicate positions produce distance ties."""
+    rs = np.random.RandomState(seed)
+    centers = rs.randint(0, size, (nobjects, 2))
+    frames = []
+    for frame in xrange(nframes):
+        holder = ObjectHolder('primary')
+        centers += rs.randint(-step, step+1, centers.shape)
+        keep = rs.rand(nobjects) > 0.05
+        for label, (x, y) in enumerate(centers[keep], start=1):
+            obj = ImageObject(iId=label)
+            obj.oCenterAbs = (int(x), int(y))
+            holder[label] = obj
+        frames.append(holder)
+    return frames
+
+def track(tracker, frames):
+    stopwatch = StopWatch(start=True)
+    for frame, holder in enumerate(frames):
+        tracker.track_next_frame(frame, holder)
+    return stopwatch.stop()
+
+def edges(tracker):
+    return [edge[:2] for edge in tracker.graph.edges.itervalues()]
+
+def check_candidates(frames, max_distance, max_degree):
+    tracker = Tracker(max_distance, max_degree)
+    track(tracker, frames)
+    for iT in tracker.frames.keys()[1:]:
+        iPreviousT = tracker.closest_preceding_frame(iT)
+        if iPreviousT is None:
+            continue
+        if tracker.find_candidates(iPreviousT, iT) != \
+                find_candidates_bruteforce(tracker, iPreviousT, iT):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the tracking candidate search')
+    parser.add_argument('-n', '--nobjects', type=int, nargs='+',
+                        default=[100, 1000, 2000, 5000, 10000],
+                        help='number of objects per frame')
+    parser.add_argument('-t', '--nframes', type=int, default=5,
+                        help='number of frames')
+    parser.add_argument('-d', '--max-distance', type=int, default=30,
+                        help='max. object distance')
+    parser.add_argument('--max-degree', type=int, default=3,
+                        help='max. node degree')
+    parser.add_argument('--skip-bruteforce', type=int, default=2000,
+                        help=('no brute force tracking above this number '
+                              'of objects'))
+    args = parser.parse_args()
+
+    print '%8s %12s %12s %8s %10s' %('objects', 'kd-tree (s)',
+                                     'brute (s)', 'speedup', 'identical')
+    for nobjects in args.nobjects:
+        # constant density of objects
+        size = int(np.sqrt(nobjects)*40)
+        frames = random_frames(nobjects, args.nframes, size, seed=nobjects)
+
+        tracker = Tracker(args.max_distance, args.max_degree)
+        t1 = track(tracker, frames)
+
+        if nobjects <= args.skip_bruteforce:
+            reference = BruteForceTracker(args.max_distance, args.max_degree)
+            t2 = track(reference, frames)
+            identical = edges(tracker) == edges(reference) and \
+                check_candidates(frames, args.max_distance, args.max_degree)
+            print '%8d %12.3f %12.3f %7.1fx %10s' %(nobjects, t1, t2, t2/t1,
+                                                    identical)
+        else:
+            print '%8d %12.3f %12s %8s %10s' %(nobjects, t1, '-', '-', '-')
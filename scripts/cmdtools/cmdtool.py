@@ -280,7 +280,7 @@ class ImageProcessor(object):
                 obj.iLabel, prob = classifier.predict(obj.aFeatures,
                                                    holder.feature_names)
 
-                obj.strClassNames = classifier.class_names[obj.iLabel]
+                obj.strClassName = classifier.class_names[obj.iLabel]
                 objects.append(obj)
                 probs.append(prob)
 